@@ -4,3 +4,24 @@ from django.apps import AppConfig
 class CourseinfoConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'courseinfo'
+
+    def ready(self):
+        from django.db.backends.signals import connection_created
+
+        from courseinfo import (
+            backends,
+            deadlines,
+            identitymap,
+            instrumentation,
+            refdata,
+            slowlog,
+            sqlite,
+            versions)
+        instrumentation.install()
+        versions.connect_signals()
+        backends.connect_signals()
+        refdata.connect_signals()
+        identitymap.connect_signals()
+        connection_created.connect(sqlite.configure_connection)
+        connection_created.connect(slowlog.install_on_connection)
+        connection_created.connect(deadlines.install_on_connection)
@@ -0,0 +1,84 @@
+"""
+Query helpers for the async views.
+
+Django's async queryset methods (aget(), acount(), async for) run through
+sync_to_async with thread_sensitive=True, i.e. on the single thread a
+request's sync code uses, so queries awaited together with
+asyncio.gather() still run one after the other. fetch() and count() run a
+queryset on a worker thread of their own instead, so the independent
+queries of a page overlap with each other and with an aget() on the request
+thread. Workers close their connections as a finished request would (see
+close_old_connections), so they neither outlive CONN_MAX_AGE nor keep
+reading an old replica snapshot. The workers are a pool of their own, so
+the number of queries in flight is COURSEINFO_ASYNC_DB_THREADS rather than
+the event loop's default executor size.
+
+Execute wrappers that the middleware pushes on the request's default
+connection (query metrics, Server-Timing, trace spans) are recorded by
+capture_request_wrappers() and pushed on the worker's connection as well.
+"""
+import contextvars
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, close_old_connections, connections
+from django.http import Http404
+
+_request_wrappers = contextvars.ContextVar('courseinfo_request_execute_wrappers', default=())
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def executor():
+    """The worker threads, COURSEINFO_ASYNC_DB_THREADS of them."""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                getattr(settings, 'COURSEINFO_ASYNC_DB_THREADS', 16),
+                thread_name_prefix='asyncdb')
+    return _executor
+
+
+def capture_request_wrappers():
+    """Record the request's execute wrappers; call on the request's thread."""
+    connection = connections[DEFAULT_DB_ALIAS]
+    # connection_created receivers install their own wrappers first
+    connection.ensure_connection()
+    _request_wrappers.set(tuple(connection.execute_wrappers))
+
+
+def _in_worker(function, using):
+    def run(*args):
+        wrappers = _request_wrappers.get() if using == DEFAULT_DB_ALIAS else ()
+        try:
+            with ExitStack() as stack:
+                if wrappers:
+                    connection = connections[using]
+                    connection.ensure_connection()
+                    # skip the wrappers this connection installed itself
+                    for wrapper in wrappers[len(connection.execute_wrappers):]:
+                        stack.enter_context(connection.execute_wrapper(wrapper))
+                return function(*args)
+        finally:
+            close_old_connections()
+    return sync_to_async(run, thread_sensitive=False, executor=executor())
+
+
+async def fetch(queryset):
+    """Evaluate a queryset on a worker thread and return its rows as a list."""
+    return await _in_worker(list, queryset.db)(queryset)
+
+
+async def count(queryset):
+    return await _in_worker(queryset.count, queryset.db)()
+
+
+async def get_object_or_404(queryset, **lookup):
+    try:
+        return await queryset.aget(**lookup)
+    except queryset.model.DoesNotExist:
+        raise Http404('No %s matches the given query.' % queryset.model._meta.object_name)
@@ -0,0 +1,158 @@
+"""
+Authentication backend that keeps resolved permission sets in a shared cache.
+
+ModelBackend loads a user's direct and group permissions with two joined
+queries on every request. CachedModelBackend keeps, in the
+COURSEINFO_PERMISSION_CACHE cache, each user's direct permissions, each
+user's group ids and each group's permissions, so a request with warm
+entries runs no permission queries. Entries are deleted when group
+membership or the permission relations change (connect_signals()).
+"""
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.backends import ModelBackend
+from django.contrib.auth.models import Group, Permission
+from django.core.cache import caches
+from django.db.models.signals import m2m_changed, post_delete, post_migrate, post_save
+
+KEY_PREFIX = 'courseinfo:perms:'
+ALL_PERMISSIONS_KEY = KEY_PREFIX + 'all'
+
+
+def _cache():
+    return caches[getattr(settings, 'COURSEINFO_PERMISSION_CACHE', 'default')]
+
+
+def _timeout():
+    return getattr(settings, 'COURSEINFO_PERMISSION_CACHE_TIMEOUT', 3600)
+
+
+def user_key(pk):
+    return '%suser:%s' % (KEY_PREFIX, pk)
+
+
+def user_groups_key(pk):
+    return '%suser-groups:%s' % (KEY_PREFIX, pk)
+
+
+def group_key(pk):
+    return '%sgroup:%s' % (KEY_PREFIX, pk)
+
+
+def _names(perms):
+    return {'%s.%s' % (app_label, codename) for app_label, codename in perms}
+
+
+class CachedModelBackend(ModelBackend):
+    def _cached(self, key, load):
+        cache = _cache()
+        value = cache.get(key)
+        if value is None:
+            value = load()
+            cache.set(key, value, _timeout())
+        return value
+
+    def _load_user_permissions(self, user_obj):
+        return _names(self._get_user_permissions(user_obj)
+                      .values_list('content_type__app_label', 'codename').order_by())
+
+    def _load_all_permissions(self):
+        return _names(Permission.objects
+                      .values_list('content_type__app_label', 'codename').order_by())
+
+    def _group_permissions(self, user_obj):
+        group_ids = self._cached(
+            user_groups_key(user_obj.pk),
+            lambda: list(user_obj.groups.values_list('pk', flat=True)))
+        if not group_ids:
+            return set()
+        cache = _cache()
+        found = cache.get_many([group_key(pk) for pk in group_ids])
+        missing = [pk for pk in group_ids if group_key(pk) not in found]
+        if missing:
+            loaded = {group_key(pk): set() for pk in missing}
+            for pk, app_label, codename in (
+                    Permission.objects.filter(group__in=missing)
+                    .values_list('group', 'content_type__app_label', 'codename').order_by()):
+                loaded[group_key(pk)].add('%s.%s' % (app_label, codename))
+            cache.set_many(loaded, _timeout())
+            found.update(loaded)
+        return set().union(*found.values())
+
+    def _get_permissions(self, user_obj, obj, from_name):
+        if not user_obj.is_active or user_obj.is_anonymous or obj is not None:
+            return set()
+        perm_cache_name = '_%s_perm_cache' % from_name
+        if not hasattr(user_obj, perm_cache_name):
+            if user_obj.is_superuser:
+                perms = self._cached(ALL_PERMISSIONS_KEY, self._load_all_permissions)
+            elif from_name == 'user':
+                perms = self._cached(
+                    user_key(user_obj.pk), lambda: self._load_user_permissions(user_obj))
+            else:
+                perms = self._group_permissions(user_obj)
+            setattr(user_obj, perm_cache_name, perms)
+        return getattr(user_obj, perm_cache_name)
+
+
+def _m2m_receiver(forward_key, reverse_key, reverse_accessor):
+    """
+    Receiver for m2m_changed on one of the permission relations. The
+    forward side's instance owns the cached entry; on the reverse side the
+    entries of the related objects in pk_set (or, for clear(), of those
+    related before the clear) are deleted.
+    """
+    def receiver(sender, instance, action, reverse, pk_set, **kwargs):
+        if not reverse:
+            if action.startswith('post_'):
+                _cache().delete(forward_key(instance.pk))
+            return
+        if action == 'pre_clear':
+            instance._courseinfo_cleared_pks = list(
+                getattr(instance, reverse_accessor).values_list('pk', flat=True))
+        elif action == 'post_clear':
+            pks = instance.__dict__.pop('_courseinfo_cleared_pks', [])
+            _cache().delete_many([reverse_key(pk) for pk in pks])
+        elif action.startswith('post_'):
+            _cache().delete_many([reverse_key(pk) for pk in pk_set])
+    return receiver
+
+
+_user_groups_changed = _m2m_receiver(user_groups_key, user_groups_key, 'user_set')
+_user_permissions_changed = _m2m_receiver(user_key, user_key, 'user_set')
+_group_permissions_changed = _m2m_receiver(group_key, group_key, 'group_set')
+
+
+def _user_deleted(sender, instance, **kwargs):
+    _cache().delete_many([user_key(instance.pk), user_groups_key(instance.pk)])
+
+
+def _group_deleted(sender, instance, **kwargs):
+    _cache().delete(group_key(instance.pk))
+
+
+def _permission_changed(sender, instance, **kwargs):
+    _cache().delete(ALL_PERMISSIONS_KEY)
+
+
+def _migrated(sender, **kwargs):
+    # create_permissions() adds new permissions with bulk_create(), which
+    # sends no post_save
+    _cache().delete(ALL_PERMISSIONS_KEY)
+
+
+def connect_signals():
+    User = get_user_model()
+    m2m_changed.connect(_user_groups_changed, sender=User.groups.through,
+                        dispatch_uid='courseinfo_perms_user_groups')
+    m2m_changed.connect(_user_permissions_changed, sender=User.user_permissions.through,
+                        dispatch_uid='courseinfo_perms_user_permissions')
+    m2m_changed.connect(_group_permissions_changed, sender=Group.permissions.through,
+                        dispatch_uid='courseinfo_perms_group_permissions')
+    post_delete.connect(_user_deleted, sender=User, dispatch_uid='courseinfo_perms_user_deleted')
+    post_delete.connect(_group_deleted, sender=Group, dispatch_uid='courseinfo_perms_group_deleted')
+    post_save.connect(_permission_changed, sender=Permission,
+                      dispatch_uid='courseinfo_perms_permission_saved')
+    post_delete.connect(_permission_changed, sender=Permission,
+                        dispatch_uid='courseinfo_perms_permission_deleted')
+    post_migrate.connect(_migrated, dispatch_uid='courseinfo_perms_migrated')
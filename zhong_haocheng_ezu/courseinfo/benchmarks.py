@@ -0,0 +1,90 @@
+"""
+Shared setup for the bench_* management commands: a throwaway test
+database filled with synthetic courseinfo data and a logged-in client.
+"""
+import time
+from contextlib import contextmanager
+
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test import Client
+from django.test.utils import override_settings
+
+from courseinfo import querycache
+from courseinfo.models import (
+    Course,
+    Instructor,
+    Period,
+    Registration,
+    Section,
+    Semester,
+    Student,
+    Year)
+
+
+@contextmanager
+def benchmark_database():
+    """Create a test database for the duration of the block."""
+    old_name = connection.settings_dict['NAME']
+    connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+    try:
+        yield
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+
+
+@contextmanager
+def uncached():
+    """Turn the page and query-result caches off, so requests run the views."""
+    max_bytes = querycache.result_cache.max_bytes
+    querycache.result_cache.max_bytes = 0
+    querycache.result_cache.clear()
+    try:
+        with override_settings(COURSEINFO_PAGE_CACHE_TIMEOUT=0):
+            yield
+    finally:
+        querycache.result_cache.max_bytes = max_bytes
+
+
+def populate(sections=20, students=200, registrations_per_section=20):
+    """Fill the (test) database with one semester of synthetic data."""
+    year = Year.objects.create(year=2023)
+    period = Period.objects.create(period_sequence=1, period_name='Spring')
+    semester = Semester.objects.create(year=year, period=period)
+    instructors = Instructor.objects.bulk_create(
+        Instructor(first_name='First%d' % i, last_name='Instructor%d' % i)
+        for i in range(max(1, sections // 5)))
+    courses = Course.objects.bulk_create(
+        Course(course_number='C%04d' % i, course_name='Course %d' % i)
+        for i in range(sections))
+    student_list = Student.objects.bulk_create(
+        Student(first_name='First%d' % i, last_name='Student%d' % i)
+        for i in range(students))
+    section_list = Section.objects.bulk_create(
+        Section(section_name='%03d' % (i % 3 + 1), semester=semester,
+                course=courses[i], instructor=instructors[i % len(instructors)])
+        for i in range(sections))
+    Registration.objects.bulk_create(
+        Registration(section=section,
+                     student=student_list[(i * registrations_per_section + j) % students])
+        for i, section in enumerate(section_list)
+        for j in range(min(registrations_per_section, students)))
+    return semester
+
+
+def staff_client():
+    user = get_user_model().objects.create_superuser(
+        'benchmark', 'benchmark@example.com', 'benchmark')
+    client = Client(HTTP_HOST='localhost')
+    client.force_login(user)
+    return client
+
+
+def timed_requests(client, url, count):
+    """Issue `count` GETs and return requests per second."""
+    start = time.perf_counter()
+    for i in range(count):
+        response = client.get(url)
+        if response.status_code != 200:
+            raise RuntimeError('GET %s returned %d' % (url, response.status_code))
+    return count / (time.perf_counter() - start)
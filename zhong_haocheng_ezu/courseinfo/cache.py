@@ -0,0 +1,45 @@
+"""
+Cache backends that count hits and misses in courseinfo.metrics.
+
+Use them in CACHES in place of the stock Django backends; the metrics
+label is the cache's METRICS_LABEL, or its LOCATION when none is given.
+"""
+from django.core.cache.backends import filebased, locmem
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
+
+from courseinfo import metrics, tracing
+
+_MISSING = object()
+
+
+class InstrumentedCacheMixin:
+    def __init__(self, location, params):
+        super().__init__(location, params)
+        self.metrics_label = params.get('METRICS_LABEL') or location or 'default'
+
+    def get(self, key, default=None, version=None):
+        with tracing.span('cache.get', **{'cache.name': self.metrics_label}) as span:
+            value = super().get(key, _MISSING, version)
+        if value is _MISSING:
+            metrics.CACHE_REQUESTS.inc(self.metrics_label, 'miss')
+            return default
+        if span is not None:
+            span.attributes['cache.hit'] = True
+        metrics.CACHE_REQUESTS.inc(self.metrics_label, 'hit')
+        return value
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        with tracing.span('cache.set', **{'cache.name': self.metrics_label}):
+            return super().set(key, value, timeout, version)
+
+    def delete(self, key, version=None):
+        with tracing.span('cache.delete', **{'cache.name': self.metrics_label}):
+            return super().delete(key, version)
+
+
+class LocMemCache(InstrumentedCacheMixin, locmem.LocMemCache):
+    pass
+
+
+class FileBasedCache(InstrumentedCacheMixin, filebased.FileBasedCache):
+    pass
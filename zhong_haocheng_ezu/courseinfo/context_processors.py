@@ -0,0 +1,55 @@
+"""
+Template context for the courseinfo navigation and action buttons.
+
+navigation() resolves the user's permission set once per request (from
+the permission cache, see courseinfo.backends) into `courseinfo_nav`, the
+list of nav entries the user may see, and `courseinfo_actions`, a
+{model: {action: bool}} mapping, so templates check permissions with
+dictionary lookups instead of one perms.courseinfo.* lookup per check.
+"""
+from functools import lru_cache
+
+from django.urls import get_script_prefix, reverse
+from django.utils.functional import SimpleLazyObject
+
+MODELS = ('instructor', 'section', 'course', 'semester', 'student', 'registration')
+ACTIONS = ('view', 'add', 'change', 'delete')
+NAV_LABELS = {
+    'instructor': 'Instructors',
+    'section': 'Sections',
+    'course': 'Courses',
+    'semester': 'Semesters',
+    'student': 'Students',
+    'registration': 'Registrations',
+}
+
+
+@lru_cache(maxsize=None)
+def _list_urls(script_prefix):
+    return {model: reverse('courseinfo_%s_list_urlpattern' % model) for model in MODELS}
+
+
+def allowed_actions(user):
+    permissions = user.get_all_permissions()
+    return {
+        model: {action: 'courseinfo.%s_%s' % (action, model) in permissions
+                for action in ACTIONS}
+        for model in MODELS
+    }
+
+
+def navigation(request):
+    user = getattr(request, 'user', None)
+    if user is None:
+        return {}
+    actions = SimpleLazyObject(lambda: allowed_actions(user))
+
+    def nav_entries():
+        urls = _list_urls(get_script_prefix())
+        return [{'label': NAV_LABELS[model], 'url': urls[model]}
+                for model in MODELS if actions[model]['view']]
+
+    return {
+        'courseinfo_actions': actions,
+        'courseinfo_nav': SimpleLazyObject(nav_entries),
+    }
@@ -0,0 +1,82 @@
+"""
+Statement deadlines for SQLite.
+
+A deadline is a monotonic time after which running statements are
+aborted. install_on_connection() registers a progress handler on every
+SQLite connection that SQLite calls every PROGRESS_INTERVAL virtual machine
+instructions; once the current context's deadline has passed the handler
+makes SQLite interrupt the statement, which releases its locks at once.
+StatementDeadlineMiddleware sets a deadline for each request, from the
+view's `statement_timeout` attribute or COURSEINFO_STATEMENT_TIMEOUT, and
+answers requests that ran past it with a 503 and a Retry-After header.
+"""
+import contextvars
+import time
+from contextlib import contextmanager
+
+from django.db import OperationalError
+
+PROGRESS_INTERVAL = 10000
+
+_deadline = contextvars.ContextVar('courseinfo_statement_deadline', default=None)
+
+
+class StatementTimeout(OperationalError):
+    """A statement was interrupted because its deadline passed."""
+
+
+def set_deadline(seconds):
+    """Abort statements running `seconds` from now; returns a reset token."""
+    return _deadline.set(None if seconds is None else time.monotonic() + seconds)
+
+
+def reset_deadline(token):
+    _deadline.reset(token)
+
+
+@contextmanager
+def deadline(seconds):
+    token = set_deadline(seconds)
+    try:
+        yield
+    finally:
+        reset_deadline(token)
+
+
+def expired():
+    current = _deadline.get()
+    return current is not None and time.monotonic() > current
+
+
+def _progress_handler():
+    # a non-zero return value interrupts the running statement
+    return expired()
+
+
+def is_timeout(error):
+    """Whether an exception is a statement interrupted by its deadline."""
+    if isinstance(error, StatementTimeout):
+        return True
+    return isinstance(error, OperationalError) and 'interrupted' in str(error) and expired()
+
+
+def statement_timeout_wrapper(execute, sql, params, many, context):
+    """Execute wrapper turning interrupted statements into StatementTimeout."""
+    try:
+        return execute(sql, params, many, context)
+    except OperationalError as error:
+        if is_timeout(error):
+            raise StatementTimeout('Statement deadline exceeded: %s' % sql[:200]) from error
+        raise
+
+
+def install_on_connection(sender, connection, **kwargs):
+    """connection_created receiver for SQLite databases."""
+    if connection.vendor != 'sqlite':
+        return
+    connection.connection.set_progress_handler(_progress_handler, PROGRESS_INTERVAL)
+    if statement_timeout_wrapper not in connection.execute_wrappers:
+        # outermost, like the slow query log (Django applies
+        # execute_wrappers[0] first): request-scoped wrappers are pushed
+        # and popped at the end
+        connection.execute_wrappers.insert(0, statement_timeout_wrapper)
@@ -1,8 +1,33 @@
 from django import forms
+from django.forms.models import ModelChoiceIterator
 
+from courseinfo import refdata
 from courseinfo.models import Instructor, Section, Course, Semester, Student, Registration
 
 
+class ReferenceChoiceIterator(ModelChoiceIterator):
+    def __iter__(self):
+        if self.field.empty_label is not None:
+            yield ('', self.field.empty_label)
+        for obj in self.field.table.all():
+            yield self.choice(obj)
+
+    def __len__(self):
+        return len(self.field.table.all()) + (self.field.empty_label is not None)
+
+    def __bool__(self):
+        return self.field.empty_label is not None or bool(self.field.table.all())
+
+
+class ReferenceChoiceField(forms.ModelChoiceField):
+    """A ModelChoiceField whose choices come from a refdata.ReferenceTable."""
+    iterator = ReferenceChoiceIterator
+
+    def __init__(self, table, **kwargs):
+        self.table = table
+        super().__init__(queryset=table.model._default_manager.all(), **kwargs)
+
+
 class InstructorForm(forms.ModelForm):
     class Meta:
         model = Instructor
@@ -44,6 +69,9 @@ class CourseForm(forms.ModelForm):
 
 
 class SemesterForm(forms.ModelForm):
+    year = ReferenceChoiceField(refdata.years)
+    period = ReferenceChoiceField(refdata.periods)
+
     class Meta:
         model = Semester
         fields = '__all__'
@@ -0,0 +1,115 @@
+"""
+Request-scoped identity map for the courseinfo models.
+
+While IdentityMapMiddleware has a map active, every fully loaded instance
+of an IdentityMapModel (including the ones select_related() builds from
+joined rows) is remembered by (model, pk), and IdentityMapForeignKey
+descriptors look the related object up there before querying. A given row
+is then fetched at most once per request however its FKs are reached.
+Saves replace and deletes evict map entries; queryset updates evict the
+whole model.
+"""
+import contextvars
+from contextlib import contextmanager
+
+from django.db import models
+from django.db.models.fields.related_descriptors import ForwardManyToOneDescriptor
+from django.db.models.signals import post_delete, post_save
+
+_map = contextvars.ContextVar('courseinfo_identity_map', default=None)
+
+
+def activate():
+    return _map.set({})
+
+
+def deactivate(token):
+    _map.reset(token)
+
+
+@contextmanager
+def active():
+    token = activate()
+    try:
+        yield
+    finally:
+        deactivate(token)
+
+
+def _key(model, pk):
+    return model._meta.concrete_model, pk
+
+
+def get(model, pk):
+    identity_map = _map.get()
+    if identity_map is None or pk is None:
+        return None
+    return identity_map.get(_key(model, pk))
+
+
+def add(instance):
+    identity_map = _map.get()
+    if (identity_map is not None and instance.pk is not None
+            and not instance.get_deferred_fields()):
+        identity_map[_key(type(instance), instance.pk)] = instance
+
+
+def discard(model, pk):
+    identity_map = _map.get()
+    if identity_map is not None:
+        identity_map.pop(_key(model, pk), None)
+
+
+def discard_model(model):
+    identity_map = _map.get()
+    if identity_map is not None:
+        concrete_model = model._meta.concrete_model
+        for key in [key for key in identity_map if key[0] is concrete_model]:
+            del identity_map[key]
+
+
+class IdentityMapModel(models.Model):
+    """Abstract base for models whose loaded instances enter the map."""
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        add(instance)
+        return instance
+
+    class Meta:
+        abstract = True
+
+
+class IdentityMapDescriptor(ForwardManyToOneDescriptor):
+    def get_object(self, instance):
+        if self.field.target_field.primary_key:
+            related = get(self.field.remote_field.model, getattr(instance, self.field.attname))
+            if related is not None:
+                return related
+        return super().get_object(instance)
+
+
+class IdentityMapForeignKey(models.ForeignKey):
+    """A ForeignKey whose descriptor checks the identity map first."""
+    forward_related_accessor_class = IdentityMapDescriptor
+
+    def deconstruct(self):
+        # identical to a ForeignKey in the database; keep migrations unchanged
+        name, path, args, kwargs = super().deconstruct()
+        return name, 'django.db.models.ForeignKey', args, kwargs
+
+
+def _saved(sender, instance, **kwargs):
+    if isinstance(instance, IdentityMapModel):
+        add(instance)
+
+
+def _deleted(sender, instance, **kwargs):
+    if isinstance(instance, IdentityMapModel):
+        discard(sender, instance.pk)
+
+
+def connect_signals():
+    post_save.connect(_saved, dispatch_uid='courseinfo_identity_map_post_save')
+    post_delete.connect(_deleted, dispatch_uid='courseinfo_identity_map_post_delete')
@@ -0,0 +1,255 @@
+"""
+Request-scoped timing hooks used by the debugging middleware.
+
+A Timeline splits the wall-clock time of one request into phases. Phases
+nest: entering a phase pauses the one it interrupts, so every phase
+records self time and the phases add up to the request's total time.
+
+RenderStats collects cumulative render time and call counts per template
+and per {% block %}. Nothing is recorded unless a Timeline or RenderStats
+is active in the current context, so the hooks installed by install()
+cost a couple of context variable lookups per call when nothing is on.
+"""
+import contextvars
+import re
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core import signing
+from django.template.base import Template
+from django.template.loader_tags import BlockNode
+
+from courseinfo import tracing
+
+DEBUG_HEADER = 'HTTP_X_COURSEINFO_DEBUG'
+DEBUG_PARAM = '_debug'
+_TOKEN_SALT = 'courseinfo.debug'
+
+_timeline = contextvars.ContextVar('courseinfo_timeline', default=None)
+_render_stats = contextvars.ContextVar('courseinfo_render_stats', default=None)
+_request = contextvars.ContextVar('courseinfo_request', default=None)
+
+
+def bind_request(request):
+    return _request.set(request)
+
+
+def unbind_request(token):
+    _request.reset(token)
+
+
+def current_request():
+    """The request being handled in this context, if any."""
+    return _request.get()
+
+
+def make_debug_token(feature):
+    """Return a signed token that turns on a debugging feature."""
+    return signing.TimestampSigner(salt=_TOKEN_SALT).sign(feature)
+
+
+def has_debug_token(request, feature):
+    tokens = request.META.get(DEBUG_HEADER, '').split(',')
+    tokens += request.GET.getlist(DEBUG_PARAM)
+    signer = signing.TimestampSigner(salt=_TOKEN_SALT)
+    max_age = getattr(settings, 'COURSEINFO_DEBUG_TOKEN_MAX_AGE', 3600)
+    for token in tokens:
+        token = token.strip()
+        if not token:
+            continue
+        try:
+            if signer.unsign(token, max_age=max_age) == feature:
+                return True
+        except signing.BadSignature:
+            continue
+    return False
+
+
+def is_staff(request):
+    """request.user.is_staff, without loading a session the request has no cookie for."""
+    if settings.SESSION_COOKIE_NAME not in request.COOKIES:
+        return False
+    return request.user.is_staff
+
+
+class Timeline:
+    def __init__(self):
+        self.durations = {}
+        self.descriptions = {}
+        self.query_count = 0
+        self._stack = []
+        self._mark = time.perf_counter()
+
+    def _charge(self, now):
+        if self._stack:
+            name = self._stack[-1]
+            self.durations[name] = self.durations.get(name, 0.0) + now - self._mark
+        self._mark = now
+
+    def enter(self, name, description=None):
+        self._charge(time.perf_counter())
+        self._stack.append(name)
+        if description is not None:
+            self.descriptions[name] = description
+
+    def exit(self):
+        self._charge(time.perf_counter())
+        self._stack.pop()
+
+    def add(self, name, duration):
+        self.durations[name] = self.durations.get(name, 0.0) + duration
+
+    def __call__(self, execute, sql, params, many, context):
+        # execute wrapper: time spent in the database is its own phase
+        self.query_count += 1
+        self.enter('db')
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.exit()
+
+    def server_timing(self):
+        entries = []
+        for name, duration in self.durations.items():
+            entry = '%s;dur=%.2f' % (name, duration * 1000)
+            if name in self.descriptions:
+                entry += ';desc="%s"' % self.descriptions[name].replace('"', "'")
+            entries.append(entry)
+        return ', '.join(entries)
+
+
+class RenderStats:
+    """Inclusive render time and call count per template and per block."""
+
+    def __init__(self):
+        self.entries = {}
+
+    def record(self, key, duration):
+        entry = self.entries.get(key)
+        if entry is None:
+            self.entries[key] = [1, duration]
+        else:
+            entry[0] += 1
+            entry[1] += duration
+
+    def header(self):
+        return ', '.join(
+            '%s;dur=%.2f;count=%d' % (key, total * 1000, count)
+            for key, (count, total) in sorted(
+                self.entries.items(), key=lambda item: item[1][1], reverse=True))
+
+
+class RenderReport:
+    """Process-wide totals of RenderStats, for the slowest-templates page."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.entries = {}
+
+    def add(self, stats):
+        with self.lock:
+            for key, (count, total) in stats.entries.items():
+                entry = self.entries.setdefault(
+                    key, {'name': key, 'calls': 0, 'requests': 0, 'total': 0.0, 'max': 0.0})
+                entry['calls'] += count
+                entry['requests'] += 1
+                entry['total'] += total
+                entry['max'] = max(entry['max'], total)
+
+    def slowest(self, limit=50):
+        with self.lock:
+            entries = [dict(entry) for entry in self.entries.values()]
+        for entry in entries:
+            entry['mean'] = entry['total'] / entry['requests']
+        return sorted(entries, key=lambda entry: entry['total'], reverse=True)[:limit]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+render_report = RenderReport()
+
+
+def activate(timeline):
+    return _timeline.set(timeline)
+
+
+def deactivate(token):
+    tracing.reset_context_var(_timeline, token)
+
+
+def activate_render_stats(stats):
+    return _render_stats.set(stats)
+
+
+def deactivate_render_stats(token):
+    _render_stats.reset(token)
+
+
+def current_timeline():
+    return _timeline.get()
+
+
+@contextmanager
+def phase(name, description=None):
+    timeline = _timeline.get()
+    if timeline is None:
+        yield
+        return
+    timeline.enter(name, description)
+    try:
+        yield
+    finally:
+        timeline.exit()
+
+
+_original_template_render = None
+_original_block_render = None
+
+
+def _template_phase_name(template):
+    return 'tpl.' + re.sub(r'[^A-Za-z0-9_.-]', '_', template.name or 'string')
+
+
+def _instrumented_template_render(self, context):
+    timeline = _timeline.get()
+    stats = _render_stats.get()
+    if timeline is None and stats is None and not tracing.is_recording():
+        return _original_template_render(self, context)
+    if timeline is not None:
+        timeline.enter(_template_phase_name(self), self.name)
+    start = time.perf_counter()
+    try:
+        with tracing.span('template.render', **{'template.name': self.name or '(string)'}):
+            return _original_template_render(self, context)
+    finally:
+        if stats is not None:
+            stats.record(self.name or '(string)', time.perf_counter() - start)
+        if timeline is not None:
+            timeline.exit()
+
+
+def _instrumented_block_render(self, context):
+    stats = _render_stats.get()
+    if stats is None:
+        return _original_block_render(self, context)
+    start = time.perf_counter()
+    try:
+        return _original_block_render(self, context)
+    finally:
+        stats.record('%s#%s' % (context.template_name or '(string)', self.name),
+                     time.perf_counter() - start)
+
+
+def install():
+    """Hook template rendering. Called once from CourseinfoConfig.ready()."""
+    global _original_template_render, _original_block_render
+    if Template._render is not _instrumented_template_render:
+        _original_template_render = Template._render
+        Template._render = _instrumented_template_render
+    if BlockNode.render is not _instrumented_block_render:
+        _original_block_render = BlockNode.render
+        BlockNode.render = _instrumented_block_render
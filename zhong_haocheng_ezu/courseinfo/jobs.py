@@ -0,0 +1,203 @@
+"""
+Database-backed background jobs.
+
+Long-running work (exports, bulk imports, maintenance) is registered as a
+task with @task and queued with enqueue(), which only stores a Job row;
+the runjobs management command claims queued jobs and runs them on a
+thread pool. There is no broker: the jobs table is the queue, and a job
+is claimed with a conditional UPDATE, so any number of workers can share
+it. A task is called as task(job_context, **arguments) and reports
+progress through the context. A task that raises is queued again with
+exponential backoff until it has used max_attempts, then marked failed
+with its traceback. Workers refresh the heartbeat of the jobs they are
+running; jobs whose worker stopped sending heartbeats are requeued by the
+other workers, and the outcome of a job that was requeued under its
+worker is discarded.
+"""
+import logging
+import os
+import socket
+import time
+import traceback
+from datetime import timedelta
+from importlib import import_module
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.db.models import F
+from django.utils import timezone
+
+from courseinfo import metrics
+from courseinfo.models import Job
+
+logger = logging.getLogger('courseinfo.jobs')
+
+TASK_MODULES = ('courseinfo.tasks',)
+PROGRESS_INTERVAL = 1.0
+
+_tasks = {}
+_loaded = False
+
+
+def task(name=None, max_attempts=3):
+    """Register a function as a task, under its own name by default."""
+    def register(function):
+        function.task_name = name or function.__name__
+        function.max_attempts = max_attempts
+        _tasks[function.task_name] = function
+        return function
+    return register
+
+
+def registered_tasks():
+    global _loaded
+    if not _loaded:
+        for module in getattr(settings, 'COURSEINFO_JOB_TASK_MODULES', TASK_MODULES):
+            import_module(module)
+        _loaded = True
+    return _tasks
+
+
+def get_task(name):
+    try:
+        return registered_tasks()[name]
+    except KeyError:
+        raise LookupError('No task named %r is registered.' % name) from None
+
+
+def enqueue(name, arguments=None, delay=0, max_attempts=None):
+    """Queue a job for a registered task and return it."""
+    function = get_task(name)
+    return Job.objects.create(
+        task=name,
+        arguments=arguments or {},
+        max_attempts=max_attempts or function.max_attempts,
+        run_after=timezone.now() + timedelta(seconds=delay))
+
+
+def worker_name():
+    return '%s:%d' % (socket.gethostname(), os.getpid())
+
+
+class JobContext:
+    """Handed to a running task so it can report progress."""
+
+    def __init__(self, job):
+        self.job = job
+        self._last_write = 0.0
+
+    def progress(self, done, total=None, message=None):
+        """Record progress; writes are throttled to one per PROGRESS_INTERVAL."""
+        self.job.progress = done
+        fields = {'progress': done, 'heartbeat': timezone.now()}
+        if total is not None:
+            self.job.total = fields['total'] = total
+        if message is not None:
+            self.job.message = fields['message'] = message[:255]
+        now = time.monotonic()
+        if now - self._last_write >= PROGRESS_INTERVAL or done == self.job.total:
+            self._last_write = now
+            _claimed(self.job).update(**fields)
+
+
+def _claimed(job):
+    """The job's row while it is still running under the worker that claimed it."""
+    return Job.objects.filter(pk=job.pk, status=Job.RUNNING, worker=job.worker)
+
+
+def retry_delay(attempts):
+    base = getattr(settings, 'COURSEINFO_JOB_RETRY_DELAY', 10.0)
+    return min(base * 2 ** (attempts - 1), getattr(settings, 'COURSEINFO_JOB_MAX_RETRY_DELAY', 3600.0))
+
+
+def claim(worker, batch=10):
+    """Mark the next due job as running for this worker and return it, or None."""
+    now = timezone.now()
+    candidates = list(Job.objects.filter(status=Job.QUEUED, run_after__lte=now)
+                      .order_by('run_after', 'job_id')
+                      .values_list('pk', flat=True)[:batch])
+    for pk in candidates:
+        # another worker may have claimed it since the SELECT
+        claimed = Job.objects.filter(pk=pk, status=Job.QUEUED).update(
+            status=Job.RUNNING, worker=worker, started=now, heartbeat=now,
+            attempts=F('attempts') + 1)
+        if claimed:
+            return Job.objects.get(pk=pk)
+    return None
+
+
+def heartbeat(worker, pks):
+    """Mark the given jobs, if still running for this worker, as alive."""
+    return Job.objects.filter(pk__in=pks, status=Job.RUNNING, worker=worker).update(
+        heartbeat=timezone.now())
+
+
+def run(job):
+    """
+    Run a claimed job and record its outcome. Returns 'lost' without
+    recording anything if the job was requeued while it ran.
+    """
+    close_old_connections()
+    start = time.perf_counter()
+    try:
+        function = get_task(job.task)
+        result = function(JobContext(job), **job.arguments)
+    except Exception:
+        error = traceback.format_exc()
+        logger.exception('Job %s failed on attempt %d of %d',
+                         job, job.attempts, job.max_attempts)
+        now = timezone.now()
+        if job.attempts < job.max_attempts and job.task in _tasks:
+            delay = retry_delay(job.attempts)
+            updated = _claimed(job).update(
+                status=Job.QUEUED, error=error, heartbeat=now,
+                run_after=now + timedelta(seconds=delay),
+                message='Attempt %d failed; retrying in %g s' % (job.attempts, delay))
+            outcome = 'retried'
+        else:
+            updated = _claimed(job).update(
+                status=Job.FAILED, error=error, heartbeat=now, finished=now,
+                message='Failed after %d attempts' % job.attempts)
+            outcome = 'failed'
+    else:
+        now = timezone.now()
+        fields = {'status': Job.SUCCEEDED, 'result': result, 'heartbeat': now, 'finished': now}
+        if job.total is not None:
+            fields['progress'] = job.total
+        updated = _claimed(job).update(**fields)
+        outcome = 'succeeded'
+    finally:
+        close_old_connections()
+    if not updated:
+        logger.warning('Job %s was requeued while it ran; discarding its outcome', job)
+        outcome = 'lost'
+    metrics.JOBS.inc(job.task, outcome)
+    metrics.JOB_DURATION.observe(time.perf_counter() - start, job.task)
+    metrics.registry.maybe_dump()
+    return outcome
+
+
+def requeue_stale(seconds):
+    """Give up on running jobs without a heartbeat for `seconds`; returns the count."""
+    cutoff = timezone.now() - timedelta(seconds=seconds)
+    stale = Job.objects.filter(status=Job.RUNNING, heartbeat__lt=cutoff)
+    message = 'Worker stopped responding'
+    failed = stale.filter(attempts__gte=F('max_attempts')).update(
+        status=Job.FAILED, finished=timezone.now(), message=message)
+    requeued = stale.update(status=Job.QUEUED, run_after=timezone.now(), message=message)
+    return failed + requeued
+
+
+def prune(days):
+    """Delete jobs that finished more than `days` days ago."""
+    cutoff = timezone.now() - timedelta(days=days)
+    deleted, _ = Job.objects.filter(
+        status__in=[Job.SUCCEEDED, Job.FAILED], finished__lt=cutoff).delete()
+    return deleted
+
+
+def retry(job):
+    """Queue a failed job again with a fresh set of attempts."""
+    return Job.objects.filter(pk=job.pk, status=Job.FAILED).update(
+        status=Job.QUEUED, attempts=0, run_after=timezone.now(), progress=0,
+        message='', error='', worker='', started=None, finished=None)
@@ -0,0 +1,255 @@
+import asyncio
+import importlib
+import io
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+from wsgiref.util import setup_testing_defaults
+
+from django.conf import settings
+from django.core.handlers.asgi import ASGIHandler
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.test.utils import override_settings
+from django.urls import clear_url_caches
+
+from courseinfo import benchmarks, querycache
+from courseinfo.models import Course, Instructor, Section, Semester, Student
+
+MODES = ('wsgi', 'asgi-sync', 'asgi-async')
+
+
+def wsgi_get(handler, url, cookie):
+    """GET url from a WSGI application; returns the status code."""
+    parts = urlsplit(url)
+    environ = {'PATH_INFO': parts.path, 'QUERY_STRING': parts.query,
+               'HTTP_HOST': 'localhost', 'HTTP_COOKIE': cookie, 'wsgi.input': io.BytesIO()}
+    setup_testing_defaults(environ)
+    status = []
+    response = handler(environ, lambda line, headers, exc_info=None: status.append(line))
+    try:
+        for chunk in response:
+            pass
+    finally:
+        response.close()
+    return int(status[0].split(' ', 1)[0])
+
+
+async def asgi_get(application, url, cookie):
+    """GET url from an ASGI application; returns the status code."""
+    parts = urlsplit(url)
+    scope = {
+        'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1',
+        'method': 'GET', 'scheme': 'http', 'root_path': '',
+        'path': parts.path, 'raw_path': parts.path.encode(),
+        'query_string': parts.query.encode(),
+        'headers': [(b'host', b'localhost'), (b'cookie', cookie.encode())],
+        'client': ('127.0.0.1', 50000), 'server': ('localhost', 80),
+    }
+    messages = [{'type': 'http.request', 'body': b'', 'more_body': False}]
+    status = []
+
+    async def receive():
+        if messages:
+            return messages.pop()
+        # the client stays connected until the response is complete
+        await asyncio.Future()
+
+    async def send(message):
+        if message['type'] == 'http.response.start':
+            status.append(message['status'])
+
+    await application(scope, receive, send)
+    return status[0]
+
+
+def reload_urlconf():
+    # the root URLconf's include() holds a resolver with the old patterns
+    importlib.reload(importlib.import_module('courseinfo.urls'))
+    importlib.reload(importlib.import_module(settings.ROOT_URLCONF))
+    clear_url_caches()
+
+
+@contextmanager
+def async_views(enabled):
+    """Route the list and detail URLs to the async views, or back."""
+    with override_settings(COURSEINFO_ASYNC_VIEWS=enabled):
+        reload_urlconf()
+        try:
+            yield
+        finally:
+            reload_urlconf()
+
+
+class QueryDelay:
+    """Execute wrapper counting queries and adding a network round trip to each."""
+
+    def __init__(self, seconds):
+        self.seconds = seconds
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def __call__(self, execute, sql, params, many, context):
+        with self.lock:
+            self.count += 1
+        if self.seconds:
+            time.sleep(self.seconds)
+        return execute(sql, params, many, context)
+
+
+@contextmanager
+def wrap_all_connections(wrapper):
+    """Push an execute wrapper on every connection of every thread."""
+    def install(sender, connection, **kwargs):
+        if wrapper not in connection.execute_wrappers:
+            # outermost (Django applies execute_wrappers[0] first): a
+            # connection opened during a request already has the request's
+            # wrappers, which are popped off the end
+            connection.execute_wrappers.insert(0, wrapper)
+
+    for connection in connections.all():
+        install(None, connection)
+    connection_created.connect(install, weak=False, dispatch_uid='bench_async')
+    try:
+        yield
+    finally:
+        connection_created.disconnect(dispatch_uid='bench_async')
+        for connection in connections.all():
+            if wrapper in connection.execute_wrappers:
+                connection.execute_wrappers.remove(wrapper)
+
+
+class Command(BaseCommand):
+    help = ('Compare WSGI with a fixed thread pool against ASGI, with the sync '
+            'and with the async list and detail views, at growing numbers of '
+            'concurrent clients. Requests are driven in process through '
+            'Django\'s WSGI and ASGI handlers the way a threaded WSGI server and '
+            'an event loop server such as uvicorn call them; the page and '
+            'query-result caches are off so every request reaches the database.')
+    # the URLconf is reloaded per mode; checking it up front gains nothing
+    requires_system_checks = []
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 8, 32, 64],
+                            help='numbers of concurrent clients')
+        parser.add_argument('--requests', type=int, default=200,
+                            help='requests per mode and concurrency level')
+        parser.add_argument('--wsgi-threads', type=int, default=8,
+                            help='threads of the WSGI server; more clients queue')
+        parser.add_argument('--query-latency', type=float, default=0.0,
+                            help='milliseconds added to every query, as a database '
+                                 'server on the network would')
+        parser.add_argument('--mode', dest='modes', action='append', choices=MODES,
+                            help='mode to run (repeatable; default all)')
+        parser.add_argument('--url', dest='urls', action='append',
+                            help='URL to request (repeatable; default one of each '
+                                 'detail page and two list pages)')
+
+    def handle(self, *args, **options):
+        modes = options['modes'] or MODES
+        self.queries = QueryDelay(options['query_latency'] / 1000)
+        # no router: every query goes to the benchmark database, none to
+        # the read replica's snapshot
+        with benchmarks.benchmark_database(), \
+                override_settings(DATABASE_ROUTERS=[], COURSEINFO_PAGE_CACHE_TIMEOUT=0), \
+                wrap_all_connections(self.queries):
+            benchmarks.populate()
+            client = benchmarks.staff_client()
+            cookie = '%s=%s' % (settings.SESSION_COOKIE_NAME,
+                                client.cookies[settings.SESSION_COOKIE_NAME].value)
+            urls = options['urls'] or self.default_urls()
+            max_bytes = querycache.result_cache.max_bytes
+            querycache.result_cache.max_bytes = 0
+            querycache.result_cache.clear()
+            try:
+                results = {mode: self.run_mode(mode, urls, cookie, options) for mode in modes}
+            finally:
+                querycache.result_cache.max_bytes = max_bytes
+
+        self.stdout.write('%d requests per run over %d URLs, %d WSGI threads, '
+                          '%g ms added per query' % (
+                              options['requests'], len(urls), options['wsgi_threads'],
+                              options['query_latency']))
+        self.stdout.write('%-8s %-11s %9s %9s %9s %9s %7s' % (
+            'clients', 'mode', 'req/s', 'p50 ms', 'p95 ms', 'queries', 'errors'))
+        for concurrency in options['concurrency']:
+            for mode in modes:
+                result = results[mode][concurrency]
+                self.stdout.write('%-8d %-11s %9.1f %9.1f %9.1f %9.1f %7d' % (
+                    concurrency, mode, result['rate'], result['p50'] * 1000,
+                    result['p95'] * 1000, result['queries'], result['errors']))
+
+    def default_urls(self):
+        section = Section.objects.order_by('pk').first()
+        return [
+            section.get_absolute_url(),
+            Instructor.objects.order_by('pk').first().get_absolute_url(),
+            Student.objects.order_by('pk').first().get_absolute_url(),
+            Course.objects.order_by('pk').first().get_absolute_url(),
+            Semester.objects.order_by('pk').first().get_absolute_url(),
+            '/instructor/',
+            '/student/?page=2',
+        ]
+
+    def run_mode(self, mode, urls, cookie, options):
+        with async_views(mode == 'asgi-async'):
+            if mode == 'wsgi':
+                handler = WSGIHandler()
+                pool = ThreadPoolExecutor(options['wsgi_threads'])
+
+                def get(url):
+                    return asyncio.get_running_loop().run_in_executor(
+                        pool, wsgi_get, handler, url, cookie)
+            else:
+                handler = ASGIHandler()
+                pool = None
+
+                def get(url):
+                    return asgi_get(handler, url, cookie)
+            try:
+                results = {}
+                for concurrency in options['concurrency']:
+                    results[concurrency] = asyncio.run(
+                        self.load(get, urls, concurrency, options['requests']))
+            finally:
+                if pool is not None:
+                    pool.shutdown()
+        return results
+
+    async def load(self, get, urls, concurrency, count):
+        """Keep `concurrency` requests in flight until `count` are done."""
+        for url in urls:
+            status = await get(url)
+            if status != 200:
+                raise CommandError('GET %s returned %d' % (url, status))
+        latencies = []
+        errors = 0
+        issued = 0
+
+        async def client():
+            nonlocal errors, issued
+            while issued < count:
+                url = urls[issued % len(urls)]
+                issued += 1
+                start = time.perf_counter()
+                if await get(url) != 200:
+                    errors += 1
+                latencies.append(time.perf_counter() - start)
+
+        queries = self.queries.count
+        start = time.perf_counter()
+        await asyncio.gather(*(client() for i in range(concurrency)))
+        elapsed = time.perf_counter() - start
+        latencies.sort()
+        return {
+            'rate': len(latencies) / elapsed,
+            'p50': statistics.median(latencies),
+            'p95': latencies[int(len(latencies) * 0.95) - 1] if len(latencies) > 1 else latencies[0],
+            'queries': (self.queries.count - queries) / len(latencies),
+            'errors': errors,
+        }
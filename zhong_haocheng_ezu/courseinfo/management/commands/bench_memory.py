@@ -0,0 +1,48 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from courseinfo import benchmarks, profiling
+
+DEFAULT_URLS = ['/registration/', '/section/', '/student/', '/section/1']
+
+
+class Command(BaseCommand):
+    help = ('Record the peak traced memory of each URL at growing dataset '
+            'sizes, each in a fresh throwaway database. The page and '
+            'query-result caches are off so the view itself is measured.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[100, 1000, 5000],
+                            help='numbers of registrations to generate')
+        parser.add_argument('--url', dest='urls', action='append',
+                            help='URL to measure (repeatable)')
+        parser.add_argument('--max-peak-mb', type=float,
+                            help='fail if any URL peaks above this many MiB')
+
+    def handle(self, *args, **options):
+        urls = options['urls'] or DEFAULT_URLS
+        sizes = options['sizes']
+        results = {url: [] for url in urls}
+        for size in sizes:
+            with benchmarks.benchmark_database(), benchmarks.uncached():
+                benchmarks.populate(
+                    sections=max(1, size // 20),
+                    students=max(20, size // 4),
+                    registrations_per_section=min(20, size))
+                client = benchmarks.staff_client()
+                for url in urls:
+                    client.get(url)  # warm up template loading and reference data
+                    response, report = profiling.measure_memory(client.get, url)
+                    if response.status_code != 200:
+                        raise CommandError('GET %s returned %d' % (url, response.status_code))
+                    results[url].append(report['peak'])
+
+        self.stdout.write('Peak traced memory (KiB) by number of registrations')
+        self.stdout.write('%-24s' % 'URL' + ''.join('%12d' % size for size in sizes))
+        for url, peaks in results.items():
+            self.stdout.write('%-24s' % url + ''.join('%12.0f' % (peak / 1024) for peak in peaks))
+
+        limit = options['max_peak_mb']
+        if limit is not None:
+            worst = max(max(peaks) for peaks in results.values()) / 1024 / 1024
+            if worst > limit:
+                raise CommandError('Peak memory %.1f MiB exceeds %.1f MiB' % (worst, limit))
@@ -0,0 +1,56 @@
+import statistics
+import tempfile
+
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import override_settings
+
+from courseinfo import benchmarks, profiling
+
+
+class Command(BaseCommand):
+    help = ('Measure the throughput cost of the background sampling profiler by '
+            'alternating rounds of requests with the sampler stopped and running. '
+            'The page and query-result caches are off so every request runs the view.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default='/section/')
+        parser.add_argument('--hz', type=int, default=100)
+        parser.add_argument('--requests', type=int, default=200,
+                            help='requests per round')
+        parser.add_argument('--rounds', type=int, default=5)
+        parser.add_argument('--max-overhead', type=float, default=2.0,
+                            help='fail if the overhead exceeds this percentage')
+
+    def handle(self, *args, **options):
+        url = options['url']
+        with benchmarks.benchmark_database(), benchmarks.uncached():
+            benchmarks.populate()
+            client = benchmarks.staff_client()
+            benchmarks.timed_requests(client, url, options['requests'])  # warm up
+
+            with override_settings(COURSEINFO_SAMPLER_ENABLED=True,
+                                   COURSEINFO_SAMPLER_HZ=options['hz'],
+                                   COURSEINFO_SAMPLER_DIR=tempfile.mkdtemp()):
+                baseline, sampled = [], []
+                for i in range(options['rounds']):
+                    baseline.append(
+                        benchmarks.timed_requests(client, url, options['requests']))
+                    sampler = profiling.start_background_sampler()
+                    try:
+                        sampled.append(
+                            benchmarks.timed_requests(client, url, options['requests']))
+                    finally:
+                        profiling.stop_background_sampler()
+
+        baseline_rps = statistics.median(baseline)
+        sampled_rps = statistics.median(sampled)
+        overhead = (baseline_rps - sampled_rps) / baseline_rps * 100
+        self.stdout.write('%s at %d Hz, %d rounds of %d requests' % (
+            url, options['hz'], options['rounds'], options['requests']))
+        self.stdout.write('  sampler off: %8.1f req/s (median)' % baseline_rps)
+        self.stdout.write('  sampler on:  %8.1f req/s (median), %d samples in last round' % (
+            sampled_rps, sampler.samples))
+        self.stdout.write('  overhead:    %8.2f %%' % overhead)
+        if overhead > options['max_overhead']:
+            raise CommandError('Sampler overhead %.2f%% exceeds %.2f%%' % (
+                overhead, options['max_overhead']))
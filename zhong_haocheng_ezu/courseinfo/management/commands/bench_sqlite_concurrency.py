@@ -0,0 +1,114 @@
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+
+from django.core.management.base import BaseCommand
+
+from courseinfo import sqlite
+
+SCHEMA = '''
+CREATE TABLE student (id INTEGER PRIMARY KEY, name TEXT NOT NULL);
+CREATE TABLE registration (
+    id INTEGER PRIMARY KEY,
+    student_id INTEGER NOT NULL REFERENCES student (id),
+    section INTEGER NOT NULL);
+CREATE INDEX registration_section ON registration (section);
+'''
+READ_SQL = ('SELECT s.name, COUNT(*) FROM registration r JOIN student s ON s.id = r.student_id '
+            'WHERE r.section = ? GROUP BY s.name')
+
+
+class Command(BaseCommand):
+    help = ('Measure read and write throughput of concurrent connections to a '
+            'scratch SQLite file with the default settings and with the '
+            'production pragmas (courseinfo.sqlite.RECOMMENDED_PRAGMAS).')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--readers', type=int, default=4)
+        parser.add_argument('--writers', type=int, default=1)
+        parser.add_argument('--seconds', type=float, default=5.0,
+                            help='duration of each run')
+        parser.add_argument('--rows', type=int, default=20000,
+                            help='registrations in the scratch database')
+        parser.add_argument('--timeout', type=float, default=5.0,
+                            help='sqlite3 busy timeout in seconds for the default run '
+                                 '(5, the sqlite3 module\'s and Django\'s default)')
+
+    def handle(self, *args, **options):
+        for label, pragmas in [('default', {}), ('tuned', sqlite.RECOMMENDED_PRAGMAS)]:
+            with tempfile.TemporaryDirectory() as directory:
+                path = os.path.join(directory, 'bench.sqlite3')
+                self.create(path, options['rows'])
+                result = self.run(path, pragmas, options)
+            self.stdout.write(
+                '%-8s reads %8.1f/s  writes %7.1f/s  locked errors %5d  '
+                'max write wait %6.1f ms' % (
+                    label, result['reads'] / options['seconds'],
+                    result['writes'] / options['seconds'], result['locked'],
+                    result['max_wait'] * 1000))
+
+    def create(self, path, rows):
+        connection = sqlite3.connect(path)
+        connection.executescript(SCHEMA)
+        connection.executemany('INSERT INTO student (id, name) VALUES (?, ?)',
+                               ((i, 'Student %d' % i) for i in range(rows // 10)))
+        connection.executemany('INSERT INTO registration (student_id, section) VALUES (?, ?)',
+                               ((i % (rows // 10), i % 100) for i in range(rows)))
+        connection.commit()
+        connection.close()
+
+    def connect(self, path, pragmas, timeout):
+        connection = sqlite3.connect(path, timeout=timeout, check_same_thread=False)
+        sqlite.apply_pragmas(connection, pragmas)
+        return connection
+
+    def run(self, path, pragmas, options):
+        result = {'reads': 0, 'writes': 0, 'locked': 0, 'max_wait': 0.0}
+        lock = threading.Lock()
+        deadline = time.monotonic() + options['seconds']
+
+        def count(key, amount=1):
+            with lock:
+                result[key] += amount
+
+        def reader(number):
+            connection = self.connect(path, pragmas, options['timeout'])
+            section = number
+            while time.monotonic() < deadline:
+                try:
+                    connection.execute(READ_SQL, (section % 100,)).fetchall()
+                    count('reads')
+                except sqlite3.OperationalError:
+                    count('locked')
+                section += 1
+            connection.close()
+
+        def writer(number):
+            connection = self.connect(path, pragmas, options['timeout'])
+            student = number
+            while time.monotonic() < deadline:
+                start = time.monotonic()
+                try:
+                    with connection:
+                        connection.execute(
+                            'INSERT INTO registration (student_id, section) VALUES (?, ?)',
+                            (student % 100, student % 100))
+                        connection.execute(
+                            'DELETE FROM registration WHERE id = (SELECT MIN(id) FROM registration)')
+                    count('writes')
+                except sqlite3.OperationalError:
+                    count('locked')
+                with lock:
+                    result['max_wait'] = max(result['max_wait'], time.monotonic() - start)
+                student += 1
+            connection.close()
+
+        threads = [threading.Thread(target=reader, args=(i,)) for i in range(options['readers'])]
+        threads += [threading.Thread(target=writer, args=(i,)) for i in range(options['writers'])]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return result
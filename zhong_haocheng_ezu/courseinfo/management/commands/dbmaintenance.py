@@ -0,0 +1,153 @@
+import sqlite3
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, OperationalError, connections
+
+AUTO_VACUUM_MODES = {0: 'none', 1: 'full', 2: 'incremental'}
+
+
+class Command(BaseCommand):
+    help = ('Refresh the SQLite query planner statistics, return free pages to '
+            'the file system in small incremental-vacuum steps, checkpoint the '
+            'WAL and report table and index sizes and fragmentation. Every '
+            'step holds the write lock only briefly, so it is safe to run '
+            'while the site is serving requests.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS)
+        parser.add_argument('--full-analyze', action='store_true',
+                            help='run a full ANALYZE instead of PRAGMA optimize '
+                                 'with an analysis limit')
+        parser.add_argument('--vacuum-pages', type=int, default=256,
+                            help='free pages released per incremental vacuum step')
+        parser.add_argument('--vacuum-pause', type=float, default=0.05,
+                            help='seconds to wait between vacuum steps')
+        parser.add_argument('--max-seconds', type=float, default=60.0,
+                            help='stop vacuuming after this long')
+        parser.add_argument('--checkpoint', default='PASSIVE',
+                            choices=['PASSIVE', 'FULL', 'RESTART', 'TRUNCATE'],
+                            help='wal_checkpoint mode; only PASSIVE never waits for readers')
+        parser.add_argument('--enable-incremental-vacuum', action='store_true',
+                            help='switch auto_vacuum to INCREMENTAL; this needs a full '
+                                 'VACUUM that locks the database while it runs')
+        parser.add_argument('--busy-timeout', type=int, default=5000,
+                            help='milliseconds to wait for locks held by the site')
+        parser.add_argument('--skip-report', action='store_true')
+
+    def handle(self, *args, **options):
+        connection = connections[options['database']]
+        if connection.vendor != 'sqlite':
+            raise CommandError('dbmaintenance only supports SQLite databases')
+        with connection.cursor() as cursor:
+            self.connection = connection
+            self.cursor = cursor
+            self.pragma('busy_timeout = %d' % options['busy_timeout'])
+            before = self.totals()
+            if options['enable_incremental_vacuum']:
+                self.enable_incremental_vacuum()
+            self.analyze(options['full_analyze'])
+            self.vacuum(options)
+            self.checkpoint(options['checkpoint'])
+            after = self.totals()
+            self.stdout.write('file: %s -> %s, free pages: %d -> %d' % (
+                self.size(before['pages'] * before['page_size']),
+                self.size(after['pages'] * after['page_size']),
+                before['free'], after['free']))
+            if not options['skip_report']:
+                self.report(after)
+
+    def pragma(self, statement):
+        self.cursor.execute('PRAGMA %s' % statement)
+        return self.cursor.fetchall()
+
+    def value(self, name):
+        return self.pragma(name)[0][0]
+
+    def totals(self):
+        return {
+            'page_size': self.value('page_size'),
+            'pages': self.value('page_count'),
+            'free': self.value('freelist_count'),
+            'auto_vacuum': AUTO_VACUUM_MODES.get(self.value('auto_vacuum'), 'unknown'),
+            'journal_mode': self.value('journal_mode'),
+        }
+
+    def enable_incremental_vacuum(self):
+        self.stdout.write('switching auto_vacuum to incremental (full VACUUM)...')
+        start = time.monotonic()
+        self.pragma('auto_vacuum = INCREMENTAL')
+        self.cursor.execute('VACUUM')
+        self.stdout.write('  done in %.1f s' % (time.monotonic() - start))
+
+    def analyze(self, full):
+        start = time.monotonic()
+        if full:
+            self.cursor.execute('ANALYZE')
+            label = 'ANALYZE'
+        else:
+            # a sampled analysis keeps the write lock short on big tables
+            self.pragma('analysis_limit = 1000')
+            self.pragma('optimize = 0x10002')
+            label = 'PRAGMA optimize'
+        self.stdout.write('%s: %.1f ms' % (label, (time.monotonic() - start) * 1000))
+
+    def vacuum(self, options):
+        totals = self.totals()
+        if totals['auto_vacuum'] != 'incremental':
+            self.stdout.write(
+                'incremental vacuum: skipped, auto_vacuum is %s (see '
+                '--enable-incremental-vacuum); %d free pages stay in the file' % (
+                    totals['auto_vacuum'], totals['free']))
+            return
+        released, steps = 0, 0
+        deadline = time.monotonic() + options['max_seconds']
+        free = totals['free']
+        while free and time.monotonic() < deadline:
+            try:
+                # each step is its own short write transaction; executescript
+                # steps the pragma to completion, execute() frees one page
+                self.connection.connection.executescript(
+                    'PRAGMA incremental_vacuum(%d);' % options['vacuum_pages'])
+            except (OperationalError, sqlite3.OperationalError) as error:
+                self.stderr.write('incremental vacuum stopped: %s' % error)
+                break
+            remaining = self.value('freelist_count')
+            released += free - remaining
+            free = remaining
+            steps += 1
+            time.sleep(options['vacuum_pause'])
+        self.stdout.write('incremental vacuum: %d pages released in %d steps, %d left' % (
+            released, steps, free))
+
+    def checkpoint(self, mode):
+        if self.value('journal_mode') != 'wal':
+            return
+        busy, log, checkpointed = self.pragma('wal_checkpoint(%s)' % mode)[0]
+        self.stdout.write('wal_checkpoint(%s): %d of %d frames checkpointed%s' % (
+            mode, checkpointed, log, ', blocked by readers' if busy else ''))
+
+    def report(self, totals):
+        self.stdout.write('page size %d, %d pages, %d free (%.1f%%), auto_vacuum %s, journal %s' % (
+            totals['page_size'], totals['pages'], totals['free'],
+            100.0 * totals['free'] / max(totals['pages'], 1),
+            totals['auto_vacuum'], totals['journal_mode']))
+        try:
+            self.cursor.execute(
+                'SELECT name, COUNT(*), SUM(pgsize), SUM(unused) '
+                'FROM dbstat GROUP BY name ORDER BY SUM(pgsize) DESC')
+        except OperationalError:
+            self.stdout.write('(this SQLite build has no dbstat table; no per-object sizes)')
+            return
+        self.stdout.write('%-45s %7s %10s %8s' % ('table/index', 'pages', 'size', 'unused'))
+        for name, pages, size, unused in self.cursor.fetchall():
+            self.stdout.write('%-45s %7d %10s %7.1f%%' % (
+                name, pages, self.size(size), 100.0 * unused / size if size else 0.0))
+
+    def size(self, value):
+        if value < 1024:
+            return '%d B' % value
+        for unit in ('KiB', 'MiB', 'GiB'):
+            value /= 1024.0
+            if value < 1024 or unit == 'GiB':
+                return '%.1f %s' % (value, unit)
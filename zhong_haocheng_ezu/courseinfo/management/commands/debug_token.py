@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from courseinfo.instrumentation import make_debug_token
+
+
+class Command(BaseCommand):
+    help = ('Print a signed token that turns on a debugging feature when sent '
+            'in the X-Courseinfo-Debug header or the _debug query parameter.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('feature', help="e.g. 'server-timing'")
+
+    def handle(self, *args, **options):
+        self.stdout.write(make_debug_token(options['feature']))
@@ -0,0 +1,36 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from courseinfo import jobs
+
+
+class Command(BaseCommand):
+    help = 'Queue a background job for the runjobs worker.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('task', nargs='?')
+        parser.add_argument('--arguments', default='{}',
+                            help='JSON object of keyword arguments for the task')
+        parser.add_argument('--delay', type=float, default=0,
+                            help='seconds to wait before the job may run')
+        parser.add_argument('--max-attempts', type=int)
+        parser.add_argument('--list', action='store_true', help='list the registered tasks')
+
+    def handle(self, *args, **options):
+        if options['list'] or not options['task']:
+            for name in sorted(jobs.registered_tasks()):
+                self.stdout.write(name)
+            return
+        try:
+            arguments = json.loads(options['arguments'])
+        except ValueError as error:
+            raise CommandError('--arguments is not valid JSON: %s' % error)
+        if not isinstance(arguments, dict):
+            raise CommandError('--arguments must be a JSON object')
+        try:
+            job = jobs.enqueue(options['task'], arguments, delay=options['delay'],
+                               max_attempts=options['max_attempts'])
+        except LookupError as error:
+            raise CommandError(error)
+        self.stdout.write('Queued %s' % job)
@@ -0,0 +1,36 @@
+import time
+
+from django.contrib.sessions.models import Session
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+
+class Command(BaseCommand):
+    help = ('Delete expired sessions in small chunks, each in its own short '
+            'transaction, so the SQLite write lock is never held for long. '
+            'Unlike clearsessions it can run while the site is busy.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=500)
+        parser.add_argument('--pause', type=float, default=0.05,
+                            help='seconds to wait between chunks')
+        parser.add_argument('--max-seconds', type=float,
+                            help='stop after this long; the rest is left for the next run')
+
+    def handle(self, *args, **options):
+        now = timezone.now()
+        start = time.monotonic()
+        deleted = chunks = 0
+        while options['max_seconds'] is None or time.monotonic() - start < options['max_seconds']:
+            keys = list(Session.objects.filter(expire_date__lt=now)
+                        .values_list('session_key', flat=True)[:options['chunk_size']])
+            if not keys:
+                break
+            with transaction.atomic():
+                count, _ = Session.objects.filter(session_key__in=keys).delete()
+            deleted += count
+            chunks += 1
+            time.sleep(options['pause'])
+        self.stdout.write('Deleted %d expired sessions in %d chunks (%.1f s)' % (
+            deleted, chunks, time.monotonic() - start))
@@ -0,0 +1,69 @@
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from courseinfo import jobs, rosters
+from courseinfo.models import Semester
+
+
+class Command(BaseCommand):
+    help = ('Render the printable roster of every section in a semester into a '
+            'ZIP of HTML files, fetching the data in one query and rendering on '
+            'a process pool. --benchmark measures rendering throughput for '
+            '1, 2, 4, ... worker processes instead.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('semester', type=int, help='semester id')
+        parser.add_argument('--output', help='ZIP file to write (default: COURSEINFO_ROSTER_DIR)')
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                            help='rendering processes; 1 renders in this process')
+        parser.add_argument('--batch-size', type=int, default=rosters.BATCH_SIZE,
+                            help='sections sent to a worker at a time')
+        parser.add_argument('--background', action='store_true',
+                            help='queue a render_rosters job for runjobs instead')
+        parser.add_argument('--benchmark', action='store_true')
+
+    def handle(self, *args, **options):
+        try:
+            semester = Semester.objects.get(pk=options['semester'])
+        except Semester.DoesNotExist:
+            raise CommandError('No semester with id %d' % options['semester'])
+        if options['background']:
+            job = jobs.enqueue('render_rosters', {
+                'semester': semester.pk, 'workers': options['workers']})
+            self.stdout.write('Queued %s' % job)
+        elif options['benchmark']:
+            self.benchmark(semester, options)
+        else:
+            path = options['output'] or rosters.default_path(semester)
+            result = rosters.write_rosters(
+                semester, path, workers=options['workers'], batch_size=options['batch_size'])
+            self.stdout.write(
+                '%s: %d sections, %d students, query %.2f s, rendering %.2f s '
+                '(%.0f sections/s on %d workers), %.1f KiB of HTML in a %.1f KiB ZIP' % (
+                    path, result['sections'], result['students'], result['fetch_seconds'],
+                    result['render_seconds'],
+                    result['sections'] / max(result['render_seconds'], 1e-9),
+                    result['workers'], result['html_bytes'] / 1024.0,
+                    result['zip_bytes'] / 1024.0))
+
+    def benchmark(self, semester, options):
+        start = time.perf_counter()
+        roster_list = rosters.fetch_rosters(semester)
+        self.stdout.write('%d sections fetched in %.2f s' % (
+            len(roster_list), time.perf_counter() - start))
+        counts, workers = [], 1
+        while workers < options['workers']:
+            counts.append(workers)
+            workers *= 2
+        counts.append(options['workers'])
+        baseline = None
+        for workers in counts:
+            start = time.perf_counter()
+            for _ in rosters.render_all(roster_list, workers, options['batch_size']):
+                pass
+            rate = len(roster_list) / max(time.perf_counter() - start, 1e-9)
+            baseline = baseline or rate
+            self.stdout.write('%3d workers: %8.0f sections/s  (x%.2f)' % (
+                workers, rate, rate / baseline))
@@ -0,0 +1,85 @@
+import signal
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from courseinfo import jobs
+
+
+class Command(BaseCommand):
+    help = ('Run queued background jobs (see courseinfo.jobs) on a thread pool. '
+            'Several workers may share the queue. SIGINT or SIGTERM stops '
+            'claiming new jobs and waits for the running ones to finish.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=2,
+                            help='jobs run at the same time')
+        parser.add_argument('--poll-interval', type=float, default=1.0,
+                            help='seconds between looks at an empty queue')
+        parser.add_argument('--once', action='store_true',
+                            help='exit once no job is due instead of waiting for more')
+        parser.add_argument('--stale-after', type=float,
+                            default=getattr(settings, 'COURSEINFO_JOB_STALE_SECONDS', 600.0),
+                            help='requeue running jobs without a heartbeat for this long')
+        parser.add_argument('--keep-days', type=float,
+                            default=getattr(settings, 'COURSEINFO_JOB_KEEP_DAYS', 30),
+                            help='delete finished jobs older than this')
+
+    def handle(self, *args, **options):
+        self.stopping = False
+        signal.signal(signal.SIGINT, self.stop)
+        signal.signal(signal.SIGTERM, self.stop)
+        worker = jobs.worker_name()
+        stale = jobs.requeue_stale(options['stale_after'])
+        pruned = jobs.prune(options['keep_days'])
+        self.stdout.write('worker %s: %d threads, %d stale jobs requeued, %d old jobs deleted' % (
+            worker, options['threads'], stale, pruned))
+
+        outcomes = {}
+        running = {}
+        # beat often enough that no worker takes a running job for stale
+        heartbeat_interval = options['stale_after'] / 3
+        poll_interval = min(options['poll_interval'], heartbeat_interval)
+        last_maintenance = last_heartbeat = time.monotonic()
+        with ThreadPoolExecutor(options['threads'], thread_name_prefix='courseinfo-job') as pool:
+            while not self.stopping:
+                job = None
+                while len(running) < options['threads']:
+                    job = jobs.claim(worker)
+                    if job is None:
+                        break
+                    self.stdout.write('running %s (attempt %d of %d)' % (
+                        job, job.attempts, job.max_attempts))
+                    running[pool.submit(jobs.run, job)] = job.pk
+                if not running:
+                    if options['once']:
+                        break
+                    time.sleep(options['poll_interval'])
+                else:
+                    done, _ = wait(running, timeout=poll_interval, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        del running[future]
+                        outcome = future.result()
+                        outcomes[outcome] = outcomes.get(outcome, 0) + 1
+                if running and time.monotonic() - last_heartbeat >= heartbeat_interval:
+                    jobs.heartbeat(worker, list(running.values()))
+                    last_heartbeat = time.monotonic()
+                if time.monotonic() - last_maintenance > options['stale_after']:
+                    jobs.requeue_stale(options['stale_after'])
+                    last_maintenance = time.monotonic()
+            while running:
+                done, _ = wait(running, timeout=heartbeat_interval)
+                for future in done:
+                    del running[future]
+                    outcome = future.result()
+                    outcomes[outcome] = outcomes.get(outcome, 0) + 1
+                if running:
+                    jobs.heartbeat(worker, list(running.values()))
+        self.stdout.write('worker %s stopped: %s' % (
+            worker, ', '.join('%d %s' % (count, outcome)
+                              for outcome, count in sorted(outcomes.items())) or 'no jobs run'))
+
+    def stop(self, signum, frame):
+        self.stopping = True
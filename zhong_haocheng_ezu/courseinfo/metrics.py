@@ -0,0 +1,333 @@
+"""
+In-process metrics for the courseinfo app, rendered in the Prometheus
+text exposition format.
+
+Each worker process aggregates into its own registry. When
+COURSEINFO_METRICS_DIR is set, every worker periodically dumps a JSON
+snapshot of its registry into that directory and the /metrics endpoint
+merges all snapshots, so counters and histograms add up across WSGI
+workers. Snapshot files are named after the worker's PID and start time;
+the files of workers that have exited, or whose PID has been reused by a
+newer worker, are deleted when the snapshots are loaded, so restarts do
+not inflate the totals. The workers must share a host.
+"""
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+from bisect import bisect_left
+
+from django.conf import settings
+from django.db import OperationalError
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+SIZE_BUCKETS = (1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+JOB_DURATION_BUCKETS = (0.1, 0.5, 1.0, 5.0, 15.0, 60.0, 300.0, 900.0, 3600.0)
+DUMP_NAME_RE = re.compile(r'^metrics-(\d+)-(\d+)\.json$')
+
+
+class Family:
+    def __init__(self, registry, name, kind, documentation, labelnames, buckets=None):
+        self.registry = registry
+        self.name = name
+        self.kind = kind
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets) if buckets is not None else None
+        self.samples = {}
+
+    def inc(self, *labelvalues, amount=1):
+        with self.registry.lock:
+            self.samples[labelvalues] = self.samples.get(labelvalues, 0) + amount
+
+    def set(self, value, *labelvalues):
+        with self.registry.lock:
+            self.samples[labelvalues] = value
+
+    def observe(self, value, *labelvalues):
+        with self.registry.lock:
+            sample = self.samples.get(labelvalues)
+            if sample is None:
+                sample = self.samples[labelvalues] = {
+                    'counts': [0] * (len(self.buckets) + 1),
+                    'sum': 0.0,
+                }
+            sample['counts'][bisect_left(self.buckets, value)] += 1
+            sample['sum'] += value
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.families = {}
+        self._last_dump = 0.0
+        self._pid = None
+        self._started = None
+
+    def _register(self, family):
+        self.families[family.name] = family
+        return family
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(
+            Family(self, name, 'counter', documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self._register(
+            Family(self, name, 'gauge', documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self._register(
+            Family(self, name, 'histogram', documentation, labelnames, buckets))
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                family.name: {
+                    'kind': family.kind,
+                    'help': family.documentation,
+                    'labelnames': list(family.labelnames),
+                    'buckets': list(family.buckets) if family.buckets else None,
+                    'samples': [
+                        [list(labelvalues),
+                         dict(value, counts=list(value['counts']))
+                         if isinstance(value, dict) else value]
+                        for labelvalues, value in family.samples.items()
+                    ],
+                }
+                for family in self.families.values()
+            }
+
+    def dump_name(self):
+        if self._pid != os.getpid():
+            # a forked worker starts its own file
+            self._pid = os.getpid()
+            self._started = time.time_ns()
+        return 'metrics-%d-%d.json' % (self._pid, self._started)
+
+    def dump(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, self.dump_name())
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        with os.fdopen(fd, 'w') as tmp_file:
+            json.dump(self.snapshot(), tmp_file)
+        os.replace(tmp_path, path)
+        self._last_dump = time.monotonic()
+
+    def maybe_dump(self):
+        directory = getattr(settings, 'COURSEINFO_METRICS_DIR', None)
+        interval = getattr(settings, 'COURSEINFO_METRICS_DUMP_INTERVAL', 5.0)
+        if directory and time.monotonic() - self._last_dump >= interval:
+            self.dump(directory)
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _live_dumps(directory):
+    """Return the current dump file names, deleting those of gone workers."""
+    newest = {}
+    stale = []
+    for filename in os.listdir(directory):
+        match = DUMP_NAME_RE.match(filename)
+        if match is None:
+            continue
+        pid, started = int(match.group(1)), int(match.group(2))
+        if not _pid_alive(pid):
+            stale.append(filename)
+            continue
+        previous = newest.get(pid)
+        if previous is None or started > previous[0]:
+            if previous is not None:
+                stale.append(previous[1])
+            newest[pid] = (started, filename)
+        else:
+            stale.append(filename)
+    for filename in stale:
+        try:
+            os.remove(os.path.join(directory, filename))
+        except FileNotFoundError:
+            pass
+    return sorted(filename for started, filename in newest.values())
+
+
+def load_worker_snapshots(directory):
+    """Return {worker name: snapshot} for the dump of every live worker."""
+    snapshots = {}
+    for filename in _live_dumps(directory):
+        try:
+            with open(os.path.join(directory, filename)) as dump_file:
+                snapshots[filename[8:-5]] = json.load(dump_file)
+        except (OSError, ValueError):
+            # a worker may be replacing its file right now
+            continue
+    return snapshots
+
+
+def merge_snapshots(snapshots):
+    merged = {}
+    for snapshot in snapshots:
+        for name, family in snapshot.items():
+            target = merged.setdefault(name, dict(family, samples={}))
+            for labelvalues, value in family['samples']:
+                key = tuple(labelvalues)
+                current = target['samples'].get(key)
+                if current is None:
+                    target['samples'][key] = (
+                        dict(value, counts=list(value['counts']))
+                        if isinstance(value, dict) else value)
+                elif family['kind'] == 'gauge':
+                    # gauges do not add up across workers; report the worst
+                    target['samples'][key] = max(current, value)
+                elif isinstance(value, dict):
+                    current['counts'] = [a + b for a, b in zip(current['counts'], value['counts'])]
+                    current['sum'] += value['sum']
+                else:
+                    target['samples'][key] = current + value
+    for family in merged.values():
+        family['samples'] = [list(item) for item in family['samples'].items()]
+    return merged
+
+
+def label_snapshots(snapshots, labelname='worker'):
+    """Combine {worker: snapshot} into one snapshot with a worker label."""
+    combined = {}
+    for worker, snapshot in snapshots.items():
+        for name, family in snapshot.items():
+            target = combined.setdefault(name, dict(
+                family, labelnames=family['labelnames'] + [labelname], samples=[]))
+            target['samples'].extend(
+                [labelvalues + [worker], value] for labelvalues, value in family['samples'])
+    return combined
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{%s}' % ','.join('%s="%s"' % (name, _escape(value)) for name, value in pairs)
+
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return str(value)
+
+
+def render(snapshot):
+    """Render a snapshot in the Prometheus text format (version 0.0.4)."""
+    lines = []
+    for name in sorted(snapshot):
+        family = snapshot[name]
+        lines.append('# HELP %s %s' % (name, family['help']))
+        lines.append('# TYPE %s %s' % (name, family['kind']))
+        names = family['labelnames']
+        for labelvalues, value in family['samples']:
+            if family['kind'] in ('counter', 'gauge'):
+                lines.append('%s%s %s' % (
+                    name, _labels(names, labelvalues), _number(value)))
+                continue
+            cumulative = 0
+            bounds = list(family['buckets']) + [float('inf')]
+            for bound, count in zip(bounds, value['counts']):
+                cumulative += count
+                lines.append('%s_bucket%s %d' % (
+                    name,
+                    _labels(names, labelvalues, [('le', _number(bound))]),
+                    cumulative))
+            lines.append('%s_sum%s %s' % (
+                name, _labels(names, labelvalues), _number(value['sum'])))
+            lines.append('%s_count%s %d' % (
+                name, _labels(names, labelvalues), cumulative))
+    return '\n'.join(lines) + '\n'
+
+
+class QueryTimer:
+    """
+    Execute wrapper that counts queries and the time spent in them, and
+    notices SQLite "database is locked" errors.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.busy = 0
+        self.lock_wait = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        except OperationalError as error:
+            if 'locked' in str(error) or 'busy' in str(error):
+                self.busy += 1
+                self.lock_wait += time.perf_counter() - start
+            raise
+        finally:
+            self.count += 1
+            self.duration += time.perf_counter() - start
+
+
+registry = MetricsRegistry()
+
+REQUEST_LATENCY = registry.histogram(
+    'courseinfo_request_duration_seconds',
+    'Time spent handling a request, by URL name.',
+    ('url_name',))
+REQUEST_QUERIES = registry.histogram(
+    'courseinfo_request_queries',
+    'Number of database queries per request, by URL name.',
+    ('url_name',), buckets=QUERY_COUNT_BUCKETS)
+REQUEST_DB_TIME = registry.histogram(
+    'courseinfo_request_db_duration_seconds',
+    'Time spent in database queries per request, by URL name.',
+    ('url_name',))
+RESPONSE_SIZE = registry.histogram(
+    'courseinfo_response_size_bytes',
+    'Size of non-streaming response bodies, by URL name.',
+    ('url_name',), buckets=SIZE_BUCKETS)
+CACHE_REQUESTS = registry.counter(
+    'courseinfo_cache_requests_total',
+    'Cache lookups by cache and result; hit ratio is hit / (hit + miss).',
+    ('cache', 'result'))
+SQLITE_BUSY = registry.counter(
+    'courseinfo_sqlite_busy_total',
+    'Statements that failed because the SQLite database was locked.',
+    ('url_name',))
+SQLITE_LOCK_WAIT = registry.counter(
+    'courseinfo_sqlite_lock_wait_seconds_total',
+    'Time spent waiting on SQLite locks by statements that ended up busy.',
+    ('url_name',))
+STATEMENT_TIMEOUTS = registry.counter(
+    'courseinfo_statement_timeouts_total',
+    'Requests answered with a 503 because a statement ran past its deadline.',
+    ('url_name',))
+REPLICA_LAG = registry.gauge(
+    'courseinfo_replica_lag_seconds',
+    'Age of the read replica snapshot at the last refresher check.')
+REPLICA_REFRESHES = registry.counter(
+    'courseinfo_replica_refreshes_total',
+    'Read replica refreshes by result.',
+    ('result',))
+JOBS = registry.counter(
+    'courseinfo_jobs_total',
+    'Background job runs by task and outcome (succeeded, retried, failed, lost).',
+    ('task', 'outcome'))
+JOB_DURATION = registry.histogram(
+    'courseinfo_job_duration_seconds',
+    'Time spent running background jobs, by task.',
+    ('task',), buckets=JOB_DURATION_BUCKETS)
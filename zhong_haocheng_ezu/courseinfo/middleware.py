@@ -0,0 +1,388 @@
+import cProfile
+import os
+import random
+import threading
+import time
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connection, connections
+from django.http import HttpResponse
+
+from courseinfo import deadlines, identitymap, instrumentation, metrics, profiling, replica, tracing
+
+
+def url_name_for(request):
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return 'unresolved'
+    return match.url_name or match.view_name
+
+
+class RequestContextMiddleware:
+    """Make the current request available to instrumentation hooks."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        token = instrumentation.bind_request(request)
+        try:
+            return self.get_response(request)
+        finally:
+            instrumentation.unbind_request(token)
+
+
+class IdentityMapMiddleware:
+    """Give each request its own identity map (see courseinfo.identitymap)."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with identitymap.active():
+            return self.get_response(request)
+
+
+class MetricsMiddleware:
+    """
+    Record request latency, query counts, DB time and response sizes per
+    URL name. Queries are counted on every database alias, the read
+    replica included. Keep this first in MIDDLEWARE so the whole stack is
+    timed.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        timer = metrics.QueryTimer()
+        start = time.perf_counter()
+        with ExitStack() as stack:
+            for alias_connection in connections.all():
+                stack.enter_context(alias_connection.execute_wrapper(timer))
+            response = self.get_response(request)
+        duration = time.perf_counter() - start
+
+        url_name = url_name_for(request)
+        metrics.REQUEST_LATENCY.observe(duration, url_name)
+        metrics.REQUEST_QUERIES.observe(timer.count, url_name)
+        metrics.REQUEST_DB_TIME.observe(timer.duration, url_name)
+        if not response.streaming:
+            metrics.RESPONSE_SIZE.observe(len(response.content), url_name)
+        if timer.busy:
+            metrics.SQLITE_BUSY.inc(url_name, amount=timer.busy)
+            metrics.SQLITE_LOCK_WAIT.inc(url_name, amount=timer.lock_wait)
+        metrics.registry.maybe_dump()
+        return response
+
+
+class ServerTimingMiddleware:
+    """
+    Add a Server-Timing header splitting the request into middleware, URL
+    resolving, permission checks, ORM queries, template rendering and view
+    self time. Enabled for staff users or with a signed 'server-timing'
+    debug token (see the debug_token management command). The resolve
+    phase needs ServerTimingResolveMiddleware at the end of MIDDLEWARE.
+    """
+    feature = 'server-timing'
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        request._server_timing_start = time.perf_counter()
+        request._server_timing = None
+        with ExitStack() as stack:
+            request._server_timing_stack = stack
+            if instrumentation.has_debug_token(request, self.feature):
+                self._start(request, stack)
+            response = self.get_response(request)
+            timeline = request._server_timing
+            if timeline is not None:
+                timeline.exit()
+                instrumentation.deactivate(request._server_timing_token)
+        if timeline is not None:
+            timeline.add('total', time.perf_counter() - request._server_timing_start)
+            timeline.descriptions['db'] = '%d queries' % timeline.query_count
+            response['Server-Timing'] = timeline.server_timing()
+        return response
+
+    def _start(self, request, stack):
+        timeline = instrumentation.Timeline()
+        request._server_timing = timeline
+        request._server_timing_token = instrumentation.activate(timeline)
+        stack.enter_context(connection.execute_wrapper(timeline))
+        timeline.enter('mw', 'middleware (request phase)')
+        return timeline
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        timeline = request._server_timing
+        if timeline is None:
+            if not (getattr(settings, 'COURSEINFO_SERVER_TIMING_FOR_STAFF', True)
+                    and instrumentation.is_staff(request)):
+                return None
+            elapsed = time.perf_counter() - request._server_timing_start
+            timeline = self._start(request, request._server_timing_stack)
+            timeline.add('mw', elapsed)
+        timeline.exit()
+
+        # Django resolved the URL between the innermost middleware and the
+        # process_view() calls; move that share out of 'mw'.
+        resolve_start = getattr(request, '_server_timing_resolve_start', None)
+        if resolve_start is not None:
+            duration = time.perf_counter() - resolve_start
+            timeline.add('resolve', duration)
+            timeline.add('mw', -duration)
+
+        timeline.enter('view', 'view (self time)')
+        return None
+
+
+class ServerTimingResolveMiddleware:
+    """
+    Mark the start of URL resolving for ServerTimingMiddleware. Place last
+    in MIDDLEWARE.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        request._server_timing_resolve_start = time.perf_counter()
+        return self.get_response(request)
+
+
+class ProfilerMiddleware:
+    """
+    Profile a single request for staff users sending a signed 'profile'
+    debug token. ?_profile=sample records collapsed stacks with a
+    sampling profiler instead of running the request under cProfile.
+    Captured profiles are listed at /debug/profiles. Place after
+    AuthenticationMiddleware.
+    """
+    feature = 'profile'
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        # the token check is cheap; is_staff loads the session and user
+        if not (instrumentation.has_debug_token(request, self.feature)
+                and request.user.is_staff):
+            return self.get_response(request)
+
+        store = profiling.profile_store()
+        if request.GET.get('_profile') == 'sample':
+            sampler = profiling.ThreadSampler(
+                threading.get_ident(),
+                getattr(settings, 'COURSEINFO_PROFILE_SAMPLE_INTERVAL', 0.001))
+            sampler.start()
+            try:
+                response = self.get_response(request)
+            finally:
+                stacks = sampler.stop()
+            path = store.new_path(url_name_for(request), 'folded')
+            profiling.write_collapsed(stacks, path)
+        else:
+            profiler = cProfile.Profile()
+            response = profiler.runcall(self.get_response, request)
+            path = store.new_path(url_name_for(request), 'pstats')
+            profiler.dump_stats(path)
+        store.prune()
+        response['X-Courseinfo-Profile'] = os.path.basename(path)
+        return response
+
+
+class SamplingMiddleware:
+    """
+    Tell the background sampler which URL name each request thread is
+    serving. Does nothing unless a sampler was started from wsgi.py or
+    asgi.py.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if profiling.background_sampler is None:
+            return self.get_response(request)
+        thread_id = threading.get_ident()
+        profiling.active_requests[thread_id] = 'middleware'
+        try:
+            return self.get_response(request)
+        finally:
+            profiling.active_requests.pop(thread_id, None)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        thread_id = threading.get_ident()
+        if thread_id in profiling.active_requests:
+            profiling.active_requests[thread_id] = url_name_for(request)
+        return None
+
+
+class TemplateTimingMiddleware:
+    """
+    Collect render time and call counts per template and per block for
+    staff users and requests with a signed 'template-timing' debug token,
+    which get them in an X-Template-Timing header, or for every request
+    with COURSEINFO_TEMPLATE_TIMING. Totals feed the staff report at
+    /debug/templates. Place after AuthenticationMiddleware.
+    """
+    feature = 'template-timing'
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        wants_header = (
+            instrumentation.has_debug_token(request, self.feature)
+            or instrumentation.is_staff(request))
+        if not (wants_header or getattr(settings, 'COURSEINFO_TEMPLATE_TIMING', False)):
+            return self.get_response(request)
+        stats = instrumentation.RenderStats()
+        token = instrumentation.activate_render_stats(stats)
+        try:
+            response = self.get_response(request)
+        finally:
+            instrumentation.deactivate_render_stats(token)
+        instrumentation.render_report.add(stats)
+        if wants_header and stats.entries:
+            response['X-Template-Timing'] = stats.header()
+        return response
+
+
+class TracingMiddleware:
+    """
+    Record a trace for a sampled fraction of requests, or for requests
+    carrying a signed 'trace' debug token, and export it as JSONL. See
+    courseinfo.tracing.
+    """
+    feature = 'trace'
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        rate = getattr(settings, 'COURSEINFO_TRACE_SAMPLE_RATE', 0.0)
+        if not (random.random() < rate
+                or instrumentation.has_debug_token(request, self.feature)):
+            return self.get_response(request)
+
+        trace_token = tracing.begin_trace()
+        root, root_token = tracing.open_span(
+            request.method, tracing.KIND_SERVER,
+            **{'http.method': request.method, 'http.target': request.get_full_path()})
+        request._trace_middleware_span = tracing.open_span('middleware')
+        try:
+            with connection.execute_wrapper(tracing.query_span):
+                response = self.get_response(request)
+        finally:
+            if request._trace_middleware_span is not None:
+                tracing.close_span(*request._trace_middleware_span)
+        url_name = url_name_for(request)
+        root.name = '%s %s' % (request.method, url_name)
+        root.attributes['http.route'] = url_name
+        root.attributes['http.status_code'] = response.status_code
+        if response.status_code >= 500:
+            root.status = tracing.STATUS_ERROR
+        tracing.close_span(root, root_token)
+        tracing.export(tracing.end_trace(trace_token))
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        middleware_span = getattr(request, '_trace_middleware_span', None)
+        if middleware_span is not None:
+            tracing.close_span(*middleware_span)
+            request._trace_middleware_span = None
+        return None
+
+
+class MemoryProfileMiddleware:
+    """
+    Run a request under tracemalloc for staff users sending a signed
+    'memory' debug token. The peak is returned in X-Memory-Peak and the
+    report, with the top allocation sites, is listed at /debug/memory.
+    Place after AuthenticationMiddleware.
+    """
+    feature = 'memory'
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not (instrumentation.has_debug_token(request, self.feature)
+                and request.user.is_staff):
+            return self.get_response(request)
+        response, report = profiling.measure_memory(self.get_response, request)
+        report.update({
+            'url_name': url_name_for(request),
+            'path': request.get_full_path(),
+            'time': time.time(),
+        })
+        profiling.memory_reports.appendleft(report)
+        response['X-Memory-Peak'] = str(report['peak'])
+        return response
+
+
+class ReplicaStickinessMiddleware:
+    """
+    Route a session's courseinfo reads to the primary for a while after it
+    wrote, so it reads its own writes (see courseinfo.replica). Must follow
+    SessionMiddleware.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        session = getattr(request, 'session', None)
+        now = time.time()
+        primary = session is not None and session.get(replica.SESSION_KEY, 0) > now
+        token = replica.begin_request(primary)
+        try:
+            response = self.get_response(request)
+        finally:
+            wrote = replica.end_request(token)
+        if wrote and session is not None:
+            session[replica.SESSION_KEY] = now + getattr(
+                settings, 'COURSEINFO_REPLICA_STICKY_SECONDS', 15.0)
+        return response
+
+
+class StatementDeadlineMiddleware:
+    """
+    Give each request a statement deadline (see courseinfo.deadlines): the
+    view's `statement_timeout` attribute, or COURSEINFO_STATEMENT_TIMEOUT
+    seconds from the start of the request. Requests whose statements ran
+    past it get a 503 with a Retry-After header.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        request._statement_deadline_start = time.monotonic()
+        token = deadlines.set_deadline(getattr(settings, 'COURSEINFO_STATEMENT_TIMEOUT', None))
+        try:
+            return self.get_response(request)
+        finally:
+            deadlines.reset_deadline(token)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        view_class = getattr(view_func, 'view_class', None)
+        timeout = getattr(view_class, 'statement_timeout', None)
+        if timeout is not None:
+            elapsed = time.monotonic() - request._statement_deadline_start
+            deadlines.set_deadline(timeout - elapsed)
+        return None
+
+    def process_exception(self, request, exception):
+        if not deadlines.is_timeout(exception):
+            return None
+        metrics.STATEMENT_TIMEOUTS.inc(url_name_for(request))
+        response = HttpResponse(
+            'The server is busy; please try again shortly.\n',
+            content_type='text/plain', status=503)
+        response['Retry-After'] = str(getattr(settings, 'COURSEINFO_STATEMENT_RETRY_AFTER', 5))
+        return response
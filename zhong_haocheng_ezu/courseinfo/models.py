@@ -1,13 +1,20 @@
 from django.db import models
 from django.db.models import UniqueConstraint
-from django.urls import reverse
+from django.utils import timezone
 
+from courseinfo import refdata
+from courseinfo.identitymap import IdentityMapForeignKey, IdentityMapModel
+from courseinfo.querycache import CachedQuerySet
+from courseinfo.urlcache import reverse
 
-class Period(models.Model):
+
+class Period(IdentityMapModel):
     period_id = models.AutoField(primary_key=True)
     period_sequence = models.IntegerField(unique=True)
     period_name = models.CharField(max_length=45, unique=45)
 
+    objects = CachedQuerySet.as_manager()
+
     def __str__(self):
         return '%s' % self.period_name
 
@@ -15,10 +22,12 @@ class Period(models.Model):
         ordering = ['period_sequence']
 
 
-class Year(models.Model):
+class Year(IdentityMapModel):
     year_id = models.AutoField(primary_key=True)
     year = models.IntegerField(unique=True)
 
+    objects = CachedQuerySet.as_manager()
+
     def __str__(self):
         return '%s' % self.year
 
@@ -26,13 +35,17 @@ class Year(models.Model):
         ordering = ['year']
 
 
-class Semester(models.Model):
+class Semester(IdentityMapModel):
     semester_id = models.AutoField(primary_key=True)
-    year = models.ForeignKey(Year, related_name="semesters", on_delete=models.PROTECT)
-    period = models.ForeignKey(Period, related_name="semesters", on_delete=models.PROTECT)
+    year = IdentityMapForeignKey(Year, related_name="semesters", on_delete=models.PROTECT)
+    period = IdentityMapForeignKey(Period, related_name="semesters", on_delete=models.PROTECT)
+
+    objects = CachedQuerySet.as_manager()
 
     def __str__(self):
-        return '%s - %s' % (self.year.year, self.period.period_name)
+        year = refdata.years.get(self.year_id) or self.year
+        period = refdata.periods.get(self.period_id) or self.period
+        return '%s - %s' % (year.year, period.period_name)
 
     def get_absolute_url(self):
         return reverse('courseinfo_semester_detail_urlpattern',
@@ -53,11 +66,13 @@ class Semester(models.Model):
         ]
 
 
-class Course(models.Model):
+class Course(IdentityMapModel):
     course_id = models.AutoField(primary_key=True)
     course_number = models.CharField(max_length=20)
     course_name = models.CharField(max_length=255)
 
+    objects = CachedQuerySet.as_manager()
+
     def __str__(self):
         return '%s - %s' % (self.course_number, self.course_name)
 
@@ -80,12 +95,14 @@ class Course(models.Model):
         ]
 
 
-class Instructor(models.Model):
+class Instructor(IdentityMapModel):
     instructor = models.AutoField(primary_key=True)
     first_name = models.CharField(max_length=45)
     last_name = models.CharField(max_length=45)
     disambiguator = models.CharField(max_length=45, blank=True, default='')
 
+    objects = CachedQuerySet.as_manager()
+
     def __str__(self):
         result = ''
         if self.disambiguator == '':
@@ -114,12 +131,14 @@ class Instructor(models.Model):
         ]
 
 
-class Student(models.Model):
+class Student(IdentityMapModel):
     student_id = models.AutoField(primary_key=True)
     first_name = models.CharField(max_length=45)
     last_name = models.CharField(max_length=45)
     disambiguator = models.CharField(max_length=45, blank=True, default='')
 
+    objects = CachedQuerySet.as_manager()
+
     def __str__(self):
         result = ''
         if self.disambiguator == '':
@@ -148,12 +167,14 @@ class Student(models.Model):
         ]
 
 
-class Section(models.Model):
+class Section(IdentityMapModel):
     section_id = models.AutoField(primary_key=True)
     section_name = models.CharField(max_length=20)
-    semester = models.ForeignKey(Semester, related_name='sections', on_delete=models.PROTECT)
-    course = models.ForeignKey(Course, related_name='sections', on_delete=models.PROTECT)
-    instructor = models.ForeignKey(Instructor, related_name='sections', on_delete=models.PROTECT)
+    semester = IdentityMapForeignKey(Semester, related_name='sections', on_delete=models.PROTECT)
+    course = IdentityMapForeignKey(Course, related_name='sections', on_delete=models.PROTECT)
+    instructor = IdentityMapForeignKey(Instructor, related_name='sections', on_delete=models.PROTECT)
+
+    objects = CachedQuerySet.as_manager()
 
     def __str__(self):
         return '%s - %s (%s)' % (self.course.course_number, self.section_name, self.semester.__str__())
@@ -178,10 +199,12 @@ class Section(models.Model):
         ]
 
 
-class Registration(models.Model):
+class Registration(IdentityMapModel):
     registration_id = models.AutoField(primary_key=True)
-    student = models.ForeignKey(Student, related_name='registrations', on_delete=models.PROTECT)
-    section = models.ForeignKey(Section, related_name='registrations', on_delete=models.PROTECT)
+    student = IdentityMapForeignKey(Student, related_name='registrations', on_delete=models.PROTECT)
+    section = IdentityMapForeignKey(Section, related_name='registrations', on_delete=models.PROTECT)
+
+    objects = CachedQuerySet.as_manager()
 
     def __str__(self):
         return '%s / %s' % (self.section, self.student)
@@ -205,3 +228,54 @@ class Registration(models.Model):
             UniqueConstraint(fields=['section', 'student'],
                              name='unique_registration')
         ]
+
+
+class Job(models.Model):
+    """A background job run by the runjobs command (see courseinfo.jobs)."""
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    SUCCEEDED = 'succeeded'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (QUEUED, 'Queued'),
+        (RUNNING, 'Running'),
+        (SUCCEEDED, 'Succeeded'),
+        (FAILED, 'Failed'),
+    ]
+
+    job_id = models.AutoField(primary_key=True)
+    task = models.CharField(max_length=100)
+    arguments = models.JSONField(default=dict, blank=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=QUEUED)
+    attempts = models.IntegerField(default=0)
+    max_attempts = models.IntegerField(default=3)
+    run_after = models.DateTimeField(default=timezone.now)
+    progress = models.IntegerField(default=0)
+    total = models.IntegerField(null=True, blank=True)
+    message = models.CharField(max_length=255, blank=True, default='')
+    result = models.JSONField(null=True, blank=True)
+    error = models.TextField(blank=True, default='')
+    worker = models.CharField(max_length=100, blank=True, default='')
+    created = models.DateTimeField(auto_now_add=True)
+    started = models.DateTimeField(null=True, blank=True)
+    heartbeat = models.DateTimeField(null=True, blank=True)
+    finished = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return '%s #%d' % (self.task, self.job_id)
+
+    def get_absolute_url(self):
+        return reverse('courseinfo_job_detail_urlpattern',
+                       kwargs={'pk': self.pk})
+
+    @property
+    def percent(self):
+        if not self.total:
+            return None
+        return min(100, 100 * self.progress // self.total)
+
+    class Meta:
+        ordering = ['-created', '-job_id']
+        indexes = [
+            models.Index(fields=['status', 'run_after'], name='job_status_run_after'),
+        ]
@@ -0,0 +1,98 @@
+"""
+Full-page cache for the courseinfo list and detail pages.
+
+What a page shows for a given URL depends only on the data and on the
+viewer's courseinfo permissions (which buttons and nav links appear), so
+pages are shared between users with the same permission set. The key is
+the URL, a hash of that permission set and the versions of the tables the
+page is built from (see courseinfo.versions), so writes invalidate it.
+
+The only per-user text, the username in base.html, is rendered as a
+placeholder and filled in when the page is served. Pages that rendered a
+CSRF token are never stored, since the token belongs to one session.
+"""
+import hashlib
+
+from django.conf import settings
+from django.core.cache import caches
+from django.http import HttpResponse
+from django.utils.cache import patch_cache_control, patch_vary_headers
+from django.utils.html import escape
+
+from courseinfo import versions
+
+KEY_PREFIX = 'courseinfo:page:'
+USERNAME_PLACEHOLDER = '__courseinfo_page_cache_username__'
+
+
+def _cache():
+    return caches[getattr(settings, 'COURSEINFO_PAGE_CACHE', 'default')]
+
+
+def permission_hash(user):
+    """Hash of the user's effective courseinfo permissions."""
+    permissions = sorted(
+        permission for permission in user.get_all_permissions()
+        if permission.startswith(versions.APP_LABEL + '.'))
+    return hashlib.sha1(','.join(permissions).encode()).hexdigest()
+
+
+def is_cacheable(request):
+    return (request.method in ('GET', 'HEAD')
+            and request.user.is_authenticated
+            and getattr(settings, 'COURSEINFO_PAGE_CACHE_TIMEOUT', 300))
+
+
+def page_key(request, models):
+    table_versions = versions.model_versions(models)
+    digest = hashlib.sha1(repr(
+        (request.get_full_path(), permission_hash(request.user),
+         sorted(table_versions.items()))).encode()).hexdigest()
+    return KEY_PREFIX + digest
+
+
+def page_etag(request, models):
+    """
+    ETag for the page at this URL as this user sees it: the username is on
+    every page, so unlike page_key() it includes the user.
+    """
+    table_versions = versions.model_versions(models)
+    digest = hashlib.sha1(repr(
+        (request.get_full_path(), request.user.pk, permission_hash(request.user),
+         sorted(table_versions.items()))).encode()).hexdigest()
+    return '"%s"' % digest
+
+
+def _personalize(content, request):
+    return content.replace(
+        USERNAME_PLACEHOLDER.encode(),
+        escape(request.user.get_username()).encode())
+
+
+def _mark_private(response, state):
+    # the page is only shared between users with the same permissions
+    patch_vary_headers(response, ('Cookie',))
+    patch_cache_control(response, private=True)
+    response['X-Page-Cache'] = state
+
+
+def get(key, request):
+    """Return the cached page as a response for this user, or None."""
+    cached = _cache().get(key)
+    if cached is None:
+        return None
+    content, content_type = cached
+    response = HttpResponse(_personalize(content, request), content_type=content_type)
+    _mark_private(response, 'hit')
+    return response
+
+
+def store(key, request, response):
+    """Post-render callback: cache the page if it is safe to share."""
+    if (response.status_code == 200 and not response.streaming
+            and not response.cookies
+            and not request.META.get('CSRF_COOKIE_USED')):
+        _cache().set(key, (response.content, response['Content-Type']),
+                     getattr(settings, 'COURSEINFO_PAGE_CACHE_TIMEOUT', 300))
+    response.content = _personalize(response.content, request)
+    _mark_private(response, 'miss')
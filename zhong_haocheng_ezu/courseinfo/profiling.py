@@ -0,0 +1,251 @@
+"""
+Profiling helpers: stack samplers that produce collapsed stacks (the
+input format of flamegraph.pl and speedscope), a bounded directory of
+captured profiles and tracemalloc-based memory profiling.
+"""
+import atexit
+import os
+import re
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from collections import Counter, deque
+
+from django.conf import settings
+
+
+# keyed by location rather than by code object: code objects created at
+# run time (exec, lambdas in reloaded modules) would otherwise be kept
+# alive and grow the dict without bound
+_code_labels = {}
+
+
+def _code_label(code):
+    key = (code.co_filename, code.co_firstlineno, code.co_name)
+    label = _code_labels.get(key)
+    if label is None:
+        label = _code_labels[key] = '%s (%s:%d)' % (
+            code.co_name, os.path.basename(code.co_filename), code.co_firstlineno)
+    return label
+
+
+def collapse(frame):
+    """Return the collapsed-stack line for a frame, outermost call first."""
+    parts = []
+    while frame is not None:
+        parts.append(_code_label(frame.f_code))
+        frame = frame.f_back
+    return ';'.join(reversed(parts))
+
+
+def write_collapsed(stacks, path):
+    with open(path, 'w') as folded_file:
+        for stack, count in stacks.most_common():
+            folded_file.write('%s %d\n' % (stack, count))
+
+
+class ThreadSampler(threading.Thread):
+    """Sample one thread's stack every `interval` seconds until stopped."""
+
+    def __init__(self, thread_id, interval):
+        super().__init__(name='courseinfo-thread-sampler', daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is not None:
+                self.stacks[collapse(frame)] += 1
+
+    def stop(self):
+        self._stopped.set()
+        self.join()
+        return self.stacks
+
+
+# thread id -> URL name of the request the thread is handling; maintained
+# by SamplingMiddleware while a BackgroundSampler is running
+active_requests = {}
+
+
+class BackgroundSampler(threading.Thread):
+    """
+    Sample the stacks of threads that are handling requests `hz` times a
+    second, aggregating collapsed stacks under the request's URL name, and
+    rewrite `path` with the cumulative totals every `flush_interval`
+    seconds.
+    """
+
+    def __init__(self, hz, path, flush_interval):
+        super().__init__(name='courseinfo-background-sampler', daemon=True)
+        self.interval = 1.0 / hz
+        self.path = path
+        self.flush_interval = flush_interval
+        self.stacks = Counter()
+        self.samples = 0
+        self._stopped = threading.Event()
+        self._lock = threading.Lock()
+
+    def run(self):
+        next_flush = time.monotonic() + self.flush_interval
+        while not self._stopped.wait(self.interval):
+            self.sample()
+            if time.monotonic() >= next_flush:
+                self.flush()
+                next_flush = time.monotonic() + self.flush_interval
+
+    def sample(self):
+        if not active_requests:
+            return
+        frames = sys._current_frames()
+        with self._lock:
+            for thread_id, url_name in list(active_requests.items()):
+                frame = frames.get(thread_id)
+                if frame is not None:
+                    self.stacks[url_name + ';' + collapse(frame)] += 1
+                    self.samples += 1
+
+    def flush(self):
+        directory = os.path.dirname(self.path)
+        os.makedirs(directory, exist_ok=True)
+        with self._lock:
+            stacks = Counter(self.stacks)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        os.close(fd)
+        write_collapsed(stacks, tmp_path)
+        os.replace(tmp_path, self.path)
+
+    def stop(self):
+        self._stopped.set()
+        self.join()
+        self.flush()
+
+
+background_sampler = None
+
+
+def start_background_sampler():
+    """
+    Start this process's BackgroundSampler if COURSEINFO_SAMPLER_ENABLED.
+    Called from wsgi.py and asgi.py; forked workers start their own.
+    """
+    global background_sampler
+    if not getattr(settings, 'COURSEINFO_SAMPLER_ENABLED', False):
+        return None
+    if background_sampler is not None and background_sampler.is_alive():
+        return background_sampler
+    directory = str(getattr(settings, 'COURSEINFO_SAMPLER_DIR', 'samples'))
+    background_sampler = BackgroundSampler(
+        getattr(settings, 'COURSEINFO_SAMPLER_HZ', 100),
+        os.path.join(directory, 'samples-%d.folded' % os.getpid()),
+        getattr(settings, 'COURSEINFO_SAMPLER_FLUSH_INTERVAL', 60))
+    background_sampler.start()
+    return background_sampler
+
+
+def stop_background_sampler():
+    global background_sampler
+    if background_sampler is not None and background_sampler.is_alive():
+        background_sampler.stop()
+    background_sampler = None
+
+
+def _restart_in_child():
+    global background_sampler
+    # the parent's thread does not exist in a forked worker
+    if background_sampler is not None:
+        background_sampler = None
+        active_requests.clear()
+        start_background_sampler()
+
+
+os.register_at_fork(after_in_child=_restart_in_child)
+atexit.register(stop_background_sampler)
+
+
+class ProfileStore:
+    """A directory that keeps at most `max_files` captured profiles."""
+    filename_re = re.compile(r'^[\w.-]+\.(pstats|folded)$')
+
+    def __init__(self, directory, max_files):
+        self.directory = str(directory)
+        self.max_files = max_files
+
+    def new_path(self, label, extension):
+        os.makedirs(self.directory, exist_ok=True)
+        stamp = time.strftime('%Y%m%dT%H%M%S') + '%03d' % (time.time() % 1 * 1000)
+        label = re.sub(r'[^\w.-]+', '_', label).strip('_')[:60] or 'request'
+        return os.path.join(
+            self.directory, '%s-%s-%d.%s' % (stamp, label, os.getpid(), extension))
+
+    def list(self):
+        if not os.path.isdir(self.directory):
+            return []
+        profiles = []
+        for filename in os.listdir(self.directory):
+            if self.filename_re.match(filename):
+                stat = os.stat(os.path.join(self.directory, filename))
+                profiles.append({'name': filename, 'size': stat.st_size,
+                                 'modified': stat.st_mtime})
+        return sorted(profiles, key=lambda profile: profile['modified'], reverse=True)
+
+    def path(self, filename):
+        """Return the path of a stored profile, or None for unknown names."""
+        if not self.filename_re.match(filename):
+            return None
+        path = os.path.join(self.directory, filename)
+        return path if os.path.isfile(path) else None
+
+    def prune(self):
+        for profile in self.list()[self.max_files:]:
+            try:
+                os.remove(os.path.join(self.directory, profile['name']))
+            except FileNotFoundError:
+                pass
+
+
+def profile_store():
+    return ProfileStore(
+        getattr(settings, 'COURSEINFO_PROFILE_DIR', 'profiles'),
+        getattr(settings, 'COURSEINFO_PROFILE_MAX_FILES', 50))
+
+
+_memory_lock = threading.Lock()
+memory_reports = deque(maxlen=20)
+
+
+def measure_memory(function, *args, top=10, **kwargs):
+    """
+    Call function under tracemalloc. Returns (result, report) where report
+    holds the peak traced memory during the call and the top allocation
+    sites by growth. tracemalloc is process-wide, so allocations made by
+    other threads meanwhile are counted too; calls are serialized.
+    """
+    with _memory_lock:
+        started = not tracemalloc.is_tracing()
+        if started:
+            tracemalloc.start()
+        try:
+            before = tracemalloc.take_snapshot()
+            baseline = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+            result = function(*args, **kwargs)
+            current, peak = tracemalloc.get_traced_memory()
+            after = tracemalloc.take_snapshot()
+        finally:
+            if started:
+                tracemalloc.stop()
+    report = {
+        'peak': peak - baseline,
+        'retained': current - baseline,
+        'top': [
+            {'site': str(stat.traceback[0]), 'size': stat.size_diff, 'count': stat.count_diff}
+            for stat in after.compare_to(before, 'lineno')[:top]
+        ],
+    }
+    return result, report
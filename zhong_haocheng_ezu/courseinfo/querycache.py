@@ -0,0 +1,161 @@
+"""
+Query-result cache for the courseinfo models.
+
+CachedQuerySet.cached() opts a queryset in: its results are stored in a
+per-process LRU keyed by the SQL, the parameters and the current version
+of every table the SQL reads (see courseinfo.versions). Writes bump the
+versions, so stale results are never looked up again and age out of the
+LRU, which is capped at COURSEINFO_QUERY_CACHE_MAX_BYTES of pickled rows.
+Results read inside a transaction are not stored: they may include the
+transaction's own uncommitted writes, which a rollback would leave cached
+under the current versions.
+"""
+import hashlib
+import pickle
+import re
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.exceptions import EmptyResultSet
+from django.db import connections, models
+from django.db.models.query import ModelIterable
+
+from courseinfo import identitymap, metrics, versions
+
+_TABLE_RE = re.compile(r'\b(?:FROM|JOIN)\s+"([^"]+)"')
+
+
+class ResultCache:
+    """A thread-safe LRU of pickled results with a total size cap."""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+
+    def get(self, key):
+        with self.lock:
+            data = self.entries.get(key)
+            if data is None:
+                return None
+            self.entries.move_to_end(key)
+        return pickle.loads(data)
+
+    def set(self, key, value):
+        data = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        if len(data) > self.max_bytes // 4:
+            return
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.size -= len(old)
+            self.entries[key] = data
+            self.size += len(data)
+            while self.size > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.size -= len(evicted)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+
+result_cache = ResultCache(
+    getattr(settings, 'COURSEINFO_QUERY_CACHE_MAX_BYTES', 16 * 1024 * 1024))
+
+
+def cache_key(kind, query, using):
+    """Key for a query's results, or None if it cannot be cached."""
+    try:
+        sql, params = query.sql_with_params()
+    except EmptyResultSet:
+        return None
+    tables = set(_TABLE_RE.findall(sql))
+    if not tables or not tables <= versions.tracked_tables():
+        return None
+    table_versions = versions.table_versions(sorted(tables))
+    digest = hashlib.sha1(repr(
+        (kind, using, sql, params, sorted(table_versions.items()))).encode()).hexdigest()
+    return '%s:%s' % (kind, digest)
+
+
+class CachedQuerySet(models.QuerySet):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._use_result_cache = False
+
+    def cached(self, enabled=True):
+        """Serve this queryset's results from the query-result cache."""
+        clone = self._chain()
+        clone._use_result_cache = enabled
+        return clone
+
+    def _clone(self):
+        clone = super()._clone()
+        clone._use_result_cache = self._use_result_cache
+        return clone
+
+    def _storable(self):
+        # see the module docstring
+        return not connections[self.db].in_atomic_block
+
+    def _fetch_all(self):
+        if (self._result_cache is None and self._use_result_cache
+                and not self._prefetch_related_lookups):
+            key = cache_key('rows:%s' % self._iterable_class.__name__, self.query, self.db)
+            if key is not None:
+                rows = result_cache.get(key)
+                if rows is not None:
+                    metrics.CACHE_REQUESTS.inc('querycache', 'hit')
+                    if self._iterable_class is ModelIterable:
+                        for row in rows:
+                            identitymap.add(row)
+                    self._result_cache = rows
+                    return
+                metrics.CACHE_REQUESTS.inc('querycache', 'miss')
+                super()._fetch_all()
+                if self._storable():
+                    result_cache.set(key, self._result_cache)
+                return
+        super()._fetch_all()
+
+    def count(self):
+        if self._result_cache is None and self._use_result_cache:
+            key = cache_key('count', self.query, self.db)
+            if key is not None:
+                count = result_cache.get(key)
+                if count is None:
+                    metrics.CACHE_REQUESTS.inc('querycache', 'miss')
+                    count = super().count()
+                    if self._storable():
+                        result_cache.set(key, count)
+                else:
+                    metrics.CACHE_REQUESTS.inc('querycache', 'hit')
+                return count
+        return super().count()
+
+    # bulk operations do not send post_save/post_delete
+
+    def update(self, **kwargs):
+        rows = super().update(**kwargs)
+        versions.bump_model(self.model)
+        identitymap.discard_model(self.model)
+        return rows
+
+    update.alters_data = True
+
+    def bulk_create(self, *args, **kwargs):
+        objs = super().bulk_create(*args, **kwargs)
+        versions.bump_model(self.model)
+        return objs
+
+    def delete(self):
+        result = super().delete()
+        versions.bump_model(self.model)
+        return result
+
+    delete.alters_data = True
+    delete.queryset_only = True
@@ -0,0 +1,82 @@
+"""
+Per-worker cache of the Period and Year reference tables.
+
+Both tables are tiny and almost never change, so each worker loads them
+whole and answers lookups by primary key without queries. Every
+COURSEINFO_REFDATA_CHECK_INTERVAL seconds a lookup compares the table's
+version (see courseinfo.versions) with the one the rows were loaded at,
+which is how edits made in other workers are picked up; edits made in this
+worker invalidate it immediately. The cached instances are shared by all
+threads and must be treated as read-only.
+"""
+import threading
+import time
+
+from django.apps import apps
+from django.conf import settings
+from django.db.models.signals import post_delete, post_save
+
+from courseinfo import versions
+
+
+class ReferenceTable:
+    def __init__(self, model_name):
+        self.model_name = model_name
+        self._lock = threading.Lock()
+        self._rows = None
+        self._ordered = ()
+        self._version = None
+        self._checked = 0.0
+
+    @property
+    def model(self):
+        return apps.get_model(versions.APP_LABEL, self.model_name)
+
+    def _current(self):
+        if (self._rows is not None and time.monotonic() - self._checked
+                < getattr(settings, 'COURSEINFO_REFDATA_CHECK_INTERVAL', 1.0)):
+            return self._rows
+        with self._lock:
+            # the version is read first, so a write made during the load
+            # is picked up at the next check
+            version = versions.table_version(self.model._meta.db_table)
+            if self._rows is None or version != self._version:
+                ordered = tuple(self.model._default_manager.all())
+                self._rows = {row.pk: row for row in ordered}
+                self._ordered = ordered
+                self._version = version
+            self._checked = time.monotonic()
+            return self._rows
+
+    def get(self, pk):
+        """Return the row with this primary key, or None."""
+        row = self._current().get(pk)
+        if row is None and pk is not None:
+            # possibly added since the last check
+            self.invalidate()
+            row = self._current().get(pk)
+        return row
+
+    def all(self):
+        """All rows in the model's default ordering."""
+        self._current()
+        return self._ordered
+
+    def invalidate(self):
+        self._checked = 0.0
+
+
+periods = ReferenceTable('Period')
+years = ReferenceTable('Year')
+_tables = {'Period': periods, 'Year': years}
+
+
+def _reference_changed(sender, **kwargs):
+    table = _tables.get(sender.__name__)
+    if table is not None and sender._meta.app_label == versions.APP_LABEL:
+        table.invalidate()
+
+
+def connect_signals():
+    post_save.connect(_reference_changed, dispatch_uid='courseinfo_refdata_post_save')
+    post_delete.connect(_reference_changed, dispatch_uid='courseinfo_refdata_post_delete')
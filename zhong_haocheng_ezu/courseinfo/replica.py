@@ -0,0 +1,244 @@
+"""
+Read replica for the courseinfo models.
+
+The replica is a snapshot of the primary SQLite database at
+COURSEINFO_REPLICA_PATH, copied with the online backup API into a temporary
+file and renamed into place, so connections reading the previous snapshot
+are never blocked by a refresh. The replica database alias opens the
+snapshot read-only and without persistent connections, so each request
+reads the newest one.
+
+A ReplicaRefresher thread in each worker (started from wsgi.py and asgi.py
+when ReplicaRouter is in DATABASE_ROUTERS) keeps the snapshot newer than
+the last courseinfo write (see courseinfo.versions) and at most
+COURSEINFO_REPLICA_REFRESH_INTERVAL seconds old, adopting a snapshot
+another worker took when it is fresh enough. ReplicaRouter only compares
+that snapshot's time with the newest write time the process has seen, so
+routing costs no cache lookup or file access: it sends courseinfo reads
+to the replica while the snapshot is newer, and to the primary otherwise
+or while no refresher runs. The write time is fetched along with the
+table versions, so pages and query results cached under a version are
+never built from a snapshot older than it. Unversioned tables (the job
+queue) always use the primary.
+ReplicaStickinessMiddleware keeps a session that has just written on the
+primary for COURSEINFO_REPLICA_STICKY_SECONDS so it reads its own writes.
+"""
+import atexit
+import contextvars
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+
+from django.conf import settings
+from django.db import connections
+
+from courseinfo import metrics, versions
+
+logger = logging.getLogger('courseinfo.replica')
+
+PRIMARY = 'default'
+REPLICA = 'replica'
+SESSION_KEY = '_courseinfo_primary_until'
+
+
+class RequestState:
+    __slots__ = ('primary', 'wrote')
+
+    def __init__(self, primary):
+        self.primary = primary
+        self.wrote = False
+
+
+_request_state = contextvars.ContextVar('courseinfo_replica_state', default=None)
+_snapshot_time = None
+refresher = None
+
+
+def _path():
+    return str(settings.COURSEINFO_REPLICA_PATH)
+
+
+def _interval():
+    return getattr(settings, 'COURSEINFO_REPLICA_REFRESH_INTERVAL', 5.0)
+
+
+def refresh():
+    """Copy the primary into a new snapshot; returns the snapshot time."""
+    path = _path()
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    os.close(fd)
+    try:
+        params = connections[PRIMARY].get_connection_params()
+        params['check_same_thread'] = False
+        started = time.time()
+        source = sqlite3.connect(**params)
+        target = sqlite3.connect(tmp_path)
+        try:
+            source.backup(target)
+            # a WAL-mode header would need a -shm file to open read-only
+            target.execute('PRAGMA journal_mode = DELETE').fetchall()
+        finally:
+            target.close()
+            source.close()
+        os.utime(tmp_path, (started, started))
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return started
+
+
+def _stale(snapshot_time, now, last_write):
+    return (snapshot_time is None or snapshot_time <= last_write
+            or now - snapshot_time >= _interval())
+
+
+def update_snapshot():
+    """
+    Make sure there is a snapshot taken after the last courseinfo write and
+    at most COURSEINFO_REPLICA_REFRESH_INTERVAL seconds ago, taking one if
+    needed, and publish its time to the router.
+    """
+    global _snapshot_time
+    now = time.time()
+    last_write = versions.last_write_time()
+    snapshot_time = _snapshot_time
+    if _stale(snapshot_time, now, last_write):
+        try:
+            # another worker may have refreshed the shared snapshot
+            snapshot_time = os.stat(_path()).st_mtime
+        except FileNotFoundError:
+            snapshot_time = None
+    if _stale(snapshot_time, now, last_write):
+        try:
+            snapshot_time = refresh()
+            metrics.REPLICA_REFRESHES.inc('ok')
+        except Exception:
+            logger.exception('Refreshing the read replica failed')
+            metrics.REPLICA_REFRESHES.inc('error')
+    _snapshot_time = snapshot_time
+    if snapshot_time is not None:
+        metrics.REPLICA_LAG.set(time.time() - snapshot_time)
+
+
+class ReplicaRefresher(threading.Thread):
+    """Call update_snapshot() every `interval` seconds."""
+
+    def __init__(self, interval):
+        super().__init__(name='courseinfo-replica-refresher', daemon=True)
+        self.interval = interval
+        self._stopped = threading.Event()
+
+    def run(self):
+        while True:
+            try:
+                update_snapshot()
+            except Exception:
+                logger.exception('Checking the read replica failed')
+            if self._stopped.wait(self.interval):
+                return
+
+    def stop(self):
+        self._stopped.set()
+        self.join()
+
+
+def start_refresher():
+    """
+    Start this process's ReplicaRefresher if ReplicaRouter is configured.
+    Called from wsgi.py and asgi.py; forked workers start their own.
+    """
+    global refresher
+    if 'courseinfo.replica.ReplicaRouter' not in settings.DATABASE_ROUTERS:
+        return None
+    if refresher is not None and refresher.is_alive():
+        return refresher
+    refresher = ReplicaRefresher(getattr(settings, 'COURSEINFO_REPLICA_POLL_INTERVAL', 1.0))
+    refresher.start()
+    return refresher
+
+
+def stop_refresher():
+    global refresher
+    if refresher is not None and refresher.is_alive():
+        refresher.stop()
+    refresher = None
+
+
+def _restart_in_child():
+    global refresher, _snapshot_time
+    # the parent's thread does not exist in a forked worker
+    if refresher is not None:
+        refresher = None
+        _snapshot_time = None
+        start_refresher()
+
+
+os.register_at_fork(after_in_child=_restart_in_child)
+atexit.register(stop_refresher)
+
+
+def usable_snapshot():
+    """
+    Whether courseinfo reads can go to the replica: its snapshot is newer
+    than the last write this process knows of and at most
+    COURSEINFO_REPLICA_MAX_LAG seconds old. Only in-process state is read.
+    """
+    snapshot_time = _snapshot_time
+    if snapshot_time is None or snapshot_time <= versions.known_last_write():
+        return False
+    replica = connections[REPLICA]
+    if getattr(replica, 'courseinfo_snapshot', None) != snapshot_time:
+        # an open connection still reads the file it opened, i.e. the old
+        # snapshot; requests close it when they finish, other code here
+        if (replica.connection is not None and _request_state.get() is None
+                and not replica.in_atomic_block):
+            replica.close()
+        replica.courseinfo_snapshot = snapshot_time
+    return time.time() - snapshot_time < getattr(settings, 'COURSEINFO_REPLICA_MAX_LAG', 30.0)
+
+
+def begin_request(primary):
+    return _request_state.set(RequestState(primary))
+
+
+def end_request(token):
+    """Returns whether the request wrote to a courseinfo table."""
+    state = _request_state.get()
+    _request_state.reset(token)
+    return state.wrote
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        if not versions.is_versioned(model):
+            # the snapshot freshness check relies on the table versions
+            return None
+        state = _request_state.get()
+        if state is not None and (state.primary or state.wrote):
+            return PRIMARY
+        return REPLICA if usable_snapshot() else PRIMARY
+
+    def db_for_write(self, model, **hints):
+        if not versions.is_versioned(model):
+            return None
+        state = _request_state.get()
+        if state is not None:
+            state.wrote = True
+        return PRIMARY
+
+    def allow_relation(self, obj1, obj2, **hints):
+        if {obj1._state.db, obj2._state.db} <= {PRIMARY, REPLICA}:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, **hints):
+        if db == REPLICA:
+            return False
+        return None
@@ -0,0 +1,178 @@
+"""
+Printable section rosters for a whole semester.
+
+fetch_rosters() loads every section of a semester, with its course,
+instructor and registered students, in one joined query. write_rosters()
+then fans the template rendering out over a ProcessPoolExecutor in batches
+of sections and writes one HTML page per section into a ZIP archive.
+Workers get plain dictionaries and return strings, so neither model
+instances nor database connections cross the process boundary, and the
+rendering scales with the number of cores.
+"""
+import multiprocessing
+import os
+import re
+import threading
+import time
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+from django.apps import apps
+from django.conf import settings
+from django.db import connections
+from django.template.loader import render_to_string
+from django.utils import timezone
+from django.utils.text import slugify
+
+ROSTER_TEMPLATE = 'courseinfo/section_roster.html'
+BATCH_SIZE = 50
+FILENAME_RE = re.compile(r'^rosters-\d+-\d{8}-\d{6}\.zip$')
+
+FIELDS = (
+    'section_id', 'section_name',
+    'course__course_number', 'course__course_name',
+    'instructor__first_name', 'instructor__last_name', 'instructor__disambiguator',
+    'registrations__student__student_id',
+    'registrations__student__first_name',
+    'registrations__student__last_name',
+    'registrations__student__disambiguator',
+)
+
+
+def _name(model, first_name, last_name, disambiguator):
+    # unsaved instances, so names read exactly like the model's __str__
+    return str(model(first_name=first_name, last_name=last_name, disambiguator=disambiguator))
+
+
+def fetch_rosters(semester):
+    """Return a list of roster dictionaries, one per section, in print order."""
+    # imported here so spawned workers can load this module before setup
+    from courseinfo.models import Instructor, Section, Student
+    rows = (Section.objects.filter(semester=semester)
+            .order_by('course__course_number', 'section_name', 'section_id',
+                      'registrations__student__last_name',
+                      'registrations__student__first_name',
+                      'registrations__student__disambiguator')
+            .values_list(*FIELDS))
+    semester_name = str(semester)
+    rosters = []
+    current = None
+    for (section_id, section_name, course_number, course_name,
+         instructor_first, instructor_last, instructor_disambiguator,
+         student_id, first_name, last_name, disambiguator) in rows:
+        if current is None or current['section_id'] != section_id:
+            current = {
+                'section_id': section_id,
+                'section_name': section_name,
+                'course_number': course_number,
+                'course_name': course_name,
+                'semester': semester_name,
+                'instructor': _name(Instructor, instructor_first, instructor_last,
+                                    instructor_disambiguator),
+                'students': [],
+            }
+            rosters.append(current)
+        if student_id is not None:
+            # sections without registrations come back as one row of NULLs
+            current['students'].append({
+                'student_id': student_id,
+                'name': _name(Student, first_name, last_name, disambiguator),
+            })
+    return rosters
+
+
+def roster_filename(roster):
+    return '%s-%s-%d.html' % (
+        slugify(roster['course_number']) or 'course',
+        slugify(roster['section_name']) or 'section',
+        roster['section_id'])
+
+
+def _init_worker():
+    # needed under the spawn start method; fork inherits a configured Django
+    if not apps.ready:
+        django.setup()
+
+
+def render_batch(rosters, generated):
+    """Render a batch of rosters; returns [(filename, html)]."""
+    return [
+        (roster_filename(roster),
+         render_to_string(ROSTER_TEMPLATE, {'roster': roster, 'generated': generated}))
+        for roster in rosters]
+
+
+def _batches(rosters, size):
+    return [rosters[start:start + size] for start in range(0, len(rosters), size)]
+
+
+def render_all(rosters, workers, batch_size=BATCH_SIZE):
+    """Yield (filename, html) for every roster, in order, using `workers` processes."""
+    generated = timezone.now()
+    batches = _batches(rosters, batch_size)
+    if workers <= 1:
+        for batch in batches:
+            yield from render_batch(batch, generated)
+        return
+    # forked workers must not share the parent's database connections
+    connections.close_all()
+    context = None
+    if threading.current_thread() is not threading.main_thread():
+        # forking a threaded process (a runjobs worker) can copy locks held
+        # by other threads into the children
+        context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(workers, mp_context=context, initializer=_init_worker) as pool:
+        for rendered in pool.map(render_batch, batches, [generated] * len(batches)):
+            yield from rendered
+
+
+def roster_directory():
+    return str(getattr(settings, 'COURSEINFO_ROSTER_DIR', 'rosters'))
+
+
+def default_path(semester):
+    return os.path.join(roster_directory(), 'rosters-%d-%s.zip' % (
+        semester.pk, timezone.now().strftime('%Y%m%d-%H%M%S')))
+
+
+def archive_path(filename):
+    """Return the path of a stored roster archive, or None for unknown names."""
+    if not FILENAME_RE.match(filename):
+        return None
+    path = os.path.join(roster_directory(), filename)
+    return path if os.path.isfile(path) else None
+
+
+def write_rosters(semester, path, workers=None, batch_size=BATCH_SIZE, progress=None):
+    """
+    Render every section roster of a semester into a ZIP file at path.
+    progress(done, total), if given, is called after every batch. Returns a
+    dictionary of counts and timings.
+    """
+    workers = workers or os.cpu_count() or 1
+    start = time.perf_counter()
+    rosters = fetch_rosters(semester)
+    fetched = time.perf_counter()
+    total = len(rosters)
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    temporary = path + '.part'
+    size = 0
+    with zipfile.ZipFile(temporary, 'w', zipfile.ZIP_DEFLATED) as archive:
+        for done, (filename, html) in enumerate(render_all(rosters, workers, batch_size), 1):
+            archive.writestr(filename, html)
+            size += len(html)
+            if progress is not None and (done % batch_size == 0 or done == total):
+                progress(done, total)
+    os.replace(temporary, path)
+    finished = time.perf_counter()
+    return {
+        'sections': total,
+        'students': sum(len(roster['students']) for roster in rosters),
+        'workers': workers,
+        'fetch_seconds': fetched - start,
+        'render_seconds': finished - fetched,
+        'html_bytes': size,
+        'zip_bytes': os.path.getsize(path),
+        'file': os.path.basename(path),
+    }
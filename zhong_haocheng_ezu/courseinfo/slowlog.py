@@ -0,0 +1,194 @@
+"""
+Slow query log for the default database.
+
+Every statement slower than COURSEINFO_SLOW_QUERY_THRESHOLD seconds is
+logged to the 'courseinfo.slow_queries' logger with its fingerprint,
+redacted parameters, calling view and a summary of the project frames on
+the stack. SELECTs get an EXPLAIN QUERY PLAN, sampled at most once per
+fingerprint every COURSEINFO_SLOW_QUERY_EXPLAIN_INTERVAL seconds. The
+slowest fingerprints are kept in a bounded in-memory table for the
+/debug/slow-queries page.
+"""
+import hashlib
+import logging
+import re
+import threading
+import time
+import traceback
+from pathlib import Path
+
+from django.conf import settings
+
+from courseinfo import instrumentation
+
+logger = logging.getLogger('courseinfo.slow_queries')
+
+_STRING_RE = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_RE = re.compile(r'\b\d+(?:\.\d+)?\b')
+_PLACEHOLDER_RE = re.compile(r'%s')
+_IN_LIST_RE = re.compile(r'\(\s*\?(?:\s*,\s*\?)+\s*\)')
+_SPACE_RE = re.compile(r'\s+')
+
+
+def fingerprint(sql):
+    """Normalize a statement so that queries differing only in values match."""
+    sql = _STRING_RE.sub('?', sql)
+    sql = _PLACEHOLDER_RE.sub('?', sql)
+    sql = _NUMBER_RE.sub('?', sql)
+    sql = _IN_LIST_RE.sub('(...)', sql)
+    return _SPACE_RE.sub(' ', sql).strip()
+
+
+def redact(params, many=False):
+    if params is None:
+        return None
+    if many:
+        return '<%d parameter sets>' % len(params)
+    if isinstance(params, dict):
+        return {key: _redact_value(value) for key, value in params.items()}
+    return [_redact_value(value) for value in params]
+
+
+def _redact_value(value):
+    if value is None:
+        return None
+    if isinstance(value, (str, bytes)):
+        return '<%s len=%d>' % (type(value).__name__, len(value))
+    return '<%s>' % type(value).__name__
+
+
+_SKIPPED_FILES = {__file__, instrumentation.__file__}
+
+
+def stack_summary(limit=6):
+    root = str(Path(settings.BASE_DIR).parent)
+    frames = [
+        frame for frame in traceback.extract_stack()
+        if frame.filename.startswith(root) and frame.filename not in _SKIPPED_FILES
+    ]
+    return ['%s:%d in %s' % (Path(frame.filename).relative_to(root), frame.lineno, frame.name)
+            for frame in frames[-limit:]]
+
+
+def calling_view():
+    request = instrumentation.current_request()
+    if request is None:
+        return None
+    match = getattr(request, 'resolver_match', None)
+    name = match.view_name if match is not None else 'unresolved'
+    return '%s %s (%s)' % (request.method, request.path, name)
+
+
+class SlowQueryLog:
+    def __init__(self, size):
+        self.size = size
+        self.lock = threading.Lock()
+        self.entries = {}
+        self.explained_at = {}
+
+    def should_explain(self, key, interval):
+        now = time.monotonic()
+        with self.lock:
+            if now - self.explained_at.get(key, -interval) < interval:
+                return False
+            self.explained_at[key] = now
+            return True
+
+    def record(self, key, normalized, duration, sample):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                if len(self.entries) >= self.size:
+                    fastest = min(self.entries, key=lambda k: self.entries[k]['max'])
+                    if self.entries[fastest]['max'] >= duration:
+                        return
+                    del self.entries[fastest]
+                    self.explained_at.pop(fastest, None)
+                entry = self.entries[key] = {
+                    'fingerprint': normalized, 'count': 0, 'total': 0.0, 'max': 0.0,
+                    'plan': None,
+                }
+            entry['count'] += 1
+            entry['total'] += duration
+            entry['max'] = max(entry['max'], duration)
+            if sample.get('plan') is None:
+                sample['plan'] = entry['plan']
+            entry.update(sample)
+
+    def top(self):
+        with self.lock:
+            entries = [dict(entry) for entry in self.entries.values()]
+        for entry in entries:
+            entry['mean'] = entry['total'] / entry['count']
+        return sorted(entries, key=lambda entry: entry['max'], reverse=True)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.explained_at.clear()
+
+
+slow_queries = SlowQueryLog(getattr(settings, 'COURSEINFO_SLOW_QUERY_TOP_N', 50))
+
+
+def explain(connection, sql, params):
+    # a raw cursor skips the execute wrappers, so the EXPLAIN itself is
+    # neither logged nor counted in the request metrics
+    cursor = connection.create_cursor()
+    try:
+        cursor.execute('EXPLAIN QUERY PLAN ' + sql, params or ())
+        return ['%s' % row[-1] for row in cursor.fetchall()]
+    except Exception as error:
+        return ['EXPLAIN failed: %s' % error]
+    finally:
+        cursor.close()
+
+
+class SlowQueryLogger:
+    def __call__(self, execute, sql, params, many, context):
+        threshold = getattr(settings, 'COURSEINFO_SLOW_QUERY_THRESHOLD', None)
+        if threshold is None:
+            return execute(sql, params, many, context)
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = time.perf_counter() - start
+            if duration >= threshold:
+                self.report(sql, params, many, context['connection'], duration)
+
+    def report(self, sql, params, many, connection, duration):
+        normalized = fingerprint(sql)
+        key = hashlib.md5(normalized.encode()).hexdigest()[:12]
+        plan = None
+        interval = getattr(settings, 'COURSEINFO_SLOW_QUERY_EXPLAIN_INTERVAL', 60)
+        if (not many and sql.lstrip()[:6].upper() == 'SELECT'
+                and slow_queries.should_explain(key, interval)):
+            plan = explain(connection, sql, params)
+        sample = {
+            'sql': sql,
+            'params': redact(params, many),
+            'view': calling_view(),
+            'stack': stack_summary(),
+            'plan': plan,
+            'last_duration': duration,
+            'last_seen': time.time(),
+        }
+        slow_queries.record(key, normalized, duration, sample)
+        logger.warning(
+            'Slow query %s (%.1f ms) in %s: %s params=%s stack=%s%s',
+            key, duration * 1000, sample['view'], normalized, sample['params'],
+            ' <- '.join(reversed(sample['stack'])),
+            ' plan=%s' % ' | '.join(plan) if plan else '')
+
+
+def install_on_connection(sender, connection, **kwargs):
+    """connection_created receiver for the default database."""
+    if connection.alias != 'default' or connection.vendor != 'sqlite':
+        return
+    if not any(isinstance(wrapper, SlowQueryLogger) for wrapper in connection.execute_wrappers):
+        # outermost position (Django applies execute_wrappers[0] first), so
+        # the logged time includes the cheap wrappers inside it. It cannot
+        # go at the end: request-scoped wrappers are pushed and popped
+        # there, and a connection may be opened in the middle of a request.
+        connection.execute_wrappers.insert(0, SlowQueryLogger())
@@ -0,0 +1,37 @@
+"""
+SQLite connection tuning.
+
+configure_connection() is a connection_created receiver that runs the
+COURSEINFO_SQLITE_PRAGMAS on every new connection to a SQLite database.
+With journal_mode=WAL readers no longer block behind a writer, and
+busy_timeout makes a writer wait for the lock instead of failing with
+"database is locked". Development leaves the pragmas empty so the
+checked-in database file keeps its journal mode; production sets them.
+"""
+from django.conf import settings
+
+# the order matters: busy_timeout first so that switching the journal
+# mode waits for other connections instead of failing
+RECOMMENDED_PRAGMAS = {
+    'busy_timeout': 5000,
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'mmap_size': 256 * 1024 * 1024,
+    'cache_size': -20000,
+    'temp_store': 'MEMORY',
+}
+
+
+def apply_pragmas(dbapi_connection, pragmas):
+    """Run `PRAGMA name = value` for each item on a DB-API connection."""
+    for name, value in pragmas.items():
+        dbapi_connection.execute('PRAGMA %s = %s' % (name, value)).fetchall()
+
+
+def configure_connection(sender, connection, **kwargs):
+    # the read-only replica snapshot cannot change its journal mode
+    if connection.vendor != 'sqlite' or connection.alias != 'default':
+        return
+    pragmas = getattr(settings, 'COURSEINFO_SQLITE_PRAGMAS', None)
+    if pragmas:
+        apply_pragmas(connection.connection, pragmas)
@@ -0,0 +1,39 @@
+"""
+Background tasks for the job queue (see courseinfo.jobs).
+
+Queue them with jobs.enqueue() from a view, or with the enqueuejob
+management command, and run them with runjobs.
+"""
+import io
+
+from django.core.management import call_command
+
+from courseinfo import rosters
+from courseinfo.jobs import task
+from courseinfo.models import Semester
+
+
+def _command(name, **options):
+    output = io.StringIO()
+    call_command(name, stdout=output, stderr=output, **options)
+    return {'output': output.getvalue()}
+
+
+@task()
+def purge_sessions(job, **options):
+    job.progress(0, message='Deleting expired sessions')
+    return _command('purge_sessions', **options)
+
+
+@task(max_attempts=1)
+def dbmaintenance(job, **options):
+    job.progress(0, message='Analyzing, vacuuming and checkpointing')
+    return _command('dbmaintenance', **options)
+
+
+@task(max_attempts=2)
+def render_rosters(job, semester, workers=None):
+    semester = Semester.objects.get(pk=semester)
+    job.progress(0, message='Rendering rosters for %s' % semester)
+    return rosters.write_rosters(
+        semester, rosters.default_path(semester), workers=workers, progress=job.progress)
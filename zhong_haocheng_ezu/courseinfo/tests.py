@@ -24,3 +24,553 @@
 #             last_name="last",
 #             disambiguator="Harvard"
 #         )
+
+
+import copy
+import os
+import re
+import shutil
+import tempfile
+import time
+from datetime import timedelta
+from unittest import mock
+
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import Group, Permission
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache import caches
+from django.core.management.sql import emit_post_migrate_signal
+from django.db import connection, transaction
+from django.http import HttpResponse, StreamingHttpResponse
+from django.test import AsyncClient, RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.urls import NoReverseMatch, get_script_prefix, include, path, reverse, set_script_prefix, set_urlconf
+from django.utils import timezone
+from django.views import View
+
+from courseinfo import (
+    backends, benchmarks, deadlines, jobs, metrics, pagecache, querycache, urlcache, versions)
+from courseinfo.management.commands.bench_async import async_views
+from courseinfo.models import Course, Instructor, Job, Registration, Section, Semester, Student
+from courseinfo.views import StudentList
+
+MODELS = ['instructor', 'section', 'course', 'registration', 'semester', 'student']
+
+_template_dir = None
+
+
+def courseinfo_templates():
+    """
+    TEMPLATES with the app's templates reachable as courseinfo/...: their
+    directory is named courseInfo, which only case-insensitive file systems
+    find under that name.
+    """
+    global _template_dir
+    if _template_dir is None:
+        _template_dir = tempfile.mkdtemp()
+        os.symlink(os.path.join(os.path.dirname(__file__), 'templates', 'courseInfo'),
+                   os.path.join(_template_dir, 'courseinfo'))
+    templates = copy.deepcopy(settings.TEMPLATES)
+    templates[0]['DIRS'] = [_template_dir]
+    return templates
+
+
+def tearDownModule():
+    if _template_dir is not None:
+        shutil.rmtree(_template_dir)
+
+
+def make_user(username, *codenames):
+    user = get_user_model().objects.create_user(username, password='secret')
+    user.user_permissions.set(Permission.objects.filter(
+        content_type__app_label='courseinfo', codename__in=codenames))
+    return user
+
+
+class PagesMixin:
+    """Renders courseinfo pages, with empty caches."""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        templates = override_settings(TEMPLATES=courseinfo_templates())
+        templates.enable()
+        cls.addClassCleanup(templates.disable)
+
+    def setUp(self):
+        caches['default'].clear()
+        querycache.result_cache.clear()
+
+    def client_for(self, user):
+        client = self.client_class()
+        client.force_login(user)
+        return client
+
+
+class PageTestCase(PagesMixin, TestCase):
+    pass
+
+
+class UrlCacheTest(SimpleTestCase):
+    pattern_names = [
+        'courseinfo_%s_%s_urlpattern' % (model, kind)
+        for model in MODELS for kind in ['list', 'create']]
+    pk_pattern_names = [
+        'courseinfo_%s_%s_urlpattern' % (model, kind)
+        for model in MODELS for kind in ['detail', 'update', 'delete']]
+
+    def setUp(self):
+        self.old_prefix = get_script_prefix()
+        self.addCleanup(set_script_prefix, self.old_prefix)
+
+    def test_all_patterns_are_compiled(self):
+        compiled = urlcache.compiled_patterns()
+        self.assertEqual(len(self.pattern_names + self.pk_pattern_names), 30)
+        for name in self.pattern_names + self.pk_pattern_names:
+            self.assertIn(name, compiled)
+
+    def test_equivalent_to_reverse(self):
+        for prefix in ['/', '/courses/', '/ez u/%/']:
+            set_script_prefix(prefix)
+            for name in self.pattern_names:
+                self.assertEqual(urlcache.reverse(name), reverse(name))
+            for name in self.pk_pattern_names:
+                for pk in [0, 1, 42, '7', 10 ** 12]:
+                    self.assertEqual(
+                        urlcache.reverse(name, kwargs={'pk': pk}),
+                        reverse(name, kwargs={'pk': pk}))
+                self.assertEqual(
+                    urlcache.reverse(name, args=[3]), reverse(name, args=[3]))
+
+    def test_invalid_arguments_raise_like_reverse(self):
+        for name in self.pk_pattern_names:
+            for kwargs in [{}, {'pk': -1}, {'pk': 'x'}, {'pk': 1, 'other': 2}]:
+                with self.assertRaises(NoReverseMatch):
+                    reverse(name, kwargs=kwargs)
+                with self.assertRaises(NoReverseMatch):
+                    urlcache.reverse(name, kwargs=kwargs)
+
+    def test_compiled_patterns_used_during_requests(self):
+        # the request handler sets the thread's urlconf to ROOT_URLCONF
+        set_urlconf(settings.ROOT_URLCONF)
+        self.addCleanup(set_urlconf, None)
+        with mock.patch('courseinfo.urlcache.django_reverse') as django_reverse:
+            url = urlcache.reverse('courseinfo_section_detail_urlpattern', kwargs={'pk': 3})
+        django_reverse.assert_not_called()
+        self.assertEqual(url, reverse('courseinfo_section_detail_urlpattern', kwargs={'pk': 3}))
+
+
+@jobs.task(name='test_succeed')
+def succeed(job):
+    return {'ok': True}
+
+
+@jobs.task(name='test_fail')
+def fail(job):
+    raise RuntimeError('boom')
+
+
+class JobQueueTest(TestCase):
+    def setUp(self):
+        # run() would close the test case's connection, which is inside a
+        # transaction
+        patcher = mock.patch('courseinfo.jobs.close_old_connections')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def make_stale(self, job, seconds):
+        Job.objects.filter(pk=job.pk).update(heartbeat=timezone.now() - timedelta(seconds=seconds))
+
+    def test_claim_takes_due_jobs_once(self):
+        later = jobs.enqueue('test_succeed', delay=60)
+        due = jobs.enqueue('test_succeed')
+        job = jobs.claim('worker-1')
+        self.assertEqual(job.pk, due.pk)
+        self.assertEqual((job.status, job.worker, job.attempts), (Job.RUNNING, 'worker-1', 1))
+        self.assertIsNone(jobs.claim('worker-2'))
+        later.refresh_from_db()
+        self.assertEqual(later.status, Job.QUEUED)
+
+    def test_run_records_the_result(self):
+        jobs.enqueue('test_succeed')
+        job = jobs.claim('worker-1')
+        self.assertEqual(jobs.run(job), 'succeeded')
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.result), (Job.SUCCEEDED, {'ok': True}))
+
+    @override_settings(COURSEINFO_JOB_RETRY_DELAY=10.0, COURSEINFO_JOB_MAX_RETRY_DELAY=25.0)
+    def test_failures_are_retried_with_backoff(self):
+        self.assertEqual([jobs.retry_delay(n) for n in range(1, 5)], [10.0, 20.0, 25.0, 25.0])
+
+        jobs.enqueue('test_fail', max_attempts=2)
+        job = jobs.claim('worker-1')
+        before = timezone.now()
+        with self.assertLogs('courseinfo.jobs', 'ERROR'):
+            self.assertEqual(jobs.run(job), 'retried')
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.QUEUED)
+        self.assertGreaterEqual(job.run_after, before + timedelta(seconds=10))
+        self.assertLess(job.run_after, before + timedelta(seconds=11))
+        self.assertIsNone(jobs.claim('worker-1'))
+
+        Job.objects.filter(pk=job.pk).update(run_after=timezone.now())
+        job = jobs.claim('worker-1')
+        self.assertEqual(job.attempts, 2)
+        with self.assertLogs('courseinfo.jobs', 'ERROR'):
+            self.assertEqual(jobs.run(job), 'failed')
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.FAILED)
+        self.assertIn('RuntimeError: boom', job.error)
+
+    def test_stale_jobs_are_requeued(self):
+        jobs.enqueue('test_succeed', max_attempts=2)
+        job = jobs.claim('worker-1')
+        self.make_stale(job, 120)
+        self.assertEqual(jobs.heartbeat('worker-2', [job.pk]), 0)
+        self.assertEqual(jobs.heartbeat('worker-1', [job.pk]), 1)
+        self.assertEqual(jobs.requeue_stale(60), 0)
+
+        self.make_stale(job, 120)
+        self.assertEqual(jobs.requeue_stale(60), 1)
+        requeued = Job.objects.get(pk=job.pk)
+        self.assertEqual(requeued.status, Job.QUEUED)
+
+        # the first worker finishing late must not overwrite the requeued job
+        with self.assertLogs('courseinfo.jobs', 'WARNING'):
+            self.assertEqual(jobs.run(job), 'lost')
+        requeued.refresh_from_db()
+        self.assertEqual((requeued.status, requeued.result), (Job.QUEUED, None))
+
+    def test_stale_jobs_out_of_attempts_fail(self):
+        jobs.enqueue('test_succeed', max_attempts=1)
+        job = jobs.claim('worker-1')
+        self.make_stale(job, 120)
+        self.assertEqual(jobs.requeue_stale(60), 1)
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.FAILED)
+
+
+class QueryCacheTest(TransactionTestCase):
+    # a TestCase would run every test inside a transaction, where results
+    # are never stored
+
+    def setUp(self):
+        querycache.result_cache.clear()
+        self.addCleanup(querycache.result_cache.clear)
+        self.course = Course.objects.create(course_number='C1', course_name='One')
+        Course.objects.create(course_number='C2', course_name='Two')
+
+    def names(self):
+        return list(Course.objects.cached().values_list('course_name', flat=True))
+
+    def test_results_are_cached(self):
+        self.assertEqual(self.names(), ['One', 'Two'])
+        self.assertEqual(Course.objects.cached().count(), 2)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.names(), ['One', 'Two'])
+            self.assertEqual(Course.objects.cached().count(), 2)
+
+    def test_save_invalidates(self):
+        self.names()
+        self.course.course_name = 'Uno'
+        self.course.save()
+        self.assertEqual(self.names(), ['Uno', 'Two'])
+
+    def test_update_invalidates(self):
+        self.names()
+        Course.objects.filter(pk=self.course.pk).update(course_name='Uno')
+        self.assertEqual(self.names(), ['Uno', 'Two'])
+
+    def test_delete_invalidates(self):
+        self.names()
+        Course.objects.filter(pk=self.course.pk).delete()
+        self.assertEqual(self.names(), ['Two'])
+
+    def test_bulk_create_invalidates(self):
+        self.assertEqual(Course.objects.cached().count(), 2)
+        Course.objects.bulk_create([Course(course_number='C3', course_name='Three')])
+        self.assertEqual(self.names(), ['One', 'Two', 'Three'])
+        self.assertEqual(Course.objects.cached().count(), 3)
+
+    def test_uncommitted_writes_are_not_cached(self):
+        self.names()
+        with transaction.atomic():
+            Course.objects.filter(pk=self.course.pk).update(course_name='Uno')
+            during = versions.model_versions([Course])
+            self.assertEqual(self.names(), ['Uno', 'Two'])
+            with self.assertNumQueries(1):
+                self.names()
+        # bumped again once the write became visible to other connections
+        self.assertNotEqual(versions.model_versions([Course]), during)
+        self.assertEqual(self.names(), ['Uno', 'Two'])
+
+    def test_rolled_back_writes_are_not_cached(self):
+        self.names()
+        with self.assertRaises(RuntimeError):
+            with transaction.atomic():
+                Course.objects.filter(pk=self.course.pk).update(course_name='Uno')
+                self.assertEqual(self.names(), ['Uno', 'Two'])
+                raise RuntimeError
+        self.assertEqual(self.names(), ['One', 'Two'])
+
+
+class PageCacheTest(PageTestCase):
+    def setUp(self):
+        super().setUp()
+        self.course = Course.objects.create(course_number='C1', course_name='One')
+        self.url = self.course.get_absolute_url()
+
+    def test_pages_differ_by_permissions(self):
+        viewer = self.client_for(make_user('viewer', 'view_course'))
+        editor = self.client_for(make_user('editor', 'view_course', 'change_course'))
+        response = viewer.get(self.url)
+        self.assertEqual(response['X-Page-Cache'], 'miss')
+        self.assertNotContains(response, self.course.get_update_url())
+        response = editor.get(self.url)
+        self.assertEqual(response['X-Page-Cache'], 'miss')
+        self.assertContains(response, self.course.get_update_url())
+        response = viewer.get(self.url)
+        self.assertEqual(response['X-Page-Cache'], 'hit')
+        self.assertNotContains(response, self.course.get_update_url())
+
+    def test_username_is_personalized(self):
+        self.client_for(make_user('alice', 'view_course')).get(self.url)
+        response = self.client_for(make_user('bob', 'view_course')).get(self.url)
+        self.assertEqual(response['X-Page-Cache'], 'hit')
+        self.assertContains(response, 'Log Out, bob')
+        self.assertNotContains(response, 'alice')
+        self.assertNotContains(response, pagecache.USERNAME_PLACEHOLDER)
+
+    def test_cookies_and_csrf_tokens_are_not_stored(self):
+        request = RequestFactory().get(self.url)
+        request.user = make_user('alice', 'view_course')
+        key = pagecache.page_key(request, [Course])
+
+        response = HttpResponse(b'page')
+        response.set_cookie('flavour', 'chocolate')
+        pagecache.store(key, request, response)
+        self.assertIsNone(pagecache.get(key, request))
+
+        request.META['CSRF_COOKIE_USED'] = True
+        pagecache.store(key, request, HttpResponse(b'page'))
+        self.assertIsNone(pagecache.get(key, request))
+
+        del request.META['CSRF_COOKIE_USED']
+        pagecache.store(key, request, HttpResponse(b'page'))
+        self.assertEqual(pagecache.get(key, request).content, b'page')
+
+    def test_writes_invalidate_pages(self):
+        client = self.client_for(make_user('alice', 'view_course'))
+        client.get(self.url)
+        self.assertEqual(client.get(self.url)['X-Page-Cache'], 'hit')
+        self.course.course_name = 'Uno'
+        self.course.save()
+        response = client.get(self.url)
+        self.assertEqual(response['X-Page-Cache'], 'miss')
+        self.assertContains(response, 'Uno')
+
+
+class ConditionalGetTest(PageTestCase):
+    def setUp(self):
+        super().setUp()
+        self.course = Course.objects.create(course_number='C1', course_name='One')
+        self.url = self.course.get_absolute_url()
+        self.client = self.client_for(make_user('alice', 'view_course'))
+
+    def test_matching_etag_gets_304_with_etag(self):
+        etag = self.client.get(self.url)['ETag']
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+        self.assertEqual(response.content, b'')
+
+    def test_writes_change_the_etag(self):
+        etag = self.client.get(self.url)['ETag']
+        self.course.course_name = 'Uno'
+        self.course.save()
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertContains(response, 'Uno')
+
+
+class CachedModelBackendTest(TestCase):
+    def setUp(self):
+        caches[settings.COURSEINFO_PERMISSION_CACHE].clear()
+        self.user = make_user('alice', 'view_course')
+        self.group = Group.objects.create(name='editors')
+        self.change_course = Permission.objects.get(
+            content_type__app_label='courseinfo', codename='change_course')
+
+    def permissions(self):
+        # a fresh instance, as the next request would load
+        user = get_user_model().objects.get(pk=self.user.pk)
+        return {p for p in user.get_all_permissions() if p.startswith('courseinfo.')}
+
+    def test_warm_entries_run_no_queries(self):
+        self.user.groups.add(self.group)
+        self.permissions()
+        user = get_user_model().objects.get(pk=self.user.pk)
+        with self.assertNumQueries(0):
+            user.get_all_permissions()
+
+    def test_relation_changes_invalidate(self):
+        self.assertEqual(self.permissions(), {'courseinfo.view_course'})
+        self.group.permissions.add(self.change_course)
+        self.user.groups.add(self.group)
+        self.assertEqual(self.permissions(), {'courseinfo.view_course', 'courseinfo.change_course'})
+        self.user.groups.remove(self.group)
+        self.assertEqual(self.permissions(), {'courseinfo.view_course'})
+
+        self.user.groups.add(self.group)
+        self.permissions()
+        self.change_course.group_set.clear()
+        self.assertEqual(self.permissions(), {'courseinfo.view_course'})
+
+        self.change_course.user_set.add(self.user)
+        self.assertEqual(self.permissions(), {'courseinfo.view_course', 'courseinfo.change_course'})
+        self.user.user_permissions.clear()
+        self.assertEqual(self.permissions(), set())
+
+    def test_flag_changes_apply(self):
+        self.permissions()
+        self.user.is_superuser = True
+        self.user.save()
+        self.assertIn('courseinfo.delete_registration', self.permissions())
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.permissions(), set())
+
+    def test_migrate_drops_the_permission_list(self):
+        self.user.is_superuser = True
+        self.user.save()
+        self.permissions()
+        cache = caches[settings.COURSEINFO_PERMISSION_CACHE]
+        self.assertIsNotNone(cache.get(backends.ALL_PERMISSIONS_KEY))
+        # create_permissions() adds permissions this way, without post_save
+        Permission.objects.bulk_create([Permission(
+            name='Can export course', codename='export_course',
+            content_type=ContentType.objects.get_for_model(Course))])
+        self.assertNotIn('courseinfo.export_course', self.permissions())
+        emit_post_migrate_signal(0, False, 'default')
+        self.assertIsNone(cache.get(backends.ALL_PERMISSIONS_KEY))
+        self.assertIn('courseinfo.export_course', self.permissions())
+
+
+# counts to a hundred million, which takes SQLite several seconds
+SLOW_SQL = (
+    'WITH RECURSIVE numbers(n) AS (SELECT 1 UNION ALL SELECT n + 1 FROM numbers '
+    'WHERE n < 100000000) SELECT COUNT(*) FROM numbers')
+
+
+class SlowView(View):
+    statement_timeout = 0.05
+
+    def get(self, request):
+        with connection.cursor() as cursor:
+            cursor.execute(SLOW_SQL)
+        return HttpResponse('finished')
+
+
+urlpatterns = [path('slow/', SlowView.as_view()), path('', include('zhong_haocheng_ezu.urls'))]
+
+
+@override_settings(ROOT_URLCONF=__name__)
+class StatementDeadlineTest(TestCase):
+    def test_statements_past_the_deadline_are_interrupted(self):
+        start = time.monotonic()
+        with deadlines.deadline(0.05), self.assertRaises(deadlines.StatementTimeout):
+            with connection.cursor() as cursor:
+                cursor.execute(SLOW_SQL)
+        self.assertLess(time.monotonic() - start, 1.0)
+        # the connection stays usable
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT 1')
+
+    @override_settings(COURSEINFO_STATEMENT_RETRY_AFTER=7)
+    def test_requests_past_the_deadline_get_503(self):
+        start = time.monotonic()
+        response = self.client.get('/slow/')
+        self.assertLess(time.monotonic() - start, 1.0)
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], '7')
+
+
+class StreamingListTest(PageTestCase):
+    student_url_re = re.compile(r'href="(/student/\d+)"')
+
+    def setUp(self):
+        super().setUp()
+        Student.objects.bulk_create(
+            Student(first_name='First%d' % i, last_name='Student%02d' % i) for i in range(60))
+        self.user = make_user('alice', 'view_student')
+        self.client = self.client_for(self.user)
+
+    def student_urls(self, content):
+        return self.student_url_re.findall(content.decode())
+
+    def test_stream_has_the_rows_of_all_pages(self):
+        paginated = []
+        for page in range(1, 4):
+            response = self.client.get('/student/', {'page': page})
+            self.assertContains(response, '?stream=1')
+            paginated += self.student_urls(response.content)
+        self.assertEqual(len(paginated), 60)
+
+        with mock.patch.object(StudentList, 'stream_chunk_size', 7):
+            response = self.client.get('/student/', {'stream': 1})
+        self.assertIsInstance(response, StreamingHttpResponse)
+        streamed = self.student_urls(b''.join(response.streaming_content))
+        self.assertEqual(streamed, paginated)
+
+    def test_asgi_requests_get_the_normal_page(self):
+        # Django's ASGI handler would iterate the stream on the event loop,
+        # where the ORM cannot run
+        client = AsyncClient()
+        client.force_login(self.user)
+        response = async_to_sync(client.get)('/student/', {'stream': 1})
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.streaming)
+        self.assertEqual(len(self.student_urls(response.content)), StudentList.paginate_by)
+        self.assertNotContains(response, '?stream=1')
+
+
+class AsyncViewTest(PagesMixin, TransactionTestCase):
+    # the async views query on worker threads, which only see committed rows,
+    # and both kinds of view are served over ASGI, where lists do not stream
+
+    def setUp(self):
+        super().setUp()
+        benchmarks.populate(sections=10, students=60, registrations_per_section=8)
+        self.client = AsyncClient()
+        self.client.force_login(get_user_model().objects.create_superuser('alice'))
+        uncached = benchmarks.uncached()
+        uncached.__enter__()
+        self.addCleanup(uncached.__exit__, None, None, None)
+
+    def urls(self):
+        urls = ['/%s/' % model for model in MODELS] + ['/student/?page=2', '/student/?page=last']
+        for model in [Instructor, Section, Course, Registration, Semester, Student]:
+            urls.append(model.objects.order_by('pk').first().get_absolute_url())
+        return urls
+
+    def render(self, url):
+        """The page at url, served over ASGI, and the number of queries it ran."""
+        with mock.patch.object(metrics.REQUEST_QUERIES, 'observe') as observe:
+            response = async_to_sync(self.client.get)(url)
+        self.assertEqual(response.status_code, 200, url)
+        return response.content.decode(), observe.call_args[0][0]
+
+    def test_async_views_render_the_sync_pages(self):
+        urls = self.urls()
+        # warm the permission cache and the reference data
+        for url in urls:
+            self.render(url)
+        sync_pages = {url: self.render(url) for url in urls}
+        with async_views(True):
+            async_pages = {url: self.render(url) for url in urls}
+        for url in urls:
+            with self.subTest(url=url):
+                self.assertEqual(async_pages[url][0], sync_pages[url][0])
+                self.assertEqual(async_pages[url][1], sync_pages[url][1])
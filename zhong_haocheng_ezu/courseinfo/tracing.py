@@ -0,0 +1,196 @@
+"""
+Minimal request tracing.
+
+TracingMiddleware samples a fraction of requests (COURSEINFO_TRACE_SAMPLE_RATE,
+or any request carrying a signed 'trace' debug token). For a sampled
+request, spans are recorded for the middleware phase, view dispatch, the
+courseinfo mixins, every ORM query, cache calls and template renders.
+Finished traces are appended as one OTLP/JSON line each (the format of
+the OpenTelemetry collector's file exporter) to a size-rotated
+COURSEINFO_TRACE_DIR/traces-<pid>.jsonl.
+"""
+import contextvars
+import functools
+import json
+import logging
+import logging.handlers
+import os
+import secrets
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+
+KIND_INTERNAL = 1
+KIND_SERVER = 2
+KIND_CLIENT = 3
+STATUS_OK = 1
+STATUS_ERROR = 2
+
+_trace = contextvars.ContextVar('courseinfo_trace', default=None)
+_span = contextvars.ContextVar('courseinfo_span', default=None)
+
+
+class Span:
+    __slots__ = ('trace_id', 'span_id', 'parent_id', 'name', 'kind',
+                 'start', 'end', 'attributes', 'status')
+
+    def __init__(self, trace_id, parent_id, name, kind, attributes):
+        self.trace_id = trace_id
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent_id
+        self.name = name
+        self.kind = kind
+        self.start = time.time_ns()
+        self.end = None
+        self.attributes = attributes
+        self.status = STATUS_OK
+
+    def as_otlp(self):
+        span = {
+            'traceId': self.trace_id,
+            'spanId': self.span_id,
+            'name': self.name,
+            'kind': self.kind,
+            'startTimeUnixNano': str(self.start),
+            'endTimeUnixNano': str(self.end),
+            'attributes': [_otlp_attribute(key, value)
+                           for key, value in self.attributes.items()],
+            'status': {'code': self.status},
+        }
+        if self.parent_id:
+            span['parentSpanId'] = self.parent_id
+        return span
+
+
+def _otlp_attribute(key, value):
+    if isinstance(value, bool):
+        return {'key': key, 'value': {'boolValue': value}}
+    if isinstance(value, int):
+        return {'key': key, 'value': {'intValue': str(value)}}
+    if isinstance(value, float):
+        return {'key': key, 'value': {'doubleValue': value}}
+    return {'key': key, 'value': {'stringValue': str(value)}}
+
+
+class Trace:
+    def __init__(self):
+        self.trace_id = secrets.token_hex(16)
+        self.spans = []
+
+    def as_otlp(self):
+        return {'resourceSpans': [{
+            'resource': {'attributes': [_otlp_attribute('service.name', 'courseinfo')]},
+            'scopeSpans': [{
+                'scope': {'name': 'courseinfo.tracing'},
+                'spans': [span.as_otlp() for span in self.spans],
+            }],
+        }]}
+
+
+def is_recording():
+    return _trace.get() is not None
+
+
+def reset_context_var(var, token):
+    """
+    ContextVar.reset() that also works from a copy of the context the token
+    was made in: for an async view Django calls process_view() through
+    sync_to_async, on a copied context whose changes are copied back.
+    """
+    try:
+        var.reset(token)
+    except ValueError:
+        var.set(None if token.old_value is token.MISSING else token.old_value)
+
+
+def begin_trace():
+    return _trace.set(Trace())
+
+
+def end_trace(token):
+    trace = _trace.get()
+    _trace.reset(token)
+    return trace
+
+
+def open_span(name, kind=KIND_INTERNAL, **attributes):
+    """Start a span as a child of the current one; returns (span, token)."""
+    trace = _trace.get()
+    if trace is None:
+        return None, None
+    parent = _span.get()
+    span = Span(trace.trace_id, parent.span_id if parent else None, name, kind, attributes)
+    trace.spans.append(span)
+    return span, _span.set(span)
+
+
+def close_span(span, token, error=None):
+    if span is None:
+        return
+    span.end = time.time_ns()
+    if error is not None:
+        span.status = STATUS_ERROR
+        span.attributes['exception.type'] = type(error).__name__
+    reset_context_var(_span, token)
+
+
+@contextmanager
+def span(name, kind=KIND_INTERNAL, **attributes):
+    if _trace.get() is None:
+        yield None
+        return
+    current, token = open_span(name, kind, **attributes)
+    try:
+        yield current
+    except BaseException as error:
+        close_span(current, token, error)
+        raise
+    else:
+        close_span(current, token)
+
+
+def traced(name):
+    """Decorator recording a span around each call of a function or method."""
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if _trace.get() is None:
+                return function(*args, **kwargs)
+            with span(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def query_span(execute, sql, params, many, context):
+    """Execute wrapper recording one span per ORM query."""
+    with span('db.query', KIND_CLIENT,
+              **{'db.system': 'sqlite',
+                 'db.operation': sql.lstrip().split(' ', 1)[0].upper(),
+                 'db.statement': sql}):
+        return execute(sql, params, many, context)
+
+
+_exporter = None
+
+
+def exporter():
+    global _exporter
+    if _exporter is None:
+        directory = str(getattr(settings, 'COURSEINFO_TRACE_DIR', 'traces'))
+        os.makedirs(directory, exist_ok=True)
+        handler = logging.handlers.RotatingFileHandler(
+            os.path.join(directory, 'traces-%d.jsonl' % os.getpid()),
+            maxBytes=getattr(settings, 'COURSEINFO_TRACE_MAX_BYTES', 10 * 1024 * 1024),
+            backupCount=getattr(settings, 'COURSEINFO_TRACE_BACKUP_COUNT', 5))
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        _exporter = logging.getLogger('courseinfo.traces.export')
+        _exporter.propagate = False
+        _exporter.setLevel(logging.INFO)
+        _exporter.addHandler(handler)
+    return _exporter
+
+
+def export(trace):
+    exporter().info(json.dumps(trace.as_otlp(), separators=(',', ':')))
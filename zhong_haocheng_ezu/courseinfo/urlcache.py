@@ -0,0 +1,104 @@
+"""
+Fast URL reversing for the courseinfo_*_urlpattern names.
+
+django.urls.reverse() searches the resolver's candidates, converts and
+regex-checks the arguments and quotes the whole URL on every call, and
+templates call get_absolute_url() and friends once per row. reverse() here
+compiles each courseinfo pattern once per process into its quoted static
+parts and converters, so a call is a dictionary lookup, one regex check per
+argument and a join. Anything it cannot build identically (other names,
+positional args, per-request urlconfs, arguments that do not match) is
+passed on to django.urls.reverse().
+"""
+import re
+import threading
+from urllib.parse import quote
+
+from django.conf import settings
+from django.urls import get_resolver, get_script_prefix, get_urlconf
+from django.urls import reverse as django_reverse
+from django.utils.http import RFC3986_SUBDELIMS, escape_leading_slashes
+
+NAME_RE = re.compile(r'^courseinfo_\w+_urlpattern$')
+SAFE = RFC3986_SUBDELIMS + '/~:@'
+_PARAM_RE = re.compile(r'%\((\w+)\)s')
+
+
+class CompiledPattern:
+    def __init__(self, result, params, converters):
+        parts = _PARAM_RE.split(result)
+        # even indexes are static text, odd ones parameter names
+        self.static = [quote(part.replace('%%', '%'), safe=SAFE) for part in parts[0::2]]
+        self.params = parts[1::2]
+        self.param_set = frozenset(params)
+        self.converters = [converters[name] for name in self.params]
+        self.regexes = [re.compile(converter.regex) for converter in self.converters]
+
+    def build(self, prefix, kwargs):
+        """Return the URL, or None when reverse() must decide."""
+        if kwargs.keys() != self.param_set:
+            return None
+        url = [prefix, self.static[0]]
+        for name, converter, regex, static in zip(
+                self.params, self.converters, self.regexes, self.static[1:]):
+            try:
+                text = str(converter.to_url(kwargs[name]))
+            except ValueError:
+                return None
+            if not regex.fullmatch(text):
+                return None
+            url.append(quote(text, safe=SAFE))
+            url.append(static)
+        return escape_leading_slashes(''.join(url))
+
+
+_lock = threading.Lock()
+_compiled = (None, {})
+_prefixes = {}
+
+
+def _compile(resolver):
+    patterns = {}
+    for name in resolver.reverse_dict:
+        if not isinstance(name, str) or not NAME_RE.match(name):
+            continue
+        candidates = resolver.reverse_dict.getlist(name)
+        if len(candidates) != 1 or len(candidates[0][0]) != 1 or candidates[0][2]:
+            # several candidates or defaults: leave it to reverse()
+            continue
+        possibility, pattern, defaults, converters = candidates[0]
+        result, params = possibility[0]
+        patterns[name] = CompiledPattern(result, params, converters)
+    return patterns
+
+
+def compiled_patterns():
+    global _compiled
+    resolver = get_resolver()
+    compiled_for, patterns = _compiled
+    if compiled_for is not resolver:
+        with _lock:
+            patterns = _compile(resolver)
+            _compiled = (resolver, patterns)
+    return patterns
+
+
+def _quoted_prefix(prefix):
+    quoted = _prefixes.get(prefix)
+    if quoted is None:
+        quoted = _prefixes[prefix] = quote(prefix, safe=SAFE)
+    return quoted
+
+
+def reverse(viewname, urlconf=None, args=None, kwargs=None, current_app=None):
+    """Drop-in replacement for django.urls.reverse()."""
+    # the request handler sets the thread's urlconf to ROOT_URLCONF, which
+    # is what the compiled patterns come from
+    if (urlconf is None and not args and current_app is None
+            and get_urlconf() in (None, settings.ROOT_URLCONF)):
+        pattern = compiled_patterns().get(viewname)
+        if pattern is not None:
+            url = pattern.build(_quoted_prefix(get_script_prefix()), kwargs or {})
+            if url is not None:
+                return url
+    return django_reverse(viewname, urlconf, args, kwargs, current_app)
@@ -14,6 +14,7 @@ Including another URLconf
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
 from .views import redirect_root_view
+from django.conf import settings
 from django.contrib import admin
 from django.urls import path
 from courseinfo.views import (
@@ -33,8 +34,21 @@ from courseinfo.views import (
     StudentCreate, SectionCreate, CourseCreate, RegistrationCreate, SemesterCreate, InstructorCreate,
     StudentUpdate, SectionUpdate, CourseUpdate, RegistrationUpdate, SemesterUpdate, InstructorUpdate,
     StudentDelete, SectionDelete, CourseDelete, RegistrationDelete, SemesterDelete, InstructorDelete,
+    MetricsView, SlowQueryList, ProfileList, ProfileDownload, TemplateTimingReport,
+    MemoryReportList, JobList, JobDetail, JobRetry, RosterDownload,
+    AsyncInstructorList, AsyncInstructorDetail, AsyncSectionList, AsyncSectionDetail,
+    AsyncCourseList, AsyncCourseDetail, AsyncRegistrationList, AsyncRegistrationDetail,
+    AsyncSemesterList, AsyncSemesterDetail, AsyncStudentList, AsyncStudentDetail,
 )
 
+
+def read_view(view, async_view):
+    """The list or detail view, or its async variant under COURSEINFO_ASYNC_VIEWS."""
+    if getattr(settings, 'COURSEINFO_ASYNC_VIEWS', False):
+        return async_view.as_view()
+    return view.as_view()
+
+
 urlpatterns = [
     path("",
          redirect_root_view,
@@ -42,11 +56,11 @@ urlpatterns = [
     # path('admin/', admin.site.urls),
     # path('instructor/', instructor_list_view),
     path('instructor/',
-         InstructorList.as_view(),
+         read_view(InstructorList, AsyncInstructorList),
          name='courseinfo_instructor_list_urlpattern'
          ),
     path('instructor/<int:pk>',
-         InstructorDetail.as_view(),
+         read_view(InstructorDetail, AsyncInstructorDetail),
          name='courseinfo_instructor_detail_urlpattern'
          ),
     path('instructor/create/',
@@ -71,11 +85,11 @@ urlpatterns = [
     #      name='courseinfo_instructor_delete_urlpattern'),
     # path('section/', section_list_view),
     path('section/',
-         SectionList.as_view(),
+         read_view(SectionList, AsyncSectionList),
          name='courseinfo_section_list_urlpattern'
          ),
     path('section/<int:pk>',
-         SectionDetail.as_view(),
+         read_view(SectionDetail, AsyncSectionDetail),
          name='courseinfo_section_detail_urlpattern'
          ),
     path('section/create/',
@@ -93,11 +107,11 @@ urlpatterns = [
 
     # path('course/', course_list_view),
     path('course/',
-         CourseList.as_view(),
+         read_view(CourseList, AsyncCourseList),
          name='courseinfo_course_list_urlpattern'
          ),
     path('course/<int:pk>',
-         CourseDetail.as_view(),
+         read_view(CourseDetail, AsyncCourseDetail),
          name='courseinfo_course_detail_urlpattern'
          ),
     path('course/create/',
@@ -114,11 +128,11 @@ urlpatterns = [
          name='courseinfo_course_delete_urlpattern'),
     # path('registration/', registration_list_view),
     path('registration/',
-         RegistrationList.as_view(),
+         read_view(RegistrationList, AsyncRegistrationList),
          name='courseinfo_registration_list_urlpattern'
          ),
     path('registration/<int:pk>',
-         RegistrationDetail.as_view(),
+         read_view(RegistrationDetail, AsyncRegistrationDetail),
          name='courseinfo_registration_detail_urlpattern'
          ),
     path('registration/create/',
@@ -135,11 +149,11 @@ urlpatterns = [
          name='courseinfo_registration_delete_urlpattern'),
     # path('semester/', semester_list_view),
     path('semester/',
-         SemesterList.as_view(),
+         read_view(SemesterList, AsyncSemesterList),
          name='courseinfo_semester_list_urlpattern'
          ),
     path('semester/<int:pk>',
-         SemesterDetail.as_view(),
+         read_view(SemesterDetail, AsyncSemesterDetail),
          name='courseinfo_semester_detail_urlpattern'
          ),
     path('semester/create/',
@@ -156,11 +170,11 @@ urlpatterns = [
          name='courseinfo_semester_delete_urlpattern'),
     # path('student/', student_list_view)
     path('student/',
-         StudentList.as_view(),
+         read_view(StudentList, AsyncStudentList),
          name='courseinfo_student_list_urlpattern'
          ),
     path('student/<int:pk>',
-         StudentDetail.as_view(),
+         read_view(StudentDetail, AsyncStudentDetail),
          name='courseinfo_student_detail_urlpattern'
          ),
     path('student/create/',
@@ -175,4 +189,44 @@ urlpatterns = [
     path('student/<int:pk>/delete/',
          StudentDelete.as_view(),
          name='courseinfo_student_delete_urlpattern'),
+
+    path('metrics',
+         MetricsView.as_view(),
+         name='courseinfo_metrics_urlpattern'),
+
+    path('debug/slow-queries',
+         SlowQueryList.as_view(),
+         name='courseinfo_slow_query_list_urlpattern'),
+
+    path('debug/profiles/',
+         ProfileList.as_view(),
+         name='courseinfo_profile_list_urlpattern'),
+
+    path('debug/profiles/<str:filename>',
+         ProfileDownload.as_view(),
+         name='courseinfo_profile_download_urlpattern'),
+
+    path('debug/templates',
+         TemplateTimingReport.as_view(),
+         name='courseinfo_template_timing_report_urlpattern'),
+
+    path('debug/memory',
+         MemoryReportList.as_view(),
+         name='courseinfo_memory_report_list_urlpattern'),
+
+    path('debug/jobs',
+         JobList.as_view(),
+         name='courseinfo_job_list_urlpattern'),
+
+    path('debug/jobs/<int:pk>',
+         JobDetail.as_view(),
+         name='courseinfo_job_detail_urlpattern'),
+
+    path('debug/jobs/<int:pk>/retry',
+         JobRetry.as_view(),
+         name='courseinfo_job_retry_urlpattern'),
+
+    path('debug/rosters/<str:filename>',
+         RosterDownload.as_view(),
+         name='courseinfo_roster_download_urlpattern'),
 ]
@@ -1,16 +1,44 @@
+import asyncio
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth import mixins
+from django.contrib.auth.mixins import UserPassesTestMixin
+from django.core.exceptions import ImproperlyConfigured
+from django.core.handlers.asgi import ASGIRequest
+from django.core.paginator import InvalidPage, Paginator
+from django.http import Http404, StreamingHttpResponse
 from django.shortcuts import redirect, render
+from django.template.loader import get_template
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.crypto import constant_time_compare, get_random_string
+from django.utils.safestring import mark_safe
+
+from courseinfo import asyncdb, instrumentation, pagecache, tracing
+
+
+class PermissionRequiredMixin(mixins.PermissionRequiredMixin):
+    def dispatch(self, request, *args, **kwargs):
+        with tracing.span('view.dispatch', **{'code.function': type(self).__name__}):
+            return super().dispatch(request, *args, **kwargs)
+
+    def has_permission(self):
+        with instrumentation.phase('perm', 'permission checks'):
+            return super().has_permission()
 
 
 class ObjectCreateMixin:
     form_class = None
     template_name = ''
 
+    @tracing.traced('ObjectCreateMixin.get')
     def get(self, request):
         return render(
             request,
             self.template_name,
             {'form': self.form_class})
 
+    @tracing.traced('ObjectCreateMixin.post')
     def post(self, request):
         bound_form = self.form_class(request.POST)
         if bound_form.is_valid():
@@ -23,6 +51,235 @@ class ObjectCreateMixin:
                 {'form': bound_form})
 
 
+class CachedQuerysetMixin:
+    """Serve the view's queryset from the query-result cache."""
+
+    def get_queryset(self):
+        return super().get_queryset().cached()
+
+
+class DependentModelsMixin:
+    """dependent_models lists every model whose data the page shows."""
+    dependent_models = None
+
+    def get_dependent_models(self):
+        return self.dependent_models or [self.model]
+
+
+def _mark_private(response):
+    patch_vary_headers(response, ('Cookie',))
+    patch_cache_control(response, private=True)
+
+
+def _cache_on_render(key, request, response):
+    response.context_data['page_cache_username'] = pagecache.USERNAME_PLACEHOLDER
+    response.add_post_render_callback(
+        lambda rendered: pagecache.store(key, request, rendered))
+
+
+class ConditionalGetMixin(DependentModelsMixin):
+    """
+    Answer GETs whose If-None-Match matches the page's ETag with a 304
+    before the view runs. Must follow the login and permission mixins.
+    """
+
+    def dispatch(self, request, *args, **kwargs):
+        if request.method not in ('GET', 'HEAD') or not request.user.is_authenticated:
+            return super().dispatch(request, *args, **kwargs)
+        etag = pagecache.page_etag(request, self.get_dependent_models())
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            response = super().dispatch(request, *args, **kwargs)
+            if response.status_code != 200:
+                return response
+        # a 304 must carry the ETag too (RFC 9110, section 15.4.5)
+        response['ETag'] = etag
+        _mark_private(response)
+        return response
+
+
+class PageCacheMixin(DependentModelsMixin):
+    """
+    Serve the page from the page cache. Must follow the login and
+    permission mixins so that access is checked before the cache is.
+    """
+
+    def dispatch(self, request, *args, **kwargs):
+        if not pagecache.is_cacheable(request):
+            return super().dispatch(request, *args, **kwargs)
+        key = pagecache.page_key(request, self.get_dependent_models())
+        response = pagecache.get(key, request)
+        if response is not None:
+            return response
+        response = super().dispatch(request, *args, **kwargs)
+        if getattr(response, 'context_data', None) is not None:
+            _cache_on_render(key, request, response)
+        return response
+
+
+class StreamingListMixin:
+    """
+    With ?stream=1, render the whole unpaginated list as a streaming
+    response: the page around the rows first, then the rows in chunks of
+    stream_chunk_size read from a server-side iterator, so time to first
+    byte and memory do not grow with the list. The list template marks
+    where the rows go with {{ stream_marker }} and renders them in normal
+    mode by including the rows template, '<model>_list_rows.html', which
+    is rendered once per chunk here. stream_select_related names the
+    relations the rows display, which are joined into the row query.
+    Under ASGI Django iterates streaming responses on the event loop, where
+    the ORM cannot run, so ASGI requests always get the normal page.
+    """
+    stream_param = 'stream'
+    stream_chunk_size = 500
+    stream_select_related = ()
+    rows_template_name = None
+
+    def can_stream(self):
+        return not isinstance(self.request, ASGIRequest)
+
+    def is_streaming(self):
+        return self.can_stream() and self.request.GET.get(self.stream_param) == '1'
+
+    def get_paginate_by(self, queryset):
+        if self.is_streaming():
+            return None
+        return super().get_paginate_by(queryset)
+
+    def get_rows_template_name(self):
+        if self.rows_template_name is not None:
+            return self.rows_template_name
+        opts = self.object_list.model._meta
+        return '%s/%s_list_rows.html' % (opts.app_label, opts.model_name)
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        if context.get('is_paginated') and self.can_stream():
+            context['stream_url'] = '?%s=1' % self.stream_param
+        return context
+
+    def render_to_response(self, context, **response_kwargs):
+        if not self.is_streaming():
+            return super().render_to_response(context, **response_kwargs)
+        marker = '<!-- stream-%s -->' % get_random_string(16)
+        context['stream_marker'] = mark_safe(marker)
+        page = super().render_to_response(context, **response_kwargs).rendered_content
+        if page.count(marker) != 1:
+            raise ImproperlyConfigured(
+                '%s must render {{ stream_marker }} exactly once.' % self.get_template_names()[0])
+        head, tail = page.split(marker)
+        rows = self.object_list.select_related(*self.stream_select_related)
+        # pick the database now: the rows are read after the request (and
+        # its replica stickiness) has ended
+        rows = rows.using(rows.db)
+        return StreamingHttpResponse(
+            self.stream(head, rows, tail, context),
+            content_type=response_kwargs.get('content_type'))
+
+    def stream(self, head, rows, tail, context):
+        yield head
+        template = get_template(self.get_rows_template_name())
+        name = self.get_context_object_name(self.object_list)
+        chunk_context = {key: value for key, value in context.items()
+                         if key not in (name, 'object_list', 'stream_marker')}
+        chunk, chunks = [], 0
+        for row in rows.iterator(chunk_size=self.stream_chunk_size):
+            chunk.append(row)
+            if len(chunk) == self.stream_chunk_size:
+                yield template.render(dict(chunk_context, **{name: chunk}), self.request)
+                chunk, chunks = [], chunks + 1
+        if chunk or not chunks:
+            # an empty list renders the rows template's {% empty %} text
+            yield template.render(dict(chunk_context, **{name: chunk}), self.request)
+        yield tail
+
+
+class AsyncReadViewMixin(PermissionRequiredMixin, DependentModelsMixin):
+    """
+    The LoginRequiredMixin, PermissionRequiredMixin, ConditionalGetMixin and
+    PageCacheMixin stack for async read views, which define
+    `async def get_context_data_async(**kwargs)`. The access checks and
+    cache lookups need the session, the user's permissions and the caches,
+    so they run in one hop to the request's sync thread; the view's own
+    queries then run concurrently (see courseinfo.asyncdb), and Django
+    renders the response in a second hop.
+    """
+
+    async def dispatch(self, request, *args, **kwargs):
+        with tracing.span('view.dispatch', **{'code.function': type(self).__name__}):
+            response, key, etag = await sync_to_async(self.check_request)(request)
+            if response is not None:
+                return response
+            # the permission mixins' sync dispatch() is replaced by check_request()
+            response = await super(mixins.PermissionRequiredMixin, self).dispatch(
+                request, *args, **kwargs)
+        if etag is None or response.status_code != 200:
+            return response
+        if key is not None and getattr(response, 'context_data', None) is not None:
+            _cache_on_render(key, request, response)
+        response['ETag'] = etag
+        _mark_private(response)
+        return response
+
+    def check_request(self, request):
+        """
+        Returns (response, page cache key, ETag). A response (a redirect to
+        the login page, a 304 or a cached page) ends the request.
+        """
+        if not request.user.is_authenticated or not self.has_permission():
+            return self.handle_no_permission(), None, None
+        asyncdb.capture_request_wrappers()
+        if request.method not in ('GET', 'HEAD'):
+            return None, None, None
+        etag = pagecache.page_etag(request, self.get_dependent_models())
+        response = get_conditional_response(request, etag=etag)
+        key = None
+        if response is None and pagecache.is_cacheable(request):
+            key = pagecache.page_key(request, self.get_dependent_models())
+            response = pagecache.get(key, request)
+        if response is not None:
+            response['ETag'] = etag
+            _mark_private(response)
+        return response, key, etag
+
+    async def get(self, request, *args, **kwargs):
+        context = await self.get_context_data_async(**kwargs)
+        return self.render_to_response(context)
+
+
+class AsyncPaginationMixin:
+    """
+    Paginate like ListView, but count the rows and fetch the requested
+    page at the same time.
+    """
+    paginate_by = None
+    page_kwarg = 'page'
+
+    async def paginate_async(self, queryset):
+        """Returns (paginator, page, is_paginated)."""
+        paginator = Paginator(queryset, self.paginate_by)
+        number = self.request.GET.get(self.page_kwarg) or 1
+        rows = None
+        if number == 'last':
+            paginator.count = await asyncdb.count(queryset)
+            number = paginator.num_pages
+        else:
+            try:
+                number = int(number)
+            except ValueError:
+                raise Http404("Page is not 'last', nor can it be converted to an int.")
+            offset = max(number - 1, 0) * self.paginate_by
+            paginator.count, rows = await asyncio.gather(
+                asyncdb.count(queryset),
+                asyncdb.fetch(queryset[offset:offset + self.paginate_by]))
+        try:
+            page = paginator.page(number)
+        except InvalidPage as error:
+            raise Http404('Invalid page (%s): %s' % (number, error))
+        page.object_list = rows if rows is not None else await asyncdb.fetch(page.object_list)
+        return paginator, page, page.has_other_pages()
+
+
 class PageLinksMixin:
     page_kwarg = 'page'
 
@@ -58,6 +315,7 @@ class PageLinksMixin:
             return self._page_urls(last_page)
         return None
 
+    @tracing.traced('PageLinksMixin.get_context_data')
     def get_context_data(self, **kwargs):
         context = super().get_context_data(
             **kwargs)
@@ -74,3 +332,27 @@ class PageLinksMixin:
                     self.last_page(page),
             })
         return context
+
+
+class StaffRequiredMixin(UserPassesTestMixin):
+    def test_func(self):
+        return self.request.user.is_staff
+
+
+class StaffOrScraperRequiredMixin(UserPassesTestMixin):
+    """
+    Staff, or a scraper sending COURSEINFO_METRICS_TOKEN as a bearer token
+    or connecting from one of COURSEINFO_METRICS_ALLOWED_ADDRESSES. The
+    address list is empty by default: behind a local reverse proxy every
+    request comes from 127.0.0.1.
+    """
+
+    def test_func(self):
+        token = getattr(settings, 'COURSEINFO_METRICS_TOKEN', None)
+        header = self.request.META.get('HTTP_AUTHORIZATION', '')
+        if token and header.startswith('Bearer ') and constant_time_compare(header[7:], token):
+            return True
+        addresses = getattr(settings, 'COURSEINFO_METRICS_ALLOWED_ADDRESSES', ())
+        if self.request.META.get('REMOTE_ADDR') in addresses:
+            return True
+        return self.request.user.is_staff
@@ -0,0 +1,123 @@
+"""
+Per-table version counters for the courseinfo models.
+
+Every write to a courseinfo table bumps that table's counter, so anything
+cached under the current versions of the tables it was built from is
+invalidated by simply no longer being looked up. Counters live in the
+COURSEINFO_VERSION_CACHE cache; use a cache shared by all workers (see
+settings/production.py) so that invalidation crosses processes.
+Bookkeeping tables in UNVERSIONED_MODELS, such as the job queue, are
+written too often to be worth caching and are left out.
+"""
+import time
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+
+APP_LABEL = 'courseinfo'
+KEY_PREFIX = 'courseinfo:table-version:'
+LAST_WRITE_KEY = 'courseinfo:last-write'
+UNVERSIONED_MODELS = frozenset({'job'})
+
+# the newest last-write time this process has seen, so the read replica
+# router can check a snapshot's freshness without a cache lookup
+_known_last_write = 0.0
+
+
+def _cache():
+    return caches[getattr(settings, 'COURSEINFO_VERSION_CACHE', 'default')]
+
+
+def _initial_version():
+    # time based, so a counter that was evicted does not restart at a value
+    # some stale entry was stored under
+    return int(time.time() * 1000)
+
+
+def _saw_write(when):
+    global _known_last_write
+    if when > _known_last_write:
+        _known_last_write = when
+
+
+def table_versions(tables):
+    """Return {table: version} for the given table names."""
+    cache = _cache()
+    keys = {KEY_PREFIX + table: table for table in tables}
+    found = cache.get_many([*keys, LAST_WRITE_KEY])
+    _saw_write(found.pop(LAST_WRITE_KEY, 0.0))
+    missing = {key: _initial_version() for key in keys if key not in found}
+    if missing:
+        for key, version in missing.items():
+            cache.add(key, version, timeout=None)
+        found.update(cache.get_many(missing))
+    return {keys[key]: version for key, version in found.items()}
+
+
+def table_version(table):
+    return table_versions([table])[table]
+
+
+def model_versions(models):
+    return table_versions([model._meta.db_table for model in models])
+
+
+def bump_table(table):
+    cache = _cache()
+    key = KEY_PREFIX + table
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, _initial_version(), timeout=None)
+    now = time.time()
+    cache.set(LAST_WRITE_KEY, now, timeout=None)
+    _saw_write(now)
+
+
+def last_write_time():
+    """When a courseinfo table was last written to, or 0.0 if unknown."""
+    when = _cache().get(LAST_WRITE_KEY, 0.0)
+    _saw_write(when)
+    return when
+
+
+def known_last_write():
+    """
+    The newest last_write_time() this process has seen, from its own writes
+    and from table_versions(), which fetches it along with the versions.
+    """
+    return _known_last_write
+
+
+def bump_model(model):
+    table = model._meta.db_table
+    bump_table(table)
+    # bump again once the write is visible to other connections, so a
+    # reader that cached the old rows in between is invalidated too
+    transaction.on_commit(lambda: bump_table(table))
+
+
+def is_versioned(model):
+    return (model._meta.app_label == APP_LABEL
+            and model._meta.model_name not in UNVERSIONED_MODELS)
+
+
+@lru_cache(maxsize=None)
+def tracked_tables():
+    from django.apps import apps
+    return frozenset(
+        model._meta.db_table for model in apps.get_app_config(APP_LABEL).get_models()
+        if is_versioned(model))
+
+
+def _model_changed(sender, **kwargs):
+    if is_versioned(sender):
+        bump_model(sender)
+
+
+def connect_signals():
+    post_save.connect(_model_changed, dispatch_uid='courseinfo_versions_post_save')
+    post_delete.connect(_model_changed, dispatch_uid='courseinfo_versions_post_delete')
@@ -1,11 +1,30 @@
-from django.contrib.auth.mixins import LoginRequiredMixin, PermissionRequiredMixin
+import asyncio
+
+from django.contrib.auth.mixins import LoginRequiredMixin
+from django.conf import settings
 from django.core.paginator import EmptyPage, Paginator, PageNotAnInteger
+from django.db.models import Count
+from django.http import FileResponse, Http404, HttpResponse
 from django.shortcuts import render, get_object_or_404, redirect
 from django.urls import reverse_lazy
+from django.utils.http import urlencode
 from django.views import View
 from django.views.generic import ListView, DetailView, UpdateView, DeleteView
-
-from courseinfo.utils import ObjectCreateMixin, PageLinksMixin
+from django.views.generic.base import ContextMixin, TemplateResponseMixin
+
+from courseinfo import asyncdb, instrumentation, jobs, metrics, profiling, rosters, slowlog
+from courseinfo.utils import (
+    AsyncPaginationMixin,
+    AsyncReadViewMixin,
+    CachedQuerysetMixin,
+    ConditionalGetMixin,
+    ObjectCreateMixin,
+    PageCacheMixin,
+    PageLinksMixin,
+    PermissionRequiredMixin,
+    StaffOrScraperRequiredMixin,
+    StaffRequiredMixin,
+    StreamingListMixin)
 from courseinfo.forms import InstructorForm, SectionForm, CourseForm, SemesterForm, RegistrationForm, StudentForm
 from courseinfo.models import (
     Instructor,
@@ -13,7 +32,10 @@ from courseinfo.models import (
     Course,
     Registration,
     Semester,
-    Student)
+    Student,
+    Period,
+    Year,
+    Job)
 
 
 # def instructor_list_view(request):
@@ -74,10 +96,11 @@ from courseinfo.models import (
 #             request, self.template_name, context)
 
 
-class InstructorList(LoginRequiredMixin, PermissionRequiredMixin, PageLinksMixin, ListView):
+class InstructorList(LoginRequiredMixin, PermissionRequiredMixin, CachedQuerysetMixin, ConditionalGetMixin, PageCacheMixin, StreamingListMixin, PageLinksMixin, ListView):
     paginate_by = 25
     model = Instructor
     permission_required = 'courseinfo.view_instructor'
+    dependent_models = [Instructor]
 
 
 # class InstructorDetail(View):
@@ -94,14 +117,15 @@ class InstructorList(LoginRequiredMixin, PermissionRequiredMixin, PageLinksMixin
 #             {'instructor': instructor, 'section_list': section_list}
 #         )
 
-class InstructorDetail(LoginRequiredMixin, PermissionRequiredMixin, DetailView):
+class InstructorDetail(LoginRequiredMixin, PermissionRequiredMixin, CachedQuerysetMixin, ConditionalGetMixin, PageCacheMixin, DetailView):
     model = Instructor
     permission_required = 'courseinfo.view_instructor'
+    dependent_models = [Instructor, Section, Course, Semester, Year, Period]
 
     def get_context_data(self, **kwargs):
         context = super(DetailView, self).get_context_data(**kwargs)
-        instructor = self.get_object()
-        section_list = instructor.sections.all()
+        instructor = self.object
+        section_list = instructor.sections.cached().select_related('course', 'semester')
         context['section_list'] = section_list
         return context
 
@@ -185,9 +209,12 @@ class InstructorDelete(LoginRequiredMixin, PermissionRequiredMixin, DeleteView):
 #             {'section_list': Section.objects.all()}
 #         )
 
-class SectionList(LoginRequiredMixin, PermissionRequiredMixin, ListView):
+class SectionList(LoginRequiredMixin, PermissionRequiredMixin, CachedQuerysetMixin, ConditionalGetMixin, PageCacheMixin, StreamingListMixin, ListView):
     model = Section
     permission_required = 'courseinfo.view_section'
+    dependent_models = [Section, Course, Semester, Year, Period]
+    stream_select_related = ('course', 'semester')
+    queryset = Section.objects.select_related(*stream_select_related)
 
 
 # class SectionDetail(View):
@@ -210,17 +237,19 @@ class SectionList(LoginRequiredMixin, PermissionRequiredMixin, ListView):
 #              'instructor': instructor,
 #              'registration_list': registration_list}
 #         )
-class SectionDetail(LoginRequiredMixin, PermissionRequiredMixin, DetailView):
+class SectionDetail(LoginRequiredMixin, PermissionRequiredMixin, CachedQuerysetMixin, ConditionalGetMixin, PageCacheMixin, DetailView):
     model = Section
     permission_required = 'courseinfo.view_section'
+    dependent_models = [Section, Course, Semester, Year, Period, Instructor, Registration, Student]
+    queryset = Section.objects.select_related('semester', 'course', 'instructor')
 
     def get_context_data(self, **kwargs):
         context = super(DetailView, self).get_context_data(**kwargs)
-        section = self.get_object()
+        section = self.object
         semester = section.semester
         course = section.course
         instructor = section.instructor
-        registration_list = section.registrations.all()
+        registration_list = section.registrations.cached().select_related('student')
         context['semester'] = semester
         context['course'] = course
         context['instructor'] = instructor
@@ -343,19 +372,21 @@ class SectionDelete(LoginRequiredMixin, PermissionRequiredMixin, DeleteView):
 #             {'course_list': Course.objects.all()}
 #         )
 
-class CourseList(LoginRequiredMixin, PermissionRequiredMixin, ListView):
+class CourseList(LoginRequiredMixin, PermissionRequiredMixin, CachedQuerysetMixin, ConditionalGetMixin, PageCacheMixin, StreamingListMixin, ListView):
     model = Course
     permission_required = 'courseinfo.view_course'
+    dependent_models = [Course]
 
 
-class CourseDetail(LoginRequiredMixin, PermissionRequiredMixin, DetailView):
+class CourseDetail(LoginRequiredMixin, PermissionRequiredMixin, CachedQuerysetMixin, ConditionalGetMixin, PageCacheMixin, DetailView):
     model = Course
     permission_required = 'courseinfo.view_course'
+    dependent_models = [Course, Section, Semester, Year, Period]
 
     def get_context_data(self, **kwargs):
         context = super(DetailView, self).get_context_data(**kwargs)
-        course = self.get_object()
-        section_list = course.sections.all()
+        course = self.object
+        section_list = course.sections.cached().select_related('course', 'semester')
         context['section_list'] = section_list
         return context
 
@@ -478,9 +509,12 @@ class CourseDelete(LoginRequiredMixin, PermissionRequiredMixin, DeleteView):
 #         )
 
 
-class RegistrationList(LoginRequiredMixin, PermissionRequiredMixin, ListView):
+class RegistrationList(LoginRequiredMixin, PermissionRequiredMixin, CachedQuerysetMixin, ConditionalGetMixin, PageCacheMixin, StreamingListMixin, ListView):
     model = Registration
     permission_required = 'courseinfo.view_registration'
+    dependent_models = [Registration, Section, Course, Semester, Year, Period, Student]
+    stream_select_related = ('section__course', 'section__semester', 'student')
+    queryset = Registration.objects.select_related(*stream_select_related)
 
 
 # class RegistrationDetail(View):
@@ -500,13 +534,15 @@ class RegistrationList(LoginRequiredMixin, PermissionRequiredMixin, ListView):
 #              'registration': registration}
 #         )
 
-class RegistrationDetail(LoginRequiredMixin, PermissionRequiredMixin, DetailView):
+class RegistrationDetail(LoginRequiredMixin, PermissionRequiredMixin, CachedQuerysetMixin, ConditionalGetMixin, PageCacheMixin, DetailView):
     model = Registration
     permission_required = 'courseinfo.view_registration'
+    dependent_models = [Registration, Section, Course, Semester, Year, Period, Student]
+    queryset = Registration.objects.select_related('section__course', 'section__semester', 'student')
 
     def get_context_data(self, **kwargs):
         context = super(DetailView, self).get_context_data(**kwargs)
-        registration = self.get_object()
+        registration = self.object
         section = registration.section
         student = registration.student
         context['section'] = section
@@ -603,9 +639,10 @@ class RegistrationDelete(LoginRequiredMixin, PermissionRequiredMixin, DeleteView
 #             'courseInfo/semester_list.html',
 #             {'semester_list': Semester.objects.all()}
 #         )
-class SemesterList(LoginRequiredMixin, PermissionRequiredMixin, ListView):
+class SemesterList(LoginRequiredMixin, PermissionRequiredMixin, CachedQuerysetMixin, ConditionalGetMixin, PageCacheMixin, StreamingListMixin, ListView):
     model = Semester
     permission_required = 'courseinfo.view_semester'
+    dependent_models = [Semester, Year, Period]
 
 
 # class SemesterDetail(View):
@@ -620,14 +657,15 @@ class SemesterList(LoginRequiredMixin, PermissionRequiredMixin, ListView):
 #             request,
 #             'courseinfo/semester_detail.html',
 #             {'semester': semester, 'section_list': section_list})
-class SemesterDetail(LoginRequiredMixin, PermissionRequiredMixin, DetailView):
+class SemesterDetail(LoginRequiredMixin, PermissionRequiredMixin, CachedQuerysetMixin, ConditionalGetMixin, PageCacheMixin, DetailView):
     model = Semester
     permission_required = 'courseinfo.view_semester'
+    dependent_models = [Semester, Year, Period, Section, Course]
 
     def get_context_data(self, **kwargs):
         context = super(DetailView, self).get_context_data(**kwargs)
-        semester = self.get_object()
-        section_list = semester.sections.all()
+        semester = self.object
+        section_list = semester.sections.cached().select_related('course', 'semester')
         context['section_list'] = section_list
         return context
 
@@ -786,10 +824,11 @@ class SemesterDelete(LoginRequiredMixin, PermissionRequiredMixin, DeleteView):
 #         }
 #         return render(
 #             request, self.template_name, context)
-class StudentList(LoginRequiredMixin, PermissionRequiredMixin, ListView):
+class StudentList(LoginRequiredMixin, PermissionRequiredMixin, CachedQuerysetMixin, ConditionalGetMixin, PageCacheMixin, StreamingListMixin, ListView):
     paginate_by = 25
     model = Student
     permission_required = 'courseinfo.view_student'
+    dependent_models = [Student]
 
 
 # class StudentDetail(View):
@@ -805,14 +844,16 @@ class StudentList(LoginRequiredMixin, PermissionRequiredMixin, ListView):
 #             'courseinfo/student_detail.html',
 #             {'student': student, 'registration_list': registration_list}
 #         )
-class StudentDetail(LoginRequiredMixin, PermissionRequiredMixin, DetailView):
+class StudentDetail(LoginRequiredMixin, PermissionRequiredMixin, CachedQuerysetMixin, ConditionalGetMixin, PageCacheMixin, DetailView):
     model = Student
     permission_required = 'courseinfo.view_student'
+    dependent_models = [Student, Registration, Section, Course, Semester, Year, Period]
 
     def get_context_data(self, **kwargs):
         context = super(DetailView, self).get_context_data(**kwargs)
-        student = self.get_object()
-        registration_list = student.registrations.all()
+        student = self.object
+        registration_list = student.registrations.cached().select_related(
+            'section__course', 'section__semester')
         context['registration_list'] = registration_list
         return context
 
@@ -917,3 +958,286 @@ class StudentDelete(LoginRequiredMixin, PermissionRequiredMixin, DeleteView):
 
 def redirect_root_view(request):
     return redirect('courseinfo_section_list_urlpattern')
+
+
+class MetricsView(StaffOrScraperRequiredMixin, View):
+    content_type = 'text/plain; version=0.0.4; charset=utf-8'
+
+    def get(self, request):
+        directory = getattr(settings, 'COURSEINFO_METRICS_DIR', None)
+        if not directory:
+            return HttpResponse(
+                metrics.render(metrics.registry.snapshot()),
+                content_type=self.content_type)
+        metrics.registry.dump(directory)
+        snapshots = metrics.load_worker_snapshots(directory)
+        if request.GET.get('per_worker'):
+            body = metrics.render(metrics.label_snapshots(snapshots))
+        else:
+            body = metrics.render(metrics.merge_snapshots(snapshots.values()))
+        return HttpResponse(body, content_type=self.content_type)
+
+
+class SlowQueryList(StaffRequiredMixin, View):
+    template_name = 'courseinfo/slow_query_list.html'
+
+    def get(self, request):
+        return render(
+            request,
+            self.template_name,
+            {'slow_query_list': slowlog.slow_queries.top(),
+             'threshold': getattr(settings, 'COURSEINFO_SLOW_QUERY_THRESHOLD', None)})
+
+
+class ProfileList(StaffRequiredMixin, View):
+    template_name = 'courseinfo/profile_list.html'
+
+    def get(self, request):
+        return render(
+            request,
+            self.template_name,
+            {'profile_list': profiling.profile_store().list()})
+
+
+class ProfileDownload(StaffRequiredMixin, View):
+    def get(self, request, filename):
+        path = profiling.profile_store().path(filename)
+        if path is None:
+            raise Http404('No such profile.')
+        return FileResponse(open(path, 'rb'), as_attachment=True, filename=filename)
+
+
+class TemplateTimingReport(StaffRequiredMixin, View):
+    template_name = 'courseinfo/template_timing_report.html'
+
+    def get(self, request):
+        return render(
+            request,
+            self.template_name,
+            {'template_list': instrumentation.render_report.slowest()})
+
+
+class MemoryReportList(StaffRequiredMixin, View):
+    template_name = 'courseinfo/memory_report_list.html'
+
+    def get(self, request):
+        return render(
+            request,
+            self.template_name,
+            {'memory_report_list': list(profiling.memory_reports)})
+
+
+class JobList(StaffRequiredMixin, PageLinksMixin, ListView):
+    model = Job
+    paginate_by = 25
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        status = self.request.GET.get('status')
+        if status in dict(Job.STATUS_CHOICES):
+            queryset = queryset.filter(status=status)
+        return queryset
+
+    def _page_urls(self, page_number):
+        url = super()._page_urls(page_number)
+        if self.request.GET.get('status'):
+            url += '&' + urlencode({'status': self.request.GET['status']})
+        return url
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        counts = dict(Job.objects.order_by().values_list('status').annotate(Count('pk')))
+        context['status_counts'] = [
+            (status, label, counts.get(status, 0)) for status, label in Job.STATUS_CHOICES]
+        return context
+
+
+class JobDetail(StaffRequiredMixin, DetailView):
+    model = Job
+
+
+class JobRetry(StaffRequiredMixin, View):
+    def post(self, request, pk):
+        job = get_object_or_404(Job, pk=pk)
+        jobs.retry(job)
+        return redirect(job)
+
+
+class RosterDownload(StaffRequiredMixin, View):
+    def get(self, request, filename):
+        path = rosters.archive_path(filename)
+        if path is None:
+            raise Http404('No such roster archive.')
+        return FileResponse(open(path, 'rb'), as_attachment=True, filename=filename)
+
+
+# Async variants of the list and detail views, routed instead of them when
+# COURSEINFO_ASYNC_VIEWS is set (see urls.py). They show the same pages
+# with the same queries, joining in the same related objects, but each
+# page's independent queries run concurrently (see courseinfo.asyncdb).
+
+class AsyncObjectList(AsyncReadViewMixin, AsyncPaginationMixin, TemplateResponseMixin,
+                      ContextMixin, View):
+    model = None
+    select_related = ()
+
+    def get_template_names(self):
+        return ['courseinfo/%s_list.html' % self.model._meta.model_name]
+
+    async def get_context_data_async(self, **kwargs):
+        queryset = self.model.objects.cached().select_related(*self.select_related)
+        if self.paginate_by:
+            paginator, page, is_paginated = await self.paginate_async(queryset)
+            object_list = page.object_list
+        else:
+            paginator, page, is_paginated = None, None, False
+            object_list = await asyncdb.fetch(queryset)
+        return self.get_context_data(**{
+            'paginator': paginator,
+            'page_obj': page,
+            'is_paginated': is_paginated,
+            'object_list': object_list,
+            '%s_list' % self.model._meta.model_name: object_list,
+        })
+
+
+class AsyncObjectDetail(AsyncReadViewMixin, TemplateResponseMixin, ContextMixin, View):
+    model = None
+    select_related = ()
+
+    def get_template_names(self):
+        return ['courseinfo/%s_detail.html' % self.model._meta.model_name]
+
+    def get_object_async(self, pk):
+        queryset = self.model.objects.cached().select_related(*self.select_related)
+        return asyncdb.get_object_or_404(queryset, pk=pk)
+
+    def get_context_data(self, **kwargs):
+        obj = kwargs['object']
+        kwargs.setdefault(obj._meta.model_name, obj)
+        return super().get_context_data(**kwargs)
+
+
+class AsyncInstructorList(PageLinksMixin, AsyncObjectList):
+    model = Instructor
+    paginate_by = InstructorList.paginate_by
+    permission_required = InstructorList.permission_required
+    dependent_models = InstructorList.dependent_models
+
+
+class AsyncInstructorDetail(AsyncObjectDetail):
+    model = Instructor
+    permission_required = InstructorDetail.permission_required
+    dependent_models = InstructorDetail.dependent_models
+
+    async def get_context_data_async(self, pk):
+        instructor, section_list = await asyncio.gather(
+            self.get_object_async(pk),
+            asyncdb.fetch(Section.objects.cached().filter(instructor_id=pk)
+                          .select_related('course', 'semester')))
+        return self.get_context_data(object=instructor, section_list=section_list)
+
+
+class AsyncSectionList(AsyncObjectList):
+    model = Section
+    permission_required = SectionList.permission_required
+    dependent_models = SectionList.dependent_models
+    select_related = SectionList.stream_select_related
+
+
+class AsyncSectionDetail(AsyncObjectDetail):
+    model = Section
+    permission_required = SectionDetail.permission_required
+    dependent_models = SectionDetail.dependent_models
+    select_related = ('semester', 'course', 'instructor')
+
+    async def get_context_data_async(self, pk):
+        section, registration_list = await asyncio.gather(
+            self.get_object_async(pk),
+            asyncdb.fetch(Registration.objects.cached().filter(section_id=pk)
+                          .select_related('student')))
+        return self.get_context_data(
+            object=section,
+            semester=section.semester,
+            course=section.course,
+            instructor=section.instructor,
+            registration_list=registration_list)
+
+
+class AsyncCourseList(AsyncObjectList):
+    model = Course
+    permission_required = CourseList.permission_required
+    dependent_models = CourseList.dependent_models
+
+
+class AsyncCourseDetail(AsyncObjectDetail):
+    model = Course
+    permission_required = CourseDetail.permission_required
+    dependent_models = CourseDetail.dependent_models
+
+    async def get_context_data_async(self, pk):
+        course, section_list = await asyncio.gather(
+            self.get_object_async(pk),
+            asyncdb.fetch(Section.objects.cached().filter(course_id=pk)
+                          .select_related('course', 'semester')))
+        return self.get_context_data(object=course, section_list=section_list)
+
+
+class AsyncRegistrationList(AsyncObjectList):
+    model = Registration
+    permission_required = RegistrationList.permission_required
+    dependent_models = RegistrationList.dependent_models
+    select_related = RegistrationList.stream_select_related
+
+
+class AsyncRegistrationDetail(AsyncObjectDetail):
+    model = Registration
+    permission_required = RegistrationDetail.permission_required
+    dependent_models = RegistrationDetail.dependent_models
+    select_related = ('section__course', 'section__semester', 'student')
+
+    async def get_context_data_async(self, pk):
+        registration = await self.get_object_async(pk)
+        return self.get_context_data(
+            object=registration,
+            section=registration.section,
+            student=registration.student)
+
+
+class AsyncSemesterList(AsyncObjectList):
+    model = Semester
+    permission_required = SemesterList.permission_required
+    dependent_models = SemesterList.dependent_models
+
+
+class AsyncSemesterDetail(AsyncObjectDetail):
+    model = Semester
+    permission_required = SemesterDetail.permission_required
+    dependent_models = SemesterDetail.dependent_models
+
+    async def get_context_data_async(self, pk):
+        semester, section_list = await asyncio.gather(
+            self.get_object_async(pk),
+            asyncdb.fetch(Section.objects.cached().filter(semester_id=pk)
+                          .select_related('course', 'semester')))
+        return self.get_context_data(object=semester, section_list=section_list)
+
+
+class AsyncStudentList(AsyncObjectList):
+    model = Student
+    paginate_by = StudentList.paginate_by
+    permission_required = StudentList.permission_required
+    dependent_models = StudentList.dependent_models
+
+
+class AsyncStudentDetail(AsyncObjectDetail):
+    model = Student
+    permission_required = StudentDetail.permission_required
+    dependent_models = StudentDetail.dependent_models
+
+    async def get_context_data_async(self, pk):
+        student, registration_list = await asyncio.gather(
+            self.get_object_async(pk),
+            asyncdb.fetch(Registration.objects.cached().filter(student_id=pk)
+                          .select_related('section__course', 'section__semester')))
+        return self.get_context_data(object=student, registration_list=registration_list)
@@ -14,3 +14,9 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'zhong_haocheng_ezu.settings')
 
 application = get_asgi_application()
+
+from courseinfo.profiling import start_background_sampler  # noqa: E402
+from courseinfo.replica import start_refresher  # noqa: E402
+
+start_background_sampler()
+start_refresher()
@@ -43,13 +43,24 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'courseinfo.middleware.MetricsMiddleware',
+    'courseinfo.middleware.RequestContextMiddleware',
+    'courseinfo.middleware.IdentityMapMiddleware',
+    'courseinfo.middleware.TracingMiddleware',
+    'courseinfo.middleware.SamplingMiddleware',
+    'courseinfo.middleware.ServerTimingMiddleware',
+    'courseinfo.middleware.StatementDeadlineMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'courseinfo.middleware.ProfilerMiddleware',
+    'courseinfo.middleware.MemoryProfileMiddleware',
+    'courseinfo.middleware.TemplateTimingMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'courseinfo.middleware.ServerTimingResolveMiddleware',
 ]
 
 ROOT_URLCONF = 'zhong_haocheng_ezu.urls'
@@ -65,6 +76,7 @@ TEMPLATES = [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
+                'courseinfo.context_processors.navigation',
             ],
         },
     },
@@ -83,6 +95,26 @@ DATABASES = {
     }
 }
 
+# PRAGMAs run on every new SQLite connection (see courseinfo.sqlite).
+COURSEINFO_SQLITE_PRAGMAS = {}
+
+# Statements still running this many seconds into a request are aborted
+# and the request answered with a 503 (see courseinfo.deadlines). Views can
+# set their own `statement_timeout`; None means no deadline.
+COURSEINFO_STATEMENT_TIMEOUT = 10.0
+COURSEINFO_STATEMENT_RETRY_AFTER = 5
+
+
+# Cache
+# https://docs.djangoproject.com/en/4.1/topics/cache/
+
+CACHES = {
+    'default': {
+        'BACKEND': 'courseinfo.cache.LocMemCache',
+        'LOCATION': 'courseinfo-default',
+    }
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.1/ref/settings/#auth-password-validators
@@ -103,6 +135,15 @@ AUTH_PASSWORD_VALIDATORS = [
 ]
 
 
+AUTHENTICATION_BACKENDS = [
+    'courseinfo.backends.CachedModelBackend',
+]
+
+# Resolved user and group permission sets are kept in this cache.
+COURSEINFO_PERMISSION_CACHE = 'default'
+COURSEINFO_PERMISSION_CACHE_TIMEOUT = 3600
+
+
 # Internationalization
 # https://docs.djangoproject.com/en/4.1/topics/i18n/
 
@@ -132,3 +173,115 @@ LOGOUT_REDIRECT_URL = 'login_urlpattern'
 LOGIN_URL = reverse_lazy('login_urlpattern')
 
 SESSION_EXPIRE_AT_BROWSER_CLOSE = True
+# write-through: reads come from the cache, the table is only written to;
+# purge expired rows with `manage.py purge_sessions`
+SESSION_ENGINE = 'django.contrib.sessions.backends.cached_db'
+SESSION_CACHE_ALIAS = 'default'
+
+
+# Metrics
+# Set COURSEINFO_METRICS_DIR to a directory shared by all workers to have
+# /metrics merge the per-worker snapshots dumped there. /metrics is open to
+# staff, to scrapers sending "Authorization: Bearer <COURSEINFO_METRICS_TOKEN>"
+# and to the COURSEINFO_METRICS_ALLOWED_ADDRESSES (only list addresses that
+# are not shared with a reverse proxy).
+
+COURSEINFO_METRICS_DIR = None
+COURSEINFO_METRICS_DUMP_INTERVAL = 5.0
+COURSEINFO_METRICS_TOKEN = None
+COURSEINFO_METRICS_ALLOWED_ADDRESSES = ()
+
+
+# Debugging
+# Staff users, or anyone sending a token from `manage.py debug_token
+# <feature>` in the X-Courseinfo-Debug header or the _debug query
+# parameter, can turn on per-request debugging features.
+
+COURSEINFO_DEBUG_TOKEN_MAX_AGE = 3600
+COURSEINFO_SERVER_TIMING_FOR_STAFF = True
+
+# Time every template and block render for the /debug/templates report.
+# When False only staff and 'template-timing' token requests are timed.
+COURSEINFO_TEMPLATE_TIMING = False
+
+# Staff requests carrying a 'profile' token are profiled into this
+# directory, which keeps the newest COURSEINFO_PROFILE_MAX_FILES profiles.
+COURSEINFO_PROFILE_DIR = BASE_DIR / '../var/profiles'
+COURSEINFO_PROFILE_MAX_FILES = 50
+COURSEINFO_PROFILE_SAMPLE_INTERVAL = 0.001
+
+# Always-on sampling profiler started by wsgi.py/asgi.py. Each worker
+# rewrites COURSEINFO_SAMPLER_DIR/samples-<pid>.folded with collapsed stacks
+# per URL name every COURSEINFO_SAMPLER_FLUSH_INTERVAL seconds.
+COURSEINFO_SAMPLER_ENABLED = False
+COURSEINFO_SAMPLER_HZ = 100
+COURSEINFO_SAMPLER_DIR = BASE_DIR / '../var/samples'
+COURSEINFO_SAMPLER_FLUSH_INTERVAL = 60
+
+
+# Slow query log
+# Statements on the default database slower than the threshold (seconds)
+# are logged and kept in a top-N table at /debug/slow-queries. Set the
+# threshold to None to turn the log off.
+
+COURSEINFO_SLOW_QUERY_THRESHOLD = 0.1
+COURSEINFO_SLOW_QUERY_TOP_N = 50
+COURSEINFO_SLOW_QUERY_EXPLAIN_INTERVAL = 60
+
+
+# Tracing
+# A sampled fraction of requests (plus any with a 'trace' debug token) is
+# traced and appended as OTLP/JSON lines to size-rotated files.
+
+COURSEINFO_TRACE_SAMPLE_RATE = 0.0
+COURSEINFO_TRACE_DIR = BASE_DIR / '../var/traces'
+COURSEINFO_TRACE_MAX_BYTES = 10 * 1024 * 1024
+COURSEINFO_TRACE_BACKUP_COUNT = 5
+
+
+# Query-result cache
+# Querysets opted in with .cached() (or views using CachedQuerysetMixin)
+# keep their results in a per-worker LRU of at most
+# COURSEINFO_QUERY_CACHE_MAX_BYTES, invalidated through per-table version
+# counters stored in the COURSEINFO_VERSION_CACHE cache.
+
+COURSEINFO_VERSION_CACHE = 'default'
+COURSEINFO_QUERY_CACHE_MAX_BYTES = 16 * 1024 * 1024
+
+
+# Page cache
+# List and detail pages are cached for COURSEINFO_PAGE_CACHE_TIMEOUT
+# seconds per permission set and invalidated with the query-result cache's
+# table versions. Set the timeout to 0 to turn the page cache off.
+
+COURSEINFO_PAGE_CACHE = 'default'
+COURSEINFO_PAGE_CACHE_TIMEOUT = 300
+
+
+# Reference data
+# Period and Year are cached whole in every worker; edits made elsewhere
+# are noticed within COURSEINFO_REFDATA_CHECK_INTERVAL seconds.
+
+COURSEINFO_REFDATA_CHECK_INTERVAL = 1.0
+
+
+# Async views
+# Serve the list and detail pages with async views that run each page's
+# independent queries concurrently. Only worth it under ASGI (asgi.py);
+# under WSGI every async view costs an extra event loop per request.
+# Their queries run on a pool of COURSEINFO_ASYNC_DB_THREADS threads.
+
+COURSEINFO_ASYNC_VIEWS = False
+COURSEINFO_ASYNC_DB_THREADS = 16
+
+
+# Background jobs
+# Queued in the courseinfo Job table and run by `manage.py runjobs`; tasks
+# are registered in the COURSEINFO_JOB_TASK_MODULES. Failed jobs are retried
+# after COURSEINFO_JOB_RETRY_DELAY seconds, doubling each attempt.
+
+COURSEINFO_JOB_TASK_MODULES = ['courseinfo.tasks']
+COURSEINFO_JOB_RETRY_DELAY = 10.0
+COURSEINFO_JOB_STALE_SECONDS = 600.0
+COURSEINFO_JOB_KEEP_DAYS = 30
+COURSEINFO_ROSTER_DIR = BASE_DIR / '../var/rosters'
@@ -2,4 +2,49 @@ from .base import *
 
 DEBUG = False
 
-ALLOWED_HOSTS = ['localhost', '127.0.0.1', 'hzhong1.pythonanywhere.com']
\ No newline at end of file
+ALLOWED_HOSTS = ['localhost', '127.0.0.1', 'hzhong1.pythonanywhere.com']
+
+from courseinfo.sqlite import RECOMMENDED_PRAGMAS  # noqa: E402
+
+DATABASES['default'].update({
+    'CONN_MAX_AGE': 600,
+    'CONN_HEALTH_CHECKS': True,
+})
+COURSEINFO_SQLITE_PRAGMAS = RECOMMENDED_PRAGMAS
+
+# Read replica: a snapshot of the primary copied with the SQLite backup
+# API and opened read-only, kept fresh by a thread in each worker (see
+# courseinfo.replica).
+COURSEINFO_REPLICA_PATH = BASE_DIR / '../var/replica/db.sqlite3'
+COURSEINFO_REPLICA_POLL_INTERVAL = 1.0
+COURSEINFO_REPLICA_REFRESH_INTERVAL = 5.0
+COURSEINFO_REPLICA_MAX_LAG = 30.0
+COURSEINFO_REPLICA_STICKY_SECONDS = 15.0
+
+DATABASES['replica'] = {
+    'ENGINE': 'django.db.backends.sqlite3',
+    'NAME': 'file:%s?mode=ro' % COURSEINFO_REPLICA_PATH,
+    'OPTIONS': {'uri': True},
+    'CONN_MAX_AGE': 0,
+    'TEST': {'MIRROR': 'default'},
+}
+DATABASE_ROUTERS = ['courseinfo.replica.ReplicaRouter']
+MIDDLEWARE.insert(
+    MIDDLEWARE.index('django.contrib.sessions.middleware.SessionMiddleware') + 1,
+    'courseinfo.middleware.ReplicaStickinessMiddleware')
+
+COURSEINFO_METRICS_DIR = BASE_DIR / '../var/metrics'
+COURSEINFO_METRICS_TOKEN = os.environ.get('COURSEINFO_METRICS_TOKEN')
+COURSEINFO_SAMPLER_ENABLED = True
+COURSEINFO_TRACE_SAMPLE_RATE = 0.01
+
+# table versions, permission sets and sessions must be shared by all
+# workers
+CACHES['shared'] = {
+    'BACKEND': 'courseinfo.cache.FileBasedCache',
+    'LOCATION': str(BASE_DIR / '../var/cache/shared'),
+    'METRICS_LABEL': 'shared',
+}
+COURSEINFO_VERSION_CACHE = 'shared'
+COURSEINFO_PERMISSION_CACHE = 'shared'
+SESSION_CACHE_ALIAS = 'shared'